@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 ##
-## OpenLDAP: Report data size in Berkeley DB
+## OpenLDAP: Report data size in Berkeley DB and LMDB
 ##
 ## SPDX-FileCopyrightText: 2015-2025 SATOH Fumiyasu @ OSSTech Corp., Japan
 ## SPDX-License-Identifier: GPL-3.0-or-later
@@ -10,7 +10,21 @@
 import os
 import sys
 import re
+import glob
+import shlex
+import base64
 import subprocess
+import mmap
+import struct
+import argparse
+import json
+import sqlite3
+import time
+import threading
+import concurrent.futures
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from slapdstatslog2json import index_type_by_match  # noqa: E402
 
 
 ## Convert Bytes to MiB string
@@ -28,6 +42,22 @@ def format_sizes(label, size, free, decimal_places=3):
 """
 
 
+def format_mdb_stats(stats, decimal_places=3):
+    psize = stats['page_size']
+    headroom = stats['map_size'] - stats['size']
+    out = f"""\
+  Map: {stats['map_size']} ({format_b_as_mib(stats['map_size'], decimal_places)} MiB)
+  Headroom: {headroom} ({format_b_as_mib(headroom, decimal_places)} MiB)
+"""
+    for name, db in stats['databases'].items():
+        out += (
+            f"  {name}: {db['pages']} pages ({format_b_as_mib(db['pages'] * psize, decimal_places)} MiB), "
+            f"{db['overflow_pages']} overflow, {db['entries']} entries\n"
+        )
+
+    return out
+
+
 DB_STAT_PATH = os.environ.get('DB_SIZE_DB_STAT', '@SBINDIR@/slapd_db_stat')
 DB_STATS_PAGE_SIZE_RE = re.compile(r'^(\d+)(M?)\tUnderlying database page size$', re.MULTILINE)
 DB_STATS_USED_PAGES_RE = re.compile(r'^(\d+)(M?)\tNumber of tree (\w+) pages$', re.MULTILINE)
@@ -61,25 +91,886 @@ def db_sizes(db_file):
             v *= 1000000
         db_free += v
 
-    return db_size, db_free
+    return db_size, db_free, page_size
+
+
+## LMDB on-disk format (64-bit little-endian). See libraries/liblmdb/mdb.c
+MDB_MAGIC = 0xBEEFC0DE
+## MDB_page header: mp_pgno, mp_pad, mp_flags, mp_lower, mp_upper (or mp_pages)
+MDB_PAGE_HEADER = struct.Struct('<QHHHH')
+MDB_PAGE_HEADER_SIZE = MDB_PAGE_HEADER.size
+## MDB_db: md_pad, md_flags, md_depth, md_branch_pages, md_leaf_pages,
+## md_overflow_pages, md_entries, md_root
+MDB_DB = struct.Struct('<IHHQQQQQ')
+## MDB_meta: mm_magic, mm_version, mm_address, mm_mapsize,
+## mm_dbs[FREE_DBI], mm_dbs[MAIN_DBI], mm_last_pg, mm_txnid
+MDB_META = struct.Struct('<IIQQ48s48sQQ')
+## MDB_node: mn_lo, mn_hi, mn_flags, mn_ksize
+MDB_NODE = struct.Struct('<HHHH')
+MDB_NODE_SIZE = MDB_NODE.size
+MDB_PGNO = struct.Struct('<Q')
+
+P_BRANCH = 0x01
+P_LEAF = 0x02
+P_META = 0x08
+F_BIGDATA = 0x01
+F_SUBDATA = 0x02
+P_INVALID = 0xFFFFFFFFFFFFFFFF
+
+
+def is_mdb(db_file):
+    with open(db_file, 'rb') as f:
+        header = f.read(MDB_PAGE_HEADER_SIZE + 4)
+
+    return len(header) == MDB_PAGE_HEADER_SIZE + 4 and struct.unpack_from('<I', header, MDB_PAGE_HEADER_SIZE)[0] == MDB_MAGIC
+
+
+def mdb_db(data):
+    """Convert a packed MDB_db into a dict"""
+
+    _, flags, depth, branch_pages, leaf_pages, overflow_pages, entries, root = MDB_DB.unpack(data)
+
+    return {
+        'flags': flags,
+        'depth': depth,
+        'branch_pages': branch_pages,
+        'leaf_pages': leaf_pages,
+        'overflow_pages': overflow_pages,
+        'pages': branch_pages + leaf_pages + overflow_pages,
+        'entries': entries,
+        'root': root,
+    }
+
+
+def mdb_meta(buf, offset):
+    """Read a meta page or return None if invalid"""
+
+    _, _, flags, _, _ = MDB_PAGE_HEADER.unpack_from(buf, offset)
+    magic, version, _, map_size, free_db, main_db, last_pgno, txnid = MDB_META.unpack_from(buf, offset + MDB_PAGE_HEADER_SIZE)
+    if not flags & P_META or magic != MDB_MAGIC:
+        return None
+
+    return {
+        'version': version,
+        ## mm_psize is stored in md_pad of the free DB
+        'page_size': struct.unpack_from('<I', free_db)[0],
+        'map_size': map_size,
+        'free_db': mdb_db(free_db),
+        'main_db': mdb_db(main_db),
+        'last_pgno': last_pgno,
+        'txnid': txnid,
+    }
+
+
+def mdb_metas(buf):
+    """Return the valid meta pages (0 and 1) sorted by txnid in descending order"""
+
+    meta0 = mdb_meta(buf, 0)
+    if meta0 is None:
+        raise ValueError('No valid LMDB meta page')
+    metas = [meta0]
+    if len(buf) >= meta0['page_size'] * 2:
+        meta1 = mdb_meta(buf, meta0['page_size'])
+        if meta1 is not None:
+            metas.append(meta1)
+
+    return sorted(metas, key=lambda meta: meta['txnid'], reverse=True)
+
+
+def mdb_leaf_nodes(buf, page_size, root, last_pgno):
+    """Yield (flags, key, data offset) of leaf nodes in a B-tree"""
+
+    if root == P_INVALID:
+        return
+
+    pgnos = [root]
+    while pgnos:
+        pgno = pgnos.pop()
+        if pgno > last_pgno:
+            raise ValueError(f'Page number out of range: {pgno}')
+        offset = pgno * page_size
+        mp_pgno, _, flags, lower, _ = MDB_PAGE_HEADER.unpack_from(buf, offset)
+        if mp_pgno != pgno:
+            raise ValueError(f'Page number mismatch: {mp_pgno} in page {pgno}')
+        ptrs = struct.unpack_from(f'<{(lower - MDB_PAGE_HEADER_SIZE) >> 1}H', buf, offset + MDB_PAGE_HEADER_SIZE)
+        if flags & P_BRANCH:
+            for ptr in reversed(ptrs):
+                lo, hi, pgno_hi, _ = MDB_NODE.unpack_from(buf, offset + ptr)
+                pgnos.append(lo | hi << 16 | pgno_hi << 32)
+        elif flags & P_LEAF:
+            for ptr in ptrs:
+                _, _, node_flags, ksize = MDB_NODE.unpack_from(buf, offset + ptr)
+                key_offset = offset + ptr + MDB_NODE_SIZE
+                yield node_flags, buf[key_offset:key_offset + ksize], key_offset + ksize
+        else:
+            raise ValueError(f'Unexpected page flags: 0x{flags:x} in page {pgno}')
+
+
+def mdb_stats_from_meta(buf, meta):
+    page_size = meta['page_size']
+    last_pgno = meta['last_pgno']
+
+    databases = {}
+    for node_flags, key, data_offset in mdb_leaf_nodes(buf, page_size, meta['main_db']['root'], last_pgno):
+        if node_flags & F_SUBDATA:
+            databases[key.decode('utf-8', 'replace')] = mdb_db(buf[data_offset:data_offset + MDB_DB.size])
+
+    free_pages = 0
+    for node_flags, _, data_offset in mdb_leaf_nodes(buf, page_size, meta['free_db']['root'], last_pgno):
+        ## The data is an IDL of freed page numbers with the count at first
+        if node_flags & F_BIGDATA:
+            data_offset = MDB_PGNO.unpack_from(buf, data_offset)[0] * page_size + MDB_PAGE_HEADER_SIZE
+        free_pages += MDB_PGNO.unpack_from(buf, data_offset)[0]
+
+    return {
+        'page_size': page_size,
+        'map_size': meta['map_size'],
+        'txnid': meta['txnid'],
+        'last_pgno': last_pgno,
+        'size': (last_pgno + 1) * page_size,
+        'free_pages': free_pages,
+        'free': free_pages * page_size,
+        'databases': {
+            '@main': meta['main_db'],
+            '@free': meta['free_db'],
+            **dict(sorted(databases.items())),
+        },
+    }
+
+
+def mdb_stats(db_file, retries=3):
+    """Read statistics of an LMDB file (data.mdb)
+
+    Read the meta page with the newest txnid, the sub-DB records (MDB_db)
+    in the main DB and the freelist. The sub-DB B-trees are not walked:
+    their MDB_db records already have page counts.
+    Retry if a writer may have reused pages while reading. The file is
+    mapped again for each try since it may have grown past the mapping.
+    """
+
+    for retry in range(retries, -1, -1):
+        with open(db_file, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                meta = mdb_metas(buf)[0]
+                try:
+                    stats = mdb_stats_from_meta(buf, meta)
+                except (ValueError, struct.error):
+                    if not retry:
+                        raise
+                    continue
+                ## Pages freed by txnid - 1 or older may have been reused
+                if mdb_metas(buf)[0]['txnid'] <= meta['txnid'] + 1 or not retry:
+                    return stats
+
+
+def db_files(path):
+    """Return the database files in a directory (or the file itself)"""
+
+    if not os.path.isdir(path):
+        return [path]
+
+    mdb_file = os.path.join(path, 'data.mdb')
+    if os.path.exists(mdb_file):
+        return [mdb_file]
+
+    return sorted(
+        os.path.join(path, name)
+        for name in os.listdir(path)
+        if name.endswith('.bdb')
+    )
+
+
+def collect(db_file):
+    """Return the statistics of a database file as a dict"""
+
+    if is_mdb(db_file):
+        return {
+            'type': 'mdb',
+            **mdb_stats(db_file),
+        }
+
+    db_size, db_free, page_size = db_sizes(db_file)
+    return {
+        'type': 'bdb',
+        'page_size': page_size,
+        'size': db_size,
+        'free': db_free,
+    }
+
+
+class StatsCache():
+    """Cache of statistics by file path, validated by mtime and size
+
+    collect() may be called from multiple threads. save() keeps only the
+    entries of the files collected since the cache was loaded.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.entry_by_path = {}
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                self.entry_by_path = json.load(f)
+        self.seen_paths = set()
+        self.hits = 0
+        self.lock = threading.Lock()
+
+    def collect(self, db_file):
+        st = os.stat(db_file)
+        with self.lock:
+            self.seen_paths.add(db_file)
+            entry = self.entry_by_path.get(db_file)
+            if entry is not None and entry['mtime_ns'] == st.st_mtime_ns and entry['file_size'] == st.st_size:
+                self.hits += 1
+                return entry['stats']
+
+        ## Collect without the lock to read files concurrently
+        stats = collect(db_file)
+        with self.lock:
+            self.entry_by_path[db_file] = {
+                'mtime_ns': st.st_mtime_ns,
+                'file_size': st.st_size,
+                'stats': stats,
+            }
+
+        return stats
+
+    def save(self):
+        if self.path is None:
+            return
+
+        with self.lock:
+            entry_by_path = {
+                path: entry
+                for path, entry in self.entry_by_path.items()
+                if path in self.seen_paths
+            }
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(entry_by_path, f)
+        os.replace(tmp_path, self.path)
+
+
+def linear_slope(n, sx, sxx, sy, sxy):
+    """Return the least-squares slope from sums, or None if undefined"""
+
+    d = n * sxx - sx * sx
+    if n < 2 or d <= 0:
+        return None
+
+    return (n * sxy - sx * sy) / d
+
+
+def days_until(remaining, slope):
+    """Return days until `remaining` is consumed at `slope` per day"""
+
+    if slope is None or slope <= 0:
+        return None
+    if remaining <= 0:
+        return 0.0
+
+    return round(remaining / slope, 1)
+
+
+class History():
+    """Size history of database files in an SQLite database
+
+    Samples are stored in a WITHOUT ROWID table clustered by (path_id, ts)
+    so that the samples of a file in a time window are read by a range
+    scan and the growth rates are computed by aggregate sums in SQL.
+    """
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS paths (
+                path_id INTEGER PRIMARY KEY,
+                path TEXT NOT NULL UNIQUE
+            );
+            CREATE TABLE IF NOT EXISTS samples (
+                path_id INTEGER NOT NULL,
+                ts INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                free INTEGER NOT NULL,
+                map_size INTEGER,
+                disk_avail INTEGER,
+                PRIMARY KEY (path_id, ts)
+            ) WITHOUT ROWID;
+        ''')
+
+    def path_id(self, path):
+        self.db.execute('INSERT OR IGNORE INTO paths (path) VALUES (?)', (path,))
+        return self.db.execute('SELECT path_id FROM paths WHERE path = ?', (path,)).fetchone()[0]
+
+    def record(self, ts, stats_by_file):
+        with self.db:
+            for db_file, stats in stats_by_file.items():
+                if 'error' in stats:
+                    continue
+                st = os.statvfs(os.path.dirname(db_file) or '.')
+                self.db.execute(
+                    'INSERT OR REPLACE INTO samples VALUES (?, ?, ?, ?, ?, ?)',
+                    (
+                        self.path_id(db_file), ts,
+                        stats['size'], stats['free'], stats.get('map_size'),
+                        st.f_bavail * st.f_frsize,
+                    ),
+                )
+
+    def prune(self, ts):
+        with self.db:
+            self.db.execute('DELETE FROM samples WHERE ts < ?', (ts,))
+
+    def forecasts(self, since, paths=None, reclaim_ratio=0.2):
+        """Return growth rates and forecasts of files sampled since `since`"""
+
+        path_ids = self.db.execute('SELECT path_id, path FROM paths ORDER BY path').fetchall()
+        if paths:
+            path_ids = [(path_id, path) for path_id, path in path_ids if path in paths]
+
+        forecasts = []
+        for path_id, path in path_ids:
+            ## Use days since `since` as x to keep the sums small
+            n, sx, sxx, s_size, sx_size, s_free, sx_free, s_disk, sx_disk, ts_first = self.db.execute('''
+                SELECT count(*), total(x), total(x * x),
+                    total(size), total(x * size),
+                    total(free), total(x * free),
+                    total(disk_avail), total(x * disk_avail),
+                    min(ts)
+                FROM (
+                    SELECT (ts - ?1) / 86400.0 AS x, size, free, disk_avail, ts
+                    FROM samples WHERE path_id = ?2 AND ts >= ?1
+                )
+            ''', (since, path_id)).fetchone()
+            if not n:
+                continue
+            ts_last, size, free, map_size, disk_avail = self.db.execute(
+                'SELECT ts, size, free, map_size, disk_avail FROM samples'
+                ' WHERE path_id = ? ORDER BY ts DESC LIMIT 1',
+                (path_id,),
+            ).fetchone()
+            used = size - free
+
+            size_slope = linear_slope(n, sx, sxx, s_size, sx_size)
+            free_slope = linear_slope(n, sx, sxx, s_free, sx_free)
+            disk_slope = linear_slope(n, sx, sxx, s_disk, sx_disk)
+            used_slope = None if size_slope is None else size_slope - free_slope
+
+            forecast = {
+                'path': path,
+                'samples': n,
+                'first': ts_first,
+                'last': ts_last,
+                'size': size,
+                'used': used,
+                'free': free,
+                'fragmentation': round(free / used, 3) if used else None,
+                'size_per_day': None if size_slope is None else round(size_slope),
+                'used_per_day': None if used_slope is None else round(used_slope),
+                'free_per_day': None if free_slope is None else round(free_slope),
+                'disk_avail': disk_avail,
+                'disk_full_days': days_until(disk_avail, None if disk_slope is None else -disk_slope),
+            }
+            if map_size is not None:
+                ## LMDB reuses free pages before growing, so the map fills
+                ## up at the rate of used pages
+                forecast['map_size'] = map_size
+                forecast['map_full_days'] = days_until(map_size - used, used_slope)
+
+            ## Reloading (slapcat and slapadd) leaves about the used pages
+            forecast['reclaim'] = free
+            forecast['reclaim_ratio'] = round(free / size, 3) if size else 0.0
+            if forecast['reclaim_ratio'] >= reclaim_ratio:
+                forecast['reclaim_days'] = 0.0
+            elif size_slope is not None:
+                ## Solve: free + free_slope * t = reclaim_ratio * (size + size_slope * t)
+                forecast['reclaim_days'] = days_until(
+                    reclaim_ratio * size - free,
+                    free_slope - reclaim_ratio * size_slope,
+                )
+            else:
+                forecast['reclaim_days'] = None
+
+            forecasts.append(forecast)
+
+        return forecasts
+
+
+def format_forecast(forecast, decimal_places=3):
+    def days(key):
+        value = forecast.get(key)
+        return 'never' if value is None else f'{value} days'
+
+    def per_day(key):
+        value = forecast[key]
+        return 'unknown' if value is None else f'{format_b_as_mib(value, decimal_places)} MiB/day'
+
+    out = format_sizes(forecast['path'], forecast['size'], forecast['free'], decimal_places)
+    out += f"""\
+  Samples: {forecast['samples']}
+  Growth: size {per_day('size_per_day')}, used {per_day('used_per_day')}, free {per_day('free_per_day')}
+  Fragmentation (free/used): {forecast['fragmentation']}
+"""
+    if 'map_size' in forecast:
+        out += f"  Map full: {days('map_full_days')}\n"
+    out += f"  Disk full: {days('disk_full_days')}\n"
+    out += f"""\
+  Reload reclaims: {forecast['reclaim']} ({format_b_as_mib(forecast['reclaim'], decimal_places)} MiB) \
+in {days('reclaim_days')}
+"""
+
+    return out
+
+
+def ldif_entries(ldif_file):
+    """Read an LDIF file and return a list of entries as {attr: [value, ...]}
+
+    Attribute names are lowercased.
+    """
+
+    with open(ldif_file, encoding='utf-8') as f:
+        lines = f.read().splitlines()
+
+    entries = []
+    entry = {}
+    unwrapped = []
+    for line in lines:
+        if line.startswith(' ') and unwrapped:
+            unwrapped[-1] += line[1:]
+        else:
+            unwrapped.append(line)
+    for line in unwrapped + ['']:
+        if not line:
+            if entry:
+                entries.append(entry)
+                entry = {}
+            continue
+        if line.startswith('#'):
+            continue
+        attr, _, value = line.partition(':')
+        if value.startswith(':'):
+            value = base64.b64decode(value[1:].strip()).decode('utf-8', 'replace')
+        else:
+            value = value.strip()
+        entry.setdefault(attr.lower(), []).append(value)
+
+    return entries
+
+
+def strip_ordering(value):
+    """Strip the ordering prefix `{N}` of a cn=config value"""
+
+    return re.sub(r'^\{-?\d+\}', '', value)
+
+
+def slapd_d_databases(slapd_dir):
+    """Read databases (type, suffix, directory and index) from slapd.d"""
+
+    def db_number(ldif_file):
+        m = re.search(r'olcDatabase=\{(-?\d+)\}', ldif_file)
+        return int(m.group(1)) if m else 0
+
+    databases = []
+    ldif_files = glob.glob(os.path.join(slapd_dir, 'cn=config', 'olcDatabase=*.ldif'))
+    for ldif_file in sorted(ldif_files, key=db_number):
+        for entry in ldif_entries(ldif_file):
+            databases.append({
+                'type': strip_ordering(entry.get('olcdatabase', [''])[0]),
+                'suffix': entry.get('olcsuffix', []),
+                'directory': entry.get('olcdbdirectory', [None])[0],
+                'index': [strip_ordering(value) for value in entry.get('olcdbindex', [])],
+            })
+
+    return databases
+
+
+def root_path(root, path):
+    """Return `path` under the directory `root` (if any) like chroot(2)"""
+
+    if root is None:
+        return path
+
+    return os.path.join(root, path.lstrip('/'))
+
+
+def slapd_conf_directives(conf_file, root=None):
+    """Read slapd.conf and yield directives as lists of arguments
+
+    Continuation lines (starting with white spaces) are joined and
+    `include` directives are followed. Directives with unbalanced quotes
+    are reported to stderr and skipped.
+    """
+
+    with open(conf_file, encoding='utf-8') as f:
+        lines = f.read().splitlines()
+
+    directive = None
+    directive_line_n = 0
+    for line_n, line in enumerate(lines + [''], 1):
+        if line[:1] in (' ', '\t') and directive is not None:
+            if line.strip() and not line.lstrip().startswith('#'):
+                directive += ' ' + line.strip()
+            continue
+        if directive:
+            try:
+                args = shlex.split(directive, posix=True)
+            except ValueError as e:
+                print(f'{sys.argv[0]}: {conf_file}:{directive_line_n}: {e}', file=sys.stderr)
+                args = []
+            if args and args[0].lower() == 'include':
+                yield from slapd_conf_directives(root_path(root, args[1]), root)
+            elif args:
+                yield args
+        directive = None if not line.strip() or line.startswith('#') else line
+        directive_line_n = line_n
+
+
+def slapd_conf_databases(conf_file, root=None):
+    """Read databases (type, suffix, directory and index) from slapd.conf"""
+
+    databases = []
+    for args in slapd_conf_directives(conf_file, root):
+        name = args[0].lower()
+        if name == 'database':
+            databases.append({
+                'type': args[1],
+                'suffix': [],
+                'directory': None,
+                'index': [],
+            })
+        elif not databases:
+            continue
+        elif name == 'suffix':
+            databases[-1]['suffix'].append(args[1])
+        elif name == 'directory':
+            databases[-1]['directory'] = args[1]
+        elif name == 'index':
+            databases[-1]['index'].append(' '.join(args[1:]))
+
+    return databases
+
+
+def slapd_databases(config_path, root=None):
+    """Read databases from slapd.d (a directory) or slapd.conf (a file)"""
+
+    if os.path.isdir(config_path):
+        return slapd_d_databases(config_path)
+
+    return slapd_conf_databases(config_path, root)
+
+
+def parse_index(index_values):
+    """Parse olcDbIndex (or index) values into {attr: [index type, ...]}
+
+    Attributes without types get the types of the `default` attribute.
+    """
+
+    default_types = []
+    types_by_attr = {}
+    for value in index_values:
+        attrs, types = (value.split(None, 1) + [''])[:2]
+        types = [t.strip().lower() for t in types.split(',') if t.strip()]
+        for attr in attrs.split(','):
+            if attr.lower() == 'default':
+                default_types = types
+            else:
+                types_by_attr[attr] = types
+
+    return {
+        attr: types or default_types
+        for attr, types in types_by_attr.items()
+    }
+
+
+def index_usage(filters_report):
+    """Count searches by (attr, index type) in `--report filters` JSON"""
+
+    usage = {}
+    for search in filters_report['searches']:
+        for attr, match in search['assertions']:
+            ## Negated assertions (`!eq` and so on) do not use indexes
+            if match.startswith('!'):
+                continue
+            index_type = index_type_by_match.get(match)
+            if index_type is None:
+                continue
+            key = (attr.lower(), index_type)
+            usage[key] = usage.get(key, 0) + search['count']
+
+    return usage
+
+
+def index_stats(config_path, filters_report=None, root=None):
+    """Attribute the size of index files or LMDB sub-DBs to index directives
+
+    back-mdb keeps all index types of an attribute in one sub-DB named
+    by the attribute, back-bdb and back-hdb in the ATTR.bdb file.
+    Database directories and included files are looked up under `root`.
+    """
+
+    usage = None if filters_report is None else index_usage(filters_report)
+
+    databases = []
+    for database in slapd_databases(config_path, root):
+        if not database['directory'] or not database['index']:
+            continue
+        directory = root_path(root, database['directory'])
+        indexes = []
+        result = {
+            'type': database['type'],
+            'suffix': database['suffix'],
+            'directory': directory,
+            'indexes': indexes,
+        }
+        databases.append(result)
+
+        try:
+            if os.path.exists(os.path.join(directory, 'data.mdb')):
+                stats = mdb_stats(os.path.join(directory, 'data.mdb'))
+                stats_by_attr = {
+                    name.lower(): {
+                        'file': os.path.join(directory, 'data.mdb'),
+                        'name': name,
+                        'pages': db['pages'],
+                        'size': db['pages'] * stats['page_size'],
+                        ## Free pages are not owned by sub-DBs
+                        'free': None,
+                        'entries': db['entries'],
+                    }
+                    for name, db in stats['databases'].items()
+                }
+            else:
+                stats_by_attr = {}
+                for db_file in db_files(directory):
+                    size, free, page_size = db_sizes(db_file)
+                    name = os.path.basename(db_file)[:-len('.bdb')]
+                    stats_by_attr[name.lower()] = {
+                        'file': db_file,
+                        'name': name,
+                        'pages': size // page_size,
+                        'size': size,
+                        'free': free,
+                        'entries': None,
+                    }
+        except (OSError, ValueError, struct.error, subprocess.CalledProcessError) as e:
+            result['error'] = str(e)
+            stats_by_attr = {}
+
+        for attr, types in parse_index(database['index']).items():
+            index = {
+                'attr': attr,
+                'types': types,
+                **stats_by_attr.get(attr.lower(), {
+                    'file': None,
+                    'name': None,
+                    'pages': None,
+                    'size': None,
+                    'free': None,
+                    'entries': None,
+                }),
+            }
+            if usage is not None:
+                used_by_type = {
+                    index_type: usage.get((attr.lower(), index_type), 0)
+                    for index_type in types
+                    if index_type in index_type_by_match.values()
+                }
+                ## subinitial, subany and subfinal are used by `sub` assertions
+                if any(t.startswith('sub') and t != 'sub' for t in types):
+                    used_by_type['sub'] = usage.get((attr.lower(), 'sub'), 0)
+                index['searches'] = used_by_type
+                index['used'] = any(used_by_type.values())
+            indexes.append(index)
+
+        indexes.sort(key=lambda i: i['size'] or 0, reverse=True)
+
+    return databases
+
+
+def format_index_stats(databases, decimal_places=3):
+    out = ''
+    for database in databases:
+        out += f"{database['directory']} ({database['type']} {' '.join(database['suffix'])}):\n"
+        if 'error' in database:
+            out += f"  Error: {database['error']}\n"
+        for index in database['indexes']:
+            out += f"  {index['attr']} {','.join(index['types'])}: "
+            if index['size'] is None:
+                out += 'not found'
+            else:
+                out += f"{index['size']} ({format_b_as_mib(index['size'], decimal_places)} MiB), {index['pages']} pages"
+                if index['free'] is not None:
+                    out += f", {index['free']} ({format_b_as_mib(index['free'], decimal_places)} MiB) free"
+            if 'used' in index:
+                searches = ', '.join(f'{t} {n}' for t, n in index['searches'].items())
+                out += f", searches: {searches}" if index['used'] else ', UNUSED'
+            out += '\n'
+
+    return out
 
 
 def main(argv):
+    args_parser = argparse.ArgumentParser(
+        prog=sys.argv[0],
+        add_help=True,
+        description='Report data size in Berkeley DB and LMDB',
+    )
+    args_parser.add_argument(
+        'paths', metavar='PATH',
+        nargs='*',
+        help='Database file (*.bdb or data.mdb) or directory (for each slapd database)',
+    )
+    args_parser.add_argument(
+        '--json', action='store_true',
+        help='Print JSON with per-file and per-database (directory) totals',
+    )
+    args_parser.add_argument(
+        '--jobs', '-j', metavar='N',
+        type=int, default=min(8, os.cpu_count() or 1),
+        help='Number of files to read concurrently (default: %(default)s)',
+    )
+    args_parser.add_argument(
+        '--cache', metavar='FILE',
+        help='Cache statistics in FILE to skip files not modified (by mtime and size) since the last run'
+        ' (files not given in a run are dropped from the cache)',
+    )
+    args_parser.add_argument(
+        '--history', metavar='FILE',
+        help='Append a sample of each file to the SQLite database FILE',
+    )
+    args_parser.add_argument(
+        '--retention', metavar='DAYS',
+        type=float,
+        help='Delete samples older than DAYS from the history',
+    )
+    args_parser.add_argument(
+        '--forecast', action='store_true',
+        help='Print growth rates and forecasts from the history instead of sampling'
+        ' (for PATHs or all files in the history)',
+    )
+    args_parser.add_argument(
+        '--window', metavar='DAYS',
+        type=float, default=30.0,
+        help='Compute growth rates from samples in the last DAYS (default: %(default)s)',
+    )
+    args_parser.add_argument(
+        '--reclaim-ratio', metavar='RATIO',
+        type=float, default=0.2,
+        help='Forecast when free/size reaches RATIO to be reclaimed by reloading (default: %(default)s)',
+    )
+    args_parser.add_argument(
+        '--indexes', metavar='CONFIG',
+        help='Print size of each index configured in slapd.d directory or slapd.conf file CONFIG'
+        ' instead of PATHs',
+    )
+    args_parser.add_argument(
+        '--filters', metavar='FILE',
+        type=argparse.FileType('r'),
+        help='Mark indexes used by searches in FILE from `slapdstatslog2json.py --report filters`'
+        ' (all searches in the report are counted, not only its top `indexes`)',
+    )
+    args_parser.add_argument(
+        '--root', metavar='DIR',
+        help='Look up database directories and included files for --indexes under DIR',
+    )
+    args = args_parser.parse_args(argv)
+
+    if args.indexes:
+        filters_report = None if args.filters is None else json.load(args.filters)
+        databases = index_stats(args.indexes, filters_report, args.root)
+        if args.json:
+            print(json.dumps(databases, indent=2))
+        else:
+            print(format_index_stats(databases), end='')
+        return 1 if any('error' in database for database in databases) else 0
+
+    if args.forecast:
+        if not args.history:
+            args_parser.error('--forecast requires --history')
+        paths = [db_file for path in args.paths for db_file in db_files(path)]
+        forecasts = History(args.history).forecasts(
+            int(time.time() - args.window * 86400), paths, args.reclaim_ratio,
+        )
+        if args.json:
+            print(json.dumps(forecasts, indent=2))
+        else:
+            print(''.join(format_forecast(forecast) for forecast in forecasts), end='')
+        return 0
+
+    if not args.paths:
+        args_parser.error('PATH is required')
+
+    ## Group files by database (directory)
+    files_by_dir = {}
+    for path in args.paths:
+        for db_file in db_files(path):
+            files_by_dir.setdefault(os.path.dirname(db_file) or '.', []).append(db_file)
+    db_file_list = [db_file for db_files_in_dir in files_by_dir.values() for db_file in db_files_in_dir]
+
+    cache = StatsCache(args.cache)
+
+    def collect_or_error(db_file):
+        try:
+            return cache.collect(db_file)
+        except (OSError, ValueError, struct.error, subprocess.CalledProcessError) as e:
+            return {'error': str(e)}
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        stats_by_file = dict(zip(db_file_list, executor.map(collect_or_error, db_file_list)))
+
+    cache.save()
+
+    if args.history:
+        history = History(args.history)
+        ts = int(time.time())
+        history.record(ts, stats_by_file)
+        if args.retention is not None:
+            history.prune(int(ts - args.retention * 86400))
+
+    rc = 0
+    databases = []
     db_size_total = db_free_total = 0
-    for db_file in argv:
-        db_size, db_free = db_sizes(db_file)
-        db_size_total += db_size
-        db_free_total += db_free
-        print(format_sizes(db_file, db_size, db_free), end='')
+    for directory, db_files_in_dir in files_by_dir.items():
+        files = []
+        db_size_dir = db_free_dir = 0
+        for db_file in db_files_in_dir:
+            stats = stats_by_file[db_file]
+            files.append({'path': db_file, **stats})
+            if 'error' in stats:
+                print(f'{sys.argv[0]}: {db_file}: {stats["error"]}', file=sys.stderr)
+                rc = 1
+                continue
+            db_size_dir += stats['size']
+            db_free_dir += stats['free']
+            if not args.json:
+                out = format_sizes(db_file, stats['size'], stats['free'])
+                if stats['type'] == 'mdb':
+                    out += format_mdb_stats(stats)
+                print(out, end='')
+        databases.append({
+            'directory': directory,
+            'size': db_size_dir,
+            'used': db_size_dir - db_free_dir,
+            'free': db_free_dir,
+            'files': files,
+        })
+        if not args.json and len(files_by_dir) > 1:
+            print(format_sizes(f'{directory} total', db_size_dir, db_free_dir), end='')
+        db_size_total += db_size_dir
+        db_free_total += db_free_dir
 
-    print(format_sizes('Total', db_size_total, db_free_total), end='')
+    if args.json:
+        print(json.dumps({
+            'size': db_size_total,
+            'used': db_size_total - db_free_total,
+            'free': db_free_total,
+            'databases': databases,
+        }, indent=2))
+    else:
+        print(format_sizes('Total', db_size_total, db_free_total), end='')
 
-    return 0
+    return rc
 
 
 if __name__ == '__main__':
-    if len(sys.argv) < 2:
-        print("Usage: %s *.bdb" % (sys.argv[0]), file=sys.stderr)
-        sys.exit(1)
-
     sys.exit(main(sys.argv[1:]))
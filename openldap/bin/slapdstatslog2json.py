@@ -13,7 +13,25 @@ import re
 import datetime
 import json
 import calendar
-import itertools
+import argparse
+import functools
+import array
+import math
+import collections
+import contextlib
+import os
+import io
+import time
+import bisect
+import threading
+import http.server
+import zlib
+import asyncio
+import queue
+import socket
+import stat
+import errno
+import signal
 
 if __name__ == '__main__':
     logging.basicConfig(
@@ -129,7 +147,7 @@ error_text_by_n = {
     0x4121: 'X_TXN_ID_INVALID',
 }
 
-re_stats_line = re.compile(
+re_syslog_prefix = (
     r'('
     r'(?P<month_abbr>[A-Z][a-z][a-z])'
     r' (?P<month_day>[ 0-3][0-9])'
@@ -139,12 +157,44 @@ re_stats_line = re.compile(
     r')'
     r' (?P<hostname>[\w\-.]+)'
     r' [\w\-]+\[(?P<pid>[0-9]+)\]:'
+)
+
+re_syslog_line = re.compile(re_syslog_prefix)
+
+re_stats_line = re.compile(
+    re_syslog_prefix +
     r' conn=(?P<conn_id>[0-9]+)'
     r' (?P<what>fd|op)=(?P<id>[0-9]+)'
     r' (?P<chunk>.*)'
     '$'
 )
 
+## Diagnostic lines (without `conn=`) logged by loglevel other than stats
+re_diag_line = re.compile(
+    re_syslog_prefix +
+    r' (?P<message>.*)'
+    '$'
+)
+re_diag_not_indexed = re.compile(
+    r'<= (?P<backend>[a-z]+)_(?P<candidates>equality|substring|inequality|presence|approx)_candidates:'
+    r' \((?P<attr>[^)]*)\) not indexed'
+    '$'
+)
+re_diag_connection = re.compile(
+    r'(?P<function>connection_\w+)\((?P<fd>[0-9]+)\): '
+    r'(?P<text>.*)'
+    '$'
+)
+re_diag_conn_id = re.compile(r'\bid=(?P<conn_id>[0-9]+)')
+
+index_type_by_candidates = {
+    'equality': 'eq',
+    'substring': 'sub',
+    'inequality': 'eq',
+    'presence': 'pres',
+    'approx': 'approx',
+}
+
 re_bind_method = re.compile(
     r'BIND'
     r' dn="(?P<dn>[^"]*)"'
@@ -214,69 +264,227 @@ re_search_result = re.compile(
     '$'
 )
 
+## Search filter (RFC 4515 string representation as logged by slapd)
+## ======================================================================
 
-class Connection():
-    def __init__(self, conn_id):
-        self.line_n = None
-        self.datetime = None
-        self.op_by_id = {}
-        self.info = {
-            'conn': conn_id,
-            'fd': None,
-            'source': None,
-            'tls': None,
-            'dn': None,
-        }
-
-    @property
-    def id(self):
-        return self.info['conn']
-
-    @id.setter
-    def id(self, id):
-        self.info['conn'] = id
-
-    @property
-    def fd(self):
-        return self.info['fd']
+re_filter_item = re.compile(
+    r'(?P<attr>[^=~<>:()]*)'
+    r'(?P<ext>(:dn)?(:[\w.\-]+)?)'
+    r'(?P<op>=|~=|>=|<=|:=)'
+    r'(?P<value>[^()]*)'
+    '$'
+)
 
-    @fd.setter
-    def fd(self, fd):
-        self.info['fd'] = fd
+## Index type (olcDbIndex) to be used by each assertion type.
+## Ordering assertions (>= and <=) are evaluated with the equality index.
+index_type_by_match = {
+    'eq': 'eq',
+    'ge': 'eq',
+    'le': 'eq',
+    'approx': 'approx',
+    'sub': 'sub',
+    'pres': 'pres',
+}
 
-    @property
-    def tls(self):
-        return self.info['tls']
 
-    @tls.setter
-    def tls(self, tls_p):
-        self.info['tls'] = tls_p
+def parse_filter(filter_str):
+    """Parse a search filter string into a tree of tuples
+
+    ('&', [child, ...]), ('|', [child, ...]), ('!', [child]),
+    ('eq'|'ge'|'le'|'approx', attr, value), ('pres', attr),
+    ('sub', attr, initial, [any, ...], final),
+    ('ext', attr, dn_p, rule, value), ('undefined', text)
+
+    Assertion values are kept escaped as in the log.
+    """
+
+    node, end = _parse_filter(filter_str, 0)
+    if end != len(filter_str):
+        raise ValueError(f'Trailing garbage in filter: {filter_str}')
+
+    return node
+
+
+def _parse_filter(filter_str, start):
+    if filter_str[start:start + 1] != '(':
+        raise ValueError(f'No `(` at {start} in filter: {filter_str}')
+
+    op = filter_str[start + 1:start + 2]
+    if op in ('&', '|', '!'):
+        children = []
+        pos = start + 2
+        while filter_str[pos:pos + 1] == '(':
+            child, pos = _parse_filter(filter_str, pos)
+            children.append(child)
+        if filter_str[pos:pos + 1] != ')':
+            raise ValueError(f'No `)` at {pos} in filter: {filter_str}')
+        if op == '!' and len(children) != 1:
+            raise ValueError(f'Invalid `!` filter at {start}: {filter_str}')
+        return (op, children), pos + 1
+
+    end = filter_str.find(')', start)
+    if end < 0:
+        raise ValueError(f'No `)` after {start} in filter: {filter_str}')
+    item = filter_str[start + 1:end]
+
+    if item.startswith('?'):
+        ## Undefined attribute type or filter
+        return ('undefined', item), end + 1
+
+    m = re_filter_item.match(item)
+    if m is None:
+        raise ValueError(f'Invalid filter item at {start}: {filter_str}')
+
+    attr = m.group('attr')
+    op = m.group('op')
+    value = m.group('value')
+    if op == ':=':
+        ext = m.group('ext')
+        dn_p = ext.startswith(':dn')
+        rule = ext[4 if dn_p else 1:] or None
+        return ('ext', attr, dn_p, rule, value), end + 1
+    if op == '>=':
+        return ('ge', attr, value), end + 1
+    if op == '<=':
+        return ('le', attr, value), end + 1
+    if op == '~=':
+        return ('approx', attr, value), end + 1
+    if value == '*':
+        return ('pres', attr), end + 1
+    if '*' in value:
+        values = value.split('*')
+        return ('sub', attr, values[0], [v for v in values[1:-1] if v], values[-1]), end + 1
+
+    return ('eq', attr, value), end + 1
+
+
+def _filter_shape(node, assertions, negated=False):
+    match = node[0]
+    if match in ('&', '|', '!'):
+        negated = negated or match == '!'
+        return '(' + match + ''.join(sorted(_filter_shape(child, assertions, negated) for child in node[1])) + ')'
+    if match == 'undefined':
+        if node[1] == '?=undefined':
+            return '(?=undefined)'
+        return '(' + node[1].split('=', 1)[0].lower() + '=?)'
+
+    attr = node[1].lower()
+    assertions.add((attr, '!' + match if negated else match))
+    if match == 'eq':
+        return f'({attr}=?)'
+    if match == 'ge':
+        return f'({attr}>=?)'
+    if match == 'le':
+        return f'({attr}<=?)'
+    if match == 'approx':
+        return f'({attr}~=?)'
+    if match == 'pres':
+        return f'({attr}=*)'
+    if match == 'sub':
+        return ''.join((
+            f'({attr}=',
+            '?' if node[2] else '',
+            '*?*' if node[3] else '*',
+            '?' if node[4] else '',
+            ')',
+        ))
+
+    ## Extensible match
+    return ''.join((
+        f'({attr}',
+        ':dn' if node[2] else '',
+        f':{node[3]}' if node[3] else '',
+        ':=?)',
+    ))
+
+
+@functools.lru_cache(maxsize=65536)
+def filter_fingerprint(filter_str):
+    """Return the shape of a search filter and its assertions
+
+    The shape is the filter with assertion values replaced by `?`,
+    attribute names in lower case and `&`/`|` operands sorted, so that
+    filters differing only in values (or operand order) share a shape.
+    Assertions are a sorted tuple of (attribute, match type) pairs.
+    The match type of an assertion under `!` is prefixed with `!` since
+    slapd cannot use an index to evaluate a NOT filter.
+    Unparsable filters are returned as is with no assertions.
+    """
+
+    try:
+        node = parse_filter(filter_str)
+    except ValueError:
+        return filter_str, ()
+
+    assertions = set()
+    shape = _filter_shape(node, assertions)
+
+    return shape, tuple(sorted(assertions))
+
+
+@functools.lru_cache(maxsize=65536)
+def search_index_keys(filter_str):
+    """Return (attribute, index type) pairs of indexes a search filter may use
+
+    Attributes are in lower case. Negated assertions use no index.
+    An unparsable filter may use any index and has the key None only.
+    """
+
+    if filter_str is None:
+        return (None,)
+    assertions = filter_fingerprint(filter_str)[1]
+    if not assertions:
+        return (None,)
+
+    return tuple(sorted({
+        (attr, index_type_by_match[match])
+        for attr, match in assertions
+        if match in index_type_by_match
+    }))
 
-    @property
-    def source(self):
-        return self.info['source']
 
-    @source.setter
-    def source(self, source):
-        self.info['source'] = source
+class Connection():
+    __slots__ = (
+        'id',
+        'fd',
+        'source',
+        'tls',
+        'dn',
+        'dn_unbound',
+        'line_n',
+        'datetime',
+        'op_by_id',
+        'disconnect_op',
+    )
 
-    @property
-    def dn(self):
-        return self.info['dn']
+    def __init__(self, conn_id):
+        self.id = conn_id
+        self.fd = None
+        self.source = None
+        self.tls = None
+        self.dn = None
+        self.dn_unbound = None
+        self.line_n = None
+        self.datetime = None
+        self.op_by_id = {}
+        self.disconnect_op = None
 
-    @dn.setter
-    def dn(self, dn):
-        self.info['dn'] = dn
+    def add_diagnostic(self, diagnostic):
+        ## Diagnostics of a connection are reported with its DISCONNECT operation
+        if self.disconnect_op is None:
+            self.disconnect_op = Operation()
+        self.disconnect_op.add_diagnostic(diagnostic)
 
     def unbind(self):
-        self.info['dn_unbound'] = self.info['dn']
+        self.dn_unbound = self.dn
         self.dn = 'UNBOUND'
 
     def get_op_by_id(self, op_id):
-        if op_id not in self.op_by_id:
-            self.op_by_id[op_id] = Operation(conn=self, op_id=op_id)
+        op = self.op_by_id.get(op_id)
+        if op is None:
+            op = self.op_by_id[op_id] = Operation(op_id)
 
-        return self.op_by_id[op_id]
+        return op
 
     def remove_op(self, op):
         try:
@@ -285,340 +493,2202 @@ class Connection():
             pass
 
 
+## (JSON key, Operation attribute) in the order of output
+op_request_fields = (
+    ('dn', 'request_dn'),
+    ('method', 'method'),
+    ('authcid', 'authcid'),
+    ('authzid', 'authzid'),
+    ('mech', 'mech'),
+    ('ssf', 'ssf'),
+    ('bind_ssf', 'bind_ssf'),
+    ('base', 'base'),
+    ('scope', 'scope'),
+    ('deref', 'deref'),
+    ('filter', 'filter'),
+    ('attrs', 'attrs'),
+    ('attr', 'attr'),
+    ('new', 'new'),
+    ('old', 'old'),
+)
+## Fields which can be set for each operation type (all fields for others)
+op_request_fields_by_type = {
+    'CONNECT': (),
+    'DISCONNECT': (),
+    'UNBIND': (),
+    'STARTTLS': (),
+    'WHOAMI': (),
+    'BIND': op_request_fields[0:7],
+    'SEARCH': op_request_fields[7:12],
+    'COMPARE': (op_request_fields[0], op_request_fields[12]),
+    'ADD': op_request_fields[0:1],
+    'DELETE': op_request_fields[0:1],
+    'MODIFYRDN': op_request_fields[0:1],
+    'MODIFY': (op_request_fields[0], op_request_fields[11]),
+    'PASSWORD': (op_request_fields[0],) + op_request_fields[13:15],
+}
+op_result_fields = (
+    ('text', 'text'),
+    ('tag', 'tag'),
+    ('oid', 'oid'),
+    ('qtime', 'qtime'),
+)
+op_search_result_fields = (
+    ('nentries', 'nentries'),
+    ('tag', 'tag'),
+    ('text', 'text'),
+    ('qtime', 'qtime'),
+)
+
+
 class Operation():
-    def __init__(self, conn, op_id=None):
-        self.conn = conn
+    """Operation record
+
+    The connection attributes (conn_id, fd, source, tls, dn and
+    dn_unbound) are copied from the connection when the result is set,
+    request and result attributes not logged are None. sample_weight is
+    set when the parser samples connections.
+    """
+
+    __slots__ = (
+        'conn_id',
+        'fd',
+        'source',
+        'tls',
+        'dn',
+        'dn_unbound',
+        'id',
+        'type',
+        'request_line_n',
+        'request_datetime',
+        'request_dn',
+        'method',
+        'authcid',
+        'authzid',
+        'mech',
+        'ssf',
+        'bind_ssf',
+        'base',
+        'scope',
+        'deref',
+        'filter',
+        'attrs',
+        'attr',
+        'new',
+        'old',
+        'result_line_n',
+        'result_datetime',
+        'error',
+        'nentries',
+        'tag',
+        'text',
+        'oid',
+        'qtime',
+        'etime',
+        'diagnostics',
+        'sample_weight',
+    )
+
+    def __init__(self, op_id=None):
+        self.conn_id = None
+        self.fd = None
+        self.source = None
+        self.tls = None
+        self.dn = None
+        self.dn_unbound = None
         self.id = op_id
         self.type = None
+        self.request_line_n = None
         self.request_datetime = None
-        self.request = {
-            'line_n': None,
-            'timestamp': None,
-        }
+        self.request_dn = None
+        self.method = None
+        self.authcid = None
+        self.authzid = None
+        self.mech = None
+        self.ssf = None
+        self.bind_ssf = None
+        self.base = None
+        self.scope = None
+        self.deref = None
+        self.filter = None
+        self.attrs = None
+        self.attr = None
+        self.new = None
+        self.old = None
+        self.result_line_n = None
         self.result_datetime = None
-        self.result = {
-            'line_n': None,
-            'timestamp': None,
-            'error': None,
-            'error_text': None,
+        self.error = None
+        self.nentries = None
+        self.tag = None
+        self.text = None
+        self.oid = None
+        self.qtime = None
+        self.etime = None
+        self.diagnostics = None
+        self.sample_weight = None
+
+    def to_dict(self):
+        op = {
+            'conn': self.conn_id,
+            'fd': self.fd,
+            'source': self.source,
+            'tls': self.tls,
+            'dn': self.dn,
+        }
+        if self.dn_unbound is not None:
+            op['dn_unbound'] = self.dn_unbound
+        op['op'] = self.id
+        op['op_type'] = self.type
+
+        request = op['op_request'] = {
+            'line_n': self.request_line_n,
+            'timestamp': self.request_datetime.isoformat() if self.request_datetime else None,
+        }
+        for key, attr in op_request_fields_by_type.get(self.type, op_request_fields):
+            value = getattr(self, attr)
+            if value is not None:
+                request[key] = value
+
+        result = op['op_result'] = {
+            'line_n': self.result_line_n,
+            'timestamp': self.result_datetime.isoformat() if self.result_datetime else None,
+            'error': self.error,
+            'error_text': error_text_by_n.get(self.error, 'UNKNOWN'),
         }
+        for key, attr in (op_result_fields if self.nentries is None else op_search_result_fields):
+            value = getattr(self, attr)
+            if value is not None:
+                result[key] = value
+        result['etime'] = self.etime
+
+        if self.diagnostics:
+            op['op_diagnostics'] = self.diagnostics
+        if self.sample_weight is not None:
+            op['sample_weight'] = self.sample_weight
+
+        return op
 
     def to_json(self):
-        if 'etime' not in self.result:  # OpenLDAP 2.4
-            if self.request_datetime is None:
-                self.result['etime'] = None
-            else:
-                self.result['etime'] = (self.result_datetime - self.request_datetime).total_seconds()
-
-        return json.dumps({
-            **self.conn.info,
-            'op': self.id,
-            'op_type': self.type,
-            'op_request': self.request,
-            'op_result': self.result,
-        })
+        return json.dumps(self.to_dict())
+
+    def add_diagnostic(self, diagnostic):
+        if self.diagnostics is None:
+            self.diagnostics = []
+        self.diagnostics.append(diagnostic)
 
-    def set_request(self, op_type):
+    def set_request(self, conn, op_type):
         self.type = op_type
-        self.request_datetime = self.conn.datetime
-        self.request['line_n'] = self.conn.line_n
-        self.request['timestamp'] = self.request_datetime.isoformat()
+        self.request_datetime = conn.datetime
+        self.request_line_n = conn.line_n
 
-    def set_result(self, error, result=None):
-        self.result_datetime = self.conn.datetime
-        self.result['line_n'] = self.conn.line_n
-        self.result['timestamp'] = self.result_datetime.isoformat()
-        self.result['error'] = error
-        self.result['error_text'] = error_text_by_n.get(error, 'UNKNOWN')
-        if result is not None:
-            self.result.update(result)
+    def set_result(self, conn, error):
+        self.result_datetime = conn.datetime
+        self.result_line_n = conn.line_n
+        self.error = error
+        if self.etime is None and self.request_datetime is not None:  # OpenLDAP 2.4
+            self.etime = (self.result_datetime - self.request_datetime).total_seconds()
 
+        self.conn_id = conn.id
+        self.fd = conn.fd
+        self.source = conn.source
+        self.tls = conn.tls
+        self.dn = conn.dn
+        self.dn_unbound = conn.dn_unbound
 
-def main(argv):
-    line_n = 0
 
-    ## Guess log year (standard syslog has no year in timestamp)
-    for firstline in sys.stdin:
-        m = re_stats_line.match(firstline)
-        if m is None:
-            line_n += 1
-            continue
+def match_datetime(m, year):
+    if m.group('datetime'):
+        ## ISO 8601 date and time format
+        return datetime.datetime.fromisoformat(m.group('datetime'))
 
-        if m.group('datetime'):
-            ## ISO 8601 date and time format
-            break
+    ## Legacy syslog date and time format (no year)
+    month = month_by_abbr[m.group('month_abbr')]
+    mday = int(m.group('month_day'))
+    hour = int(m.group('hour'))
+    minute = int(m.group('minute'))
+    second = int(m.group('second'))
+    return datetime.datetime(year, month, mday, hour, minute, second, 0)
 
-        ## Legacy syslog date and time format (no year)
-        dt_now = datetime.datetime.now()
-        year = dt_now.year
-        month = month_by_abbr[m.group('month_abbr')]
-        mday = int(m.group('month_day'))
-        hour = int(m.group('hour'))
-        minute = int(m.group('minute'))
-        second = int(m.group('second'))
-        dt = datetime.datetime(year, month, mday, hour, minute, second, 0)
-        if dt > dt_now:
-            year = year - 1
-        break
-    else:
-        ## No stats log
-        return 0
-
-    conn_by_conn_id = {}
-    for line in itertools.chain([firstline], sys.stdin):
-        line_n += 1
-        line = line.rstrip()
-        m = re_stats_line.match(line)
-        if m is None:
-            continue
 
-        conn_id = int(m.group('conn_id'))
-        if conn_id not in conn_by_conn_id:
-            conn_by_conn_id[conn_id] = Connection(conn_id=conn_id)
-        conn = conn_by_conn_id[conn_id]
-        conn.line_n = line_n
+def guess_year(m):
+    """Guess the year of a line matched with re_syslog_prefix
+
+    Standard syslog has no year in timestamp: Assume the line was logged
+    in the last 12 months. Return None for ISO 8601 timestamp.
+    """
+
+    if m.group('datetime'):
+        return None
+
+    dt_now = datetime.datetime.now()
+    year = dt_now.year
+    if match_datetime(m, year) > dt_now:
+        year = year - 1
+
+    return year
+
+
+def line_timestamp(line, year=None):
+    """Return the POSIX timestamp of a syslog line or None"""
+
+    m = re_syslog_line.match(line)
+    if m is None:
+        return None
+
+    if year is None:
+        year = guess_year(m)
+
+    return match_datetime(m, year).timestamp()
+
+
+def seek_timestamp(f, timestamp, year=None):
+    """Seek a binary file to the first line logged at or after timestamp
+
+    Bisect byte offsets by reading the timestamp of the next full line,
+    then scan forward from the last offset before timestamp.
+    Return the offset (the file size if all lines are before timestamp).
+    """
 
-        if m.group('datetime'):
-            ## ISO 8601 date and time format
-            conn.datetime = datetime.datetime.fromisoformat(m.group('datetime'))
+    lo = 0
+    hi = f.seek(0, os.SEEK_END)
+    while hi - lo > 65536:
+        mid = (lo + hi) // 2
+        f.seek(mid)
+        f.readline()  # Skip a partial line
+        for line in f:
+            line_ts = line_timestamp(line.decode('utf-8', 'replace'), year)
+            if line_ts is not None:
+                break
         else:
-            ## Legacy syslog date and time format (no year)
-            month = month_by_abbr[m.group('month_abbr')]
-            mday = int(m.group('month_day'))
-            hour = int(m.group('hour'))
-            minute = int(m.group('minute'))
-            second = int(m.group('second'))
-            conn.datetime = datetime.datetime(year, month, mday, hour, minute, second, 0)
-
-        chunk = m.group('chunk')
-        if m.group('what') == 'fd':
-            fd = int(m.group('id'))
-            op = Operation(conn=conn)
-
-            if chunk.startswith('ACCEPT from '):
-                op.set_request('CONNECT')
-                ## FIXME: Check if conn_id is already exists
-                conn.fd = fd
-                conn.dn = 'ANONYMOUS'
-
-                chunks = chunk.split(' ')
-                if chunks[2].startswith('IP='):
-                    conn.source = chunks[2][3:]
-                elif chunks[2].startswith('PATH='):
-                    conn.source = chunks[2][5:]
-                else:
-                    logger.error(f'Unknown `ACCEPT` line: {line_n}: {line}')
-                    conn.source = 'UNKNOWN'
-                op.set_result(error=0)
-            elif chunk.startswith('TLS '):
-                conn.tls = True
+            line_ts = None
+        if line_ts is None or line_ts >= timestamp:
+            hi = mid
+        else:
+            lo = mid
+
+    f.seek(lo)
+    if lo > 0:
+        lo += len(f.readline())  # Skip a partial line
+    while True:
+        line = f.readline()
+        if not line:
+            break
+        line_ts = line_timestamp(line.decode('utf-8', 'replace'), year)
+        if line_ts is not None and line_ts >= timestamp:
+            break
+        lo += len(line)
+
+    f.seek(lo)
+    return lo
+
+
+def open_log(path, since=None, year=None):
+    """Open a log file (`-` for stdin) to read lines from
+
+    If since is given and the file is seekable, start at the first line
+    logged at or after since. year is used for legacy syslog timestamps
+    instead of guessing.
+    """
+
+    if path == '-':
+        return sys.stdin
+
+    f = open(path, 'rb')
+    if since is not None and f.seekable():
+        seek_timestamp(f, since, year)
+
+    return io.TextIOWrapper(f, encoding='utf-8', errors='replace')
+
+
+def read_logs(paths, since=None, year=None):
+    """Yield lines of log files (`-` for stdin) opened by open_log()
+
+    Each file is closed after reading it or when the generator is closed.
+    """
+
+    for path in paths:
+        f = open_log(path, since, year)
+        with contextlib.nullcontext(f) if f is sys.stdin else f:
+            yield from f
+
+
+def follow_log(path, interval=1.0):
+    """Yield lines appended to a log file like `tail -F`
+
+    Start at the end of the file and reopen it from the start when it is
+    rotated (replaced or truncated).
+    """
+
+    f = open(path, 'rb')
+    f.seek(0, os.SEEK_END)
+    buf = b''
+    try:
+        while True:
+            chunk = f.readline()
+            if chunk:
+                buf += chunk
+                if buf.endswith(b'\n'):
+                    yield buf.decode('utf-8', 'replace')
+                    buf = b''
                 continue
-            elif chunk.startswith('closed'):
-                op.set_request('DISCONNECT')
-                result = {}
-                try:
-                    result['text'] = chunk[chunk.index('(') + 1:-1]
-                except ValueError:
-                    pass
-                op.set_result(error=0, result=result)
-                try:
-                    del conn_by_conn_id[conn_id]
-                except KeyError:
-                    pass
 
-                ## FIXME: Print pending operation(s)?
-                #if conn.op_by_id:
-                #    conn.info['op_pending'] conn.op_by_id.keys()
-            else:
-                logger.error(f'Invalid `fd` line: {line_n}: {line}')
+            time.sleep(interval)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
                 continue
+            if st.st_ino != os.fstat(f.fileno()).st_ino or st.st_size < f.tell():
+                f.close()
+                f = open(path, 'rb')
+                buf = b''
+    finally:
+        f.close()
 
-            print(op.to_json())
-            conn.remove_op(op)
 
-        elif m.group('what') == 'op':
-            op_id = int(m.group('id'))
+def parse_time(time_str):
+    """Parse an ISO 8601 date and time or a time today into POSIX timestamp"""
 
-            if chunk.startswith('RESULT '):
-                op = conn.get_op_by_id(op_id)
-                m = re_result.match(chunk)
-                if m is None:
-                    logger.error(f'Invalid `RESULT` line: {line_n}: {line}')
-                    continue
-                error = int(m.group('error'))
-                result = {
-                    'text': m.group('text'),
-                }
-                if m.group('tag') is not None:
-                    result['tag'] = int(m.group('tag'))
-                if m.group('oid') is not None:
-                    result['oid'] = m.group('oid')
-                if m.group('qtime') is not None:
-                    result['qtime'] = float(m.group('qtime'))
-                if m.group('etime') is not None:
-                    result['etime'] = float(m.group('etime'))
-                op.set_result(error=error, result=result)
-                print(op.to_json())
-                conn.remove_op(op)
-
-                if op.type == 'BIND' and error == 0:
-                    conn.dn = op.request['dn']
-                elif op.type == 'STARTTLS' and error == 0:
-                    conn.tls = True
+    try:
+        return datetime.datetime.fromisoformat(time_str).timestamp()
+    except ValueError:
+        pass
 
-                continue
+    try:
+        t = datetime.time.fromisoformat(time_str)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'Invalid date and/or time: {time_str}')
 
-            if chunk.startswith('SEARCH RESULT '):
-                op = conn.get_op_by_id(op_id)
-                m = re_search_result.match(chunk)
-                if m is None:
-                    logger.error(f'Invalid `SEARCH RESULT` line: {line_n}: {line}')
-                    continue
-                error = int(m.group('error'))
-                result = {
-                    'nentries': int(m.group('nentries')),
-                    'tag': int(m.group('tag')),
-                    'text': m.group('text'),
+    return datetime.datetime.combine(datetime.date.today(), t).timestamp()
+
+
+def parse_diagnostic(message):
+    """Parse a diagnostic message into a dict or return None if unknown"""
+
+    if message.startswith('<= '):
+        m = re_diag_not_indexed.match(message)
+        if m is None:
+            return None
+        return {
+            'type': 'not_indexed',
+            'text': message,
+            'attr': m.group('attr'),
+            'index': index_type_by_candidates[m.group('candidates')],
+        }
+
+    if message.startswith('connection_'):
+        m = re_diag_connection.match(message)
+        if m is None:
+            return None
+        diagnostic = {
+            'type': m.group('function'),
+            'text': m.group('text'),
+            'fd': int(m.group('fd')),
+        }
+        m = re_diag_conn_id.search(diagnostic['text'])
+        if m is not None:
+            diagnostic['conn'] = int(m.group('conn_id'))
+        return diagnostic
+
+    return None
+
+
+class ParserStats():
+    """Self-instrumentation of StatsLogParser
+
+    Count and time lines by category (time spent in the consumer of
+    parsed operations is excluded and accounted as `sink`), and sample
+    the sizes of the parser tables and the throughput every interval
+    seconds.
+    """
+
+    def __init__(self, interval=10.0, clock=time.perf_counter):
+        self.interval = interval
+        self.clock = clock
+        self.count_by_category = collections.Counter()
+        self.seconds_by_category = collections.Counter()
+        self.lines = 0
+        self.ops = 0
+        self.read_seconds = 0.0
+        self.sink_seconds = 0.0
+        self.line_seconds = None
+        self.connections_max = 0
+        self.operations_max = 0
+        self.timeline = []
+        self.t_start = self.t_sample = clock()
+        self.lines_sampled = 0
+        self.ops_sampled = 0
+
+    def timed(self, lines):
+        """Wrap lines to time reading and processing each line"""
+
+        clock = self.clock
+        t0 = clock()
+        for line in lines:
+            t1 = clock()
+            self.read_seconds += t1 - t0
+            sink_seconds = self.sink_seconds
+            yield line
+            t0 = clock()
+            self.line_seconds = t0 - t1 - (self.sink_seconds - sink_seconds)
+
+    def add_line(self, category):
+        """Account the time of the last line processed"""
+
+        if self.line_seconds is None:
+            return
+        self.lines += 1
+        self.count_by_category[category] += 1
+        self.seconds_by_category[category] += self.line_seconds
+        self.line_seconds = None
+
+    def sample(self, parser, force=False):
+        connections = len(parser.conn_by_conn_id)
+        operations = sum(len(conn.op_by_id) for conn in parser.conn_by_conn_id.values())
+        self.connections_max = max(self.connections_max, connections)
+        self.operations_max = max(self.operations_max, operations)
+
+        t = self.clock()
+        seconds = t - self.t_sample
+        if seconds < self.interval and not (force and self.lines > self.lines_sampled):
+            return
+        self.timeline.append({
+            'elapsed': round(t - self.t_start, 3),
+            'lines': self.lines,
+            'ops': self.ops,
+            'lines_per_sec': round((self.lines - self.lines_sampled) / seconds),
+            'ops_per_sec': round((self.ops - self.ops_sampled) / seconds),
+            'connections': connections,
+            'operations': operations,
+        })
+        self.t_sample = t
+        self.lines_sampled = self.lines
+        self.ops_sampled = self.ops
+
+    def report(self, parser):
+        self.sample(parser, force=True)
+        seconds = self.clock() - self.t_start
+
+        return {
+            'lines': self.lines,
+            'ops': self.ops,
+            'seconds': seconds,
+            'lines_per_sec': round(self.lines / seconds) if seconds else None,
+            'ops_per_sec': round(self.ops / seconds) if seconds else None,
+            'read_seconds': self.read_seconds,
+            'sink_seconds': self.sink_seconds,
+            'categories': [
+                {
+                    'category': category,
+                    'count': count,
+                    'seconds': self.seconds_by_category[category],
+                    'usec_per_line': round(self.seconds_by_category[category] / count * 1e6, 3),
                 }
-                if m.group('qtime') is not None:
-                    result['qtime'] = float(m.group('qtime'))
-                if m.group('etime') is not None:
-                    result['etime'] = float(m.group('etime'))
-                op.set_result(error=error, result=result)
-                print(op.to_json())
-                conn.remove_op(op)
-                continue
+                for category, count in sorted(
+                    self.count_by_category.items(),
+                    key=lambda item: self.seconds_by_category[item[0]],
+                    reverse=True,
+                )
+            ],
+            'unmatched': self.count_by_category['unmatched'],
+            'errors': [
+                {
+                    'message': message,
+                    'count': count,
+                    'examples': parser.error_examples_by_message[message],
+                }
+                for message, count in parser.error_count_by_message.most_common()
+            ],
+            'tables': {
+                'connections': len(parser.conn_by_conn_id),
+                'connections_max': self.connections_max,
+                'operations': sum(len(conn.op_by_id) for conn in parser.conn_by_conn_id.values()),
+                'operations_max': self.operations_max,
+                'searches': sum(len(searches) for searches in parser.searches_by_pid.values()),
+            },
+            'timeline': self.timeline,
+        }
 
-            if chunk == 'UNBIND':
-                op = conn.get_op_by_id(op_id)
-                op.set_request('UNBIND')
-                op.set_result(error=0)
-                print(op.to_json())
-                conn.remove_op(op)
-                conn.unbind()
-                continue
 
-            op = conn.get_op_by_id(op_id)
+class StatsLogParser():
+    """slapd stats log parser
 
-            if chunk == 'STARTTLS':
-                op.set_request('STARTTLS')
+    Usage:
+        parser = StatsLogParser()
+        for op in parser.parse(lines):
+            print(op.to_json())
 
-            elif chunk.startswith('BIND '):
-                op.set_request('BIND')
-                if chunk.find(' method=') > 0:
-                    m = re_bind_method.match(chunk)
-                    if m is None:
-                        logger.error(f'Invalid `BIND method=` line: {line_n}: {line}')
+    parse() yields completed Operation records. If since and/or until
+    (POSIX timestamp) are given, operations completed before since are
+    not yielded and parsing stops at the first line logged after until.
+    on_diagnostic is called with diagnostics not attributed to any
+    operation or connection. year is used for legacy syslog timestamps
+    instead of guessing from the current date. stats is a ParserStats
+    to instrument the parser with.
+
+    If sample (0 < sample <= 1) is given, only connections selected by
+    sampled() are parsed and operations carry sample_weight (1 / sample).
+    Lines of the other connections are dropped by a prefix scan before
+    the regex matching.
+
+    Invalid and unknown lines are logged with sampling: The first
+    error_log_burst lines of each kind, then every power of 2 in count.
+    """
+
+    error_log_burst = 10
+    error_examples_max = 3
+
+    def __init__(self, since=None, until=None, on_diagnostic=None, year=None, stats=None, sample=None):
+        self.since = since
+        self.until = until
+        self.on_diagnostic = on_diagnostic
+        self.stats = stats
+        self.sample = sample
+        ## No need to scan lines to sample all
+        self.sample_threshold = None if sample is None or sample >= 1 else int(sample * 0x100000000)
+        self.error_count_by_message = collections.Counter()
+        self.error_examples_by_message = collections.defaultdict(list)
+        self.line_n = 0
+        self.year = year
+        self.year_guessed = year is not None
+        self.conn_by_conn_id = {}
+        ## SEARCH operations in flight in each slapd process with their
+        ## search_index_keys(), the operations by (pid, key) as ordered
+        ## sets to attribute "not indexed" diagnostics (which have no
+        ## `conn=`) to, and those of unsampled connections (`conn=ID op=ID`)
+        self.searches_by_pid = collections.defaultdict(dict)
+        self.searches_by_pid_key = {}
+        self.unsampled_searches_by_pid = collections.defaultdict(set)
+
+    def sampled(self, hostname, conn_id_str):
+        """Return whether a connection is sampled (by CRC-32 of hostname and conn_id)"""
+
+        return zlib.crc32(f'{hostname} {conn_id_str}'.encode()) < self.sample_threshold
+
+    def error(self, message, line):
+        """Log an invalid or unknown line (sampled)"""
+
+        self.error_count_by_message[message] += 1
+        count = self.error_count_by_message[message]
+        examples = self.error_examples_by_message[message]
+        if len(examples) < self.error_examples_max:
+            examples.append(f'{self.line_n}: {line}')
+        if count <= self.error_log_burst or not count & (count - 1):
+            logger.error('%s: %d: %s (#%d)', message, self.line_n, line, count)
+
+    def log_error_summary(self):
+        for message, count in self.error_count_by_message.items():
+            if count > self.error_log_burst:
+                logger.error('%s: %d times in total', message, count)
+
+    def parse_diagnostic_line(self, line):
+        m = re_diag_line.match(line)
+        if m is None:
+            return
+        diagnostic = parse_diagnostic(m.group('message'))
+        if diagnostic is None:
+            return
+        if (
+            self.sample_threshold is not None
+            and 'conn' in diagnostic
+            and not self.sampled(m.group('hostname'), str(diagnostic['conn']))
+        ):
+            return
+        if not self.year_guessed:
+            self.year = guess_year(m)
+            self.year_guessed = True
+        diagnostic = {
+            'line_n': self.line_n,
+            'timestamp': match_datetime(m, self.year).isoformat(),
+            **diagnostic,
+        }
+
+        if diagnostic['type'] == 'not_indexed':
+            ## Any of the searches in flight in the slapd process (in the
+            ## worker threads) with a non-negated assertion for the
+            ## attribute and index type may have logged this. Attribute
+            ## to the search only if it is the only candidate
+            pid = m.group('pid')
+            candidates = self.searches_by_pid_key.get((pid, (diagnostic['attr'].lower(), diagnostic['index'])), ())
+            candidates_any = self.searches_by_pid_key.get((pid, None), ())
+            ## Filters of unsampled searches are unknown
+            candidates_n = len(candidates) + len(candidates_any) + len(self.unsampled_searches_by_pid.get(pid, ()))
+            if candidates_n == 1 and (candidates or candidates_any):
+                next(iter(candidates or candidates_any)).add_diagnostic(diagnostic)
+                return
+            if candidates_n > 1:
+                diagnostic['ambiguous'] = candidates_n
+        else:
+            conn = self.conn_by_conn_id.get(diagnostic.get('conn'))
+            if conn is None:
+                fd = diagnostic['fd']
+                for conn in self.conn_by_conn_id.values():
+                    if conn.fd == fd:
+                        break
+                else:
+                    conn = None
+            if conn is not None:
+                conn.add_diagnostic(diagnostic)
+                return
+
+        if self.on_diagnostic is not None:
+            self.on_diagnostic(diagnostic)
+
+    def track_search(self, pid, op):
+        """Track a search in flight by the indexes it may use"""
+
+        keys = search_index_keys(op.filter)
+        self.searches_by_pid[pid][op] = keys
+        for key in keys:
+            searches = self.searches_by_pid_key.get((pid, key))
+            if searches is None:
+                searches = self.searches_by_pid_key[(pid, key)] = {}
+            searches[op] = None
+
+    def untrack_search(self, pid, op):
+        keys = self.searches_by_pid[pid].pop(op, None)
+        if keys is None:
+            return
+        for key in keys:
+            searches = self.searches_by_pid_key[(pid, key)]
+            del searches[op]
+            if not searches:
+                del self.searches_by_pid_key[(pid, key)]
+
+    def track_unsampled_search(self, line, tag_i, conn_i):
+        """Track a search in flight on an unsampled connection"""
+
+        pid = line[line.find('[', tag_i) + 1:conn_i - 2]
+        searches = self.unsampled_searches_by_pid[pid]
+        conn_op = line[conn_i + 1:line.find(' ', line.find(' ', conn_i + 6) + 1)]
+        if ' SRCH base=' in line:
+            searches.add(conn_op)
+        elif ' SEARCH RESULT ' in line:
+            searches.discard(conn_op)
+        else:
+            conn_prefix = line[conn_i + 1:line.find(' ', conn_i + 6) + 1]
+            searches.difference_update([search for search in searches if search.startswith(conn_prefix)])
+
+    def parse(self, lines):
+        conn_by_conn_id = self.conn_by_conn_id
+        since = self.since
+        until = self.until
+        stats = self.stats
+        if stats is not None:
+            lines = stats.timed(lines)
+            clock = stats.clock
+        sample_threshold = self.sample_threshold
+        sample_weight = None if self.sample is None else 1 / self.sample
+        category = None
+
+        for line in lines:
+            if stats is not None:
+                stats.add_line(category)
+                if not self.line_n & 0xfff:
+                    stats.sample(self)
+            self.line_n += 1
+            line = line.rstrip()
+
+            if sample_threshold is not None:
+                ## `TIMESTAMP HOSTNAME TAG[PID]: conn=ID ...`
+                conn_i = line.find(' conn=')
+                if conn_i > 0:
+                    tag_i = line.rfind(' ', 0, conn_i)
+                    hostname = line[line.rfind(' ', 0, tag_i) + 1:tag_i]
+                    conn_id_str = line[conn_i + 6:line.find(' ', conn_i + 6)]
+                    if not self.sampled(hostname, conn_id_str):
+                        ## Track searches in flight not to attribute their diagnostics to others
+                        if ' SRCH base=' in line or ' SEARCH RESULT ' in line or (' fd=' in line and ' closed' in line):
+                            self.track_unsampled_search(line, tag_i, conn_i)
+                        category = 'unsampled'
                         continue
-                    op.request['dn'] = m.group('dn')
-                    op.request['method'] = bind_method_by_n[int(m.group('method_n'))]
-                elif chunk.find(' mech=') > 0:
-                    m = re_bind_mech.match(chunk)
+
+            m = re_stats_line.match(line)
+            if m is None:
+                if ' <= ' in line or ' connection_' in line:
+                    category = 'diagnostic'
+                    self.parse_diagnostic_line(line)
+                else:
+                    category = 'unmatched'
+                continue
+
+            if not self.year_guessed:
+                self.year = guess_year(m)
+                self.year_guessed = True
+
+            conn_id = int(m.group('conn_id'))
+            conn = conn_by_conn_id.get(conn_id)
+            if conn is None:
+                conn = conn_by_conn_id[conn_id] = Connection(conn_id)
+            conn.line_n = self.line_n
+            conn.datetime = match_datetime(m, self.year)
+            if until is not None and conn.datetime.timestamp() > until:
+                break
+
+            chunk = m.group('chunk')
+            if m.group('what') == 'fd':
+                fd = int(m.group('id'))
+                op = Operation()
+
+                if chunk.startswith('ACCEPT from '):
+                    category = 'ACCEPT'
+                    op.set_request(conn, 'CONNECT')
+                    ## FIXME: Check if conn_id is already exists
+                    conn.fd = fd
+                    conn.dn = 'ANONYMOUS'
+
+                    chunks = chunk.split(' ')
+                    if chunks[2].startswith('IP='):
+                        conn.source = chunks[2][3:]
+                    elif chunks[2].startswith('PATH='):
+                        conn.source = chunks[2][5:]
+                    else:
+                        self.error('Unknown `ACCEPT` line', line)
+                        conn.source = 'UNKNOWN'
+                    op.set_result(conn, 0)
+                elif chunk.startswith('TLS '):
+                    category = 'TLS'
+                    conn.tls = True
+                    continue
+                elif chunk.startswith('closed'):
+                    category = 'closed'
+                    if conn.disconnect_op is not None:
+                        op = conn.disconnect_op
+                    op.set_request(conn, 'DISCONNECT')
+                    try:
+                        op.text = chunk[chunk.index('(') + 1:-1]
+                    except ValueError:
+                        pass
+                    op.set_result(conn, 0)
+                    try:
+                        del conn_by_conn_id[conn_id]
+                    except KeyError:
+                        pass
+                    if self.searches_by_pid.get(m.group('pid')):
+                        for pending_op in conn.op_by_id.values():
+                            self.untrack_search(m.group('pid'), pending_op)
+
+                    ## FIXME: Yield pending operation(s)?
+                else:
+                    category = 'unknown'
+                    self.error('Invalid `fd` line', line)
+                    continue
+
+            elif m.group('what') == 'op':
+                op_id = int(m.group('id'))
+                pid = m.group('pid')
+
+                if chunk.startswith('RESULT '):
+                    category = 'RESULT'
+                    op = conn.get_op_by_id(op_id)
+                    m = re_result.match(chunk)
                     if m is None:
-                        logger.error(f'Invalid `BIND mech=` line: {line_n}: {line}')
+                        self.error('Invalid `RESULT` line', line)
                         continue
-                    if 'dn' in m.groupdict():
-                        op.request['dn'] = m.group('dn')
-                    else:
-                        op.request['dn'] = 'ANONYMOUS'
-                    op.request['mech'] = m.group('mech')
-                    op.request['ssf'] = int(m.group('ssf'))
-                    if 'bind_ssf' in m.groupdict():
-                        op.request['bind_ssf'] = int(m.group('bind_ssf'))
-                elif chunk.find(' authcid=') > 0:
-                    m = re_bind_authcid.match(chunk)
+                    error = int(m.group('error'))
+                    op.text = m.group('text')
+                    if m.group('tag') is not None:
+                        op.tag = int(m.group('tag'))
+                    op.oid = m.group('oid')
+                    if m.group('qtime') is not None:
+                        op.qtime = float(m.group('qtime'))
+                    if m.group('etime') is not None:
+                        op.etime = float(m.group('etime'))
+                    op.set_result(conn, error)
+                    conn.remove_op(op)
+                    if op.type == 'SEARCH':
+                        self.untrack_search(pid, op)
+
+                    if op.type == 'BIND' and error == 0:
+                        conn.dn = op.request_dn
+                    elif op.type == 'STARTTLS' and error == 0:
+                        conn.tls = True
+
+                elif chunk.startswith('SEARCH RESULT '):
+                    category = 'SEARCH RESULT'
+                    op = conn.get_op_by_id(op_id)
+                    m = re_search_result.match(chunk)
                     if m is None:
-                        logger.error(f'Invalid `BIND authcid=` line: {line_n}: {line}')
+                        self.error('Invalid `SEARCH RESULT` line', line)
                         continue
-                    op.request['authcid'] = m.group('authcid')
-                    op.request['authzid'] = m.group('authzid')
+                    error = int(m.group('error'))
+                    op.nentries = int(m.group('nentries'))
+                    op.tag = int(m.group('tag'))
+                    op.text = m.group('text')
+                    if m.group('qtime') is not None:
+                        op.qtime = float(m.group('qtime'))
+                    if m.group('etime') is not None:
+                        op.etime = float(m.group('etime'))
+                    op.set_result(conn, error)
+                    conn.remove_op(op)
+                    self.untrack_search(pid, op)
+
+                elif chunk == 'UNBIND':
+                    category = 'UNBIND'
+                    op = conn.get_op_by_id(op_id)
+                    op.set_request(conn, 'UNBIND')
+                    op.set_result(conn, 0)
+                    conn.remove_op(op)
+                    conn.unbind()
+
                 else:
-                    logger.error(f'Invalid `BIND` line: {line_n}: {line}')
+                    category = self.parse_request(conn, conn.get_op_by_id(op_id), chunk, pid, line)
                     continue
 
-            elif chunk.startswith('WHOAMI'):
-                op.set_request('WHOAMI')
+            else:
+                category = 'unknown'
+                self.error('Unknown line', line)
+                continue
 
-                m = re_whoami.match(chunk)
+            if since is None or op.result_datetime.timestamp() >= since:
+                op.sample_weight = sample_weight
+                if stats is None:
+                    yield op
+                else:
+                    stats.ops += 1
+                    t = clock()
+                    yield op
+                    stats.sink_seconds += clock() - t
+
+        if stats is not None:
+            stats.add_line(category)
+        self.log_error_summary()
+
+    def parse_request(self, conn, op, chunk, pid, line):
+        """Parse a request line and return its category"""
+
+        if chunk == 'STARTTLS':
+            op.set_request(conn, 'STARTTLS')
+            return 'STARTTLS'
+
+        elif chunk.startswith('BIND '):
+            op.set_request(conn, 'BIND')
+            if chunk.find(' method=') > 0:
+                m = re_bind_method.match(chunk)
                 if m is None:
-                    logger.error(f'Invalid `WHOAMI` line: {line_n}: {line}')
-                    continue
+                    self.error('Invalid `BIND method=` line', line)
+                    return 'BIND method'
+                op.request_dn = m.group('dn')
+                op.method = bind_method_by_n[int(m.group('method_n'))]
+                return 'BIND method'
+            elif chunk.find(' mech=') > 0:
+                m = re_bind_mech.match(chunk)
+                if m is None:
+                    self.error('Invalid `BIND mech=` line', line)
+                    return 'BIND mech'
+                if m.group('dn') is not None:
+                    op.request_dn = m.group('dn')
+                else:
+                    op.request_dn = 'ANONYMOUS'
+                op.mech = m.group('mech')
+                op.ssf = int(m.group('ssf'))
+                if m.group('bind_ssf') is not None:
+                    op.bind_ssf = int(m.group('bind_ssf'))
+                return 'BIND mech'
+            elif chunk.find(' authcid=') > 0:
+                m = re_bind_authcid.match(chunk)
+                if m is None:
+                    self.error('Invalid `BIND authcid=` line', line)
+                    return 'BIND authcid'
+                op.authcid = m.group('authcid')
+                op.authzid = m.group('authzid')
+                return 'BIND authcid'
+            else:
+                self.error('Invalid `BIND` line', line)
+                return 'unknown'
+
+        elif chunk.startswith('WHOAMI'):
+            op.set_request(conn, 'WHOAMI')
+
+            m = re_whoami.match(chunk)
+            if m is None:
+                self.error('Invalid `WHOAMI` line', line)
+            return 'WHOAMI'
+
+        elif chunk.startswith('SRCH base='):
+            op.set_request(conn, 'SEARCH')
+
+            m = re_search_base.match(chunk)
+            if m is None:
+                self.error('Invalid `SEARCH base=` line', line)
+                self.track_search(pid, op)
+                return 'SRCH base'
 
-            elif chunk.startswith('SRCH base='):
-                op.set_request('SEARCH')
+            op.base = m.group('base')
+            op.scope = scope_by_n.get(int(m.group('scope_n')))
+            op.deref = deref_by_n.get(int(m.group('deref_n')))
+            op.filter = m.group('filter')
+            self.track_search(pid, op)
+            return 'SRCH base'
 
-                m = re_search_base.match(chunk)
-                if m is None:
-                    logger.error(f'Invalid `SEARCH base=` line: {line_n}: {line}')
-                    continue
+        elif chunk.startswith('SRCH attr='):
+            op.attrs = chunk[10:].split(' ')
+            return 'SRCH attr'
 
-                op.request['base'] = m.group('base')
-                op.request['scope'] = scope_by_n.get(int(m.group('scope_n')))
-                op.request['deref'] = deref_by_n.get(int(m.group('deref_n')))
-                op.request['filter'] = m.group('filter')
+        elif chunk.startswith('CMP '):
+            op.set_request(conn, 'COMPARE')
 
-            elif chunk.startswith('SRCH attr='):
-                op.request['attrs'] = chunk[10:].split(' ')
+            m = re_cmp.match(chunk)
+            if m is None:
+                self.error('Invalid `CMP` line', line)
+                return 'CMP'
+            op.request_dn = m.group('dn')
+            op.attr = m.group('attr')
+            return 'CMP'
 
-            elif chunk.startswith('CMP '):
-                op.set_request('COMPARE')
+        elif chunk.startswith('ADD dn="'):
+            op.set_request(conn, 'ADD')
+            op.request_dn = chunk[8:-1]
+            return 'ADD'
 
-                op.request['attrs'] = chunk[10:].split(' ')
-                m = re_cmp.match(chunk)
-                if m is None:
-                    logger.error(f'Invalid `CMP` line: {line_n}: {line}')
+        elif chunk.startswith('DEL dn="'):
+            op.set_request(conn, 'DELETE')
+            op.request_dn = chunk[8:-1]
+            return 'DEL'
+
+        elif chunk.startswith('MOD dn='):
+            op.set_request(conn, 'MODIFY')
+
+            m = re_modify_dn.match(chunk)
+            if m is None:
+                self.error('Invalid `MOD dn=` line', line)
+                return 'MOD dn'
+            op.request_dn = m.group('dn')
+            return 'MOD dn'
+
+        elif chunk.startswith('MOD attr='):
+            op.attrs = chunk[9:].split(' ')
+            return 'MOD attr'
+
+        elif chunk.startswith('MODRDN dn="'):
+            op.set_request(conn, 'MODIFYRDN')
+            op.request_dn = chunk[11:-1]
+            return 'MODRDN'
+
+        elif chunk.startswith('PASSMOD'):
+            op.set_request(conn, 'PASSWORD')
+            if chunk.startswith('PASSMOD id="'):
+                rq_index = chunk.rfind('"')
+                op.request_dn = chunk[12:rq_index]
+                chunk = chunk[rq_index + 1:]
+            ## New password is supplied
+            op.new = (chunk.find(' new') >= 0)
+            ## Old password is supplied
+            op.old = (chunk.find(' old') >= 0)
+            return 'PASSMOD'
+
+        elif chunk.startswith('EXT '):  # FIXME: conn=100931 op=0 EXT oid=...
+            return 'EXT'
+        elif chunk.startswith('ABANDON msg='):  # FIXME
+            return 'ABANDON'
+
+        ## FIXME: Support CANCEL WHOAMI PROXYAUTHZ DENIED
+
+        self.error('Unknown line', line)
+        return 'unknown'
+
+
+def parse(lines, **kwargs):
+    """Parse slapd stats log lines and yield completed Operation records
+
+    See StatsLogParser for keyword arguments.
+    """
+
+    return StatsLogParser(**kwargs).parse(lines)
+
+
+class JSONSink():
+    """Sink to write operations as JSON lines"""
+
+    def __init__(self, file=None):
+        self.file = file
+
+    def add(self, op):
+        print(op.to_json(), file=self.file)
+
+    def add_diagnostic(self, diagnostic):
+        logger.debug('Unattributed diagnostic: %(line_n)s: %(text)s', diagnostic)
+
+    def report(self):
+        return None
+
+
+def summarize(values):
+    """Return total, mean, nearest-rank percentiles and max of values"""
+
+    if not values:
+        return None
+
+    values = sorted(values)
+    n = len(values)
+    total = sum(values)
+
+    return {
+        'total': total,
+        'mean': total / n,
+        'p50': values[math.ceil(n * 0.50) - 1],
+        'p90': values[math.ceil(n * 0.90) - 1],
+        'p99': values[math.ceil(n * 0.99) - 1],
+        'max': values[-1],
+    }
+
+
+class FilterReport():
+    """Aggregate SEARCH operations by filter shape, base and scope"""
+
+    def __init__(self, top=20):
+        self.top = top
+        self.search_by_key = {}
+
+    def add(self, op):
+        if op.type != 'SEARCH' or op.filter is None:
+            return
+
+        shape, assertions = filter_fingerprint(op.filter)
+        key = (shape, op.base, op.scope)
+        search = self.search_by_key.get(key)
+        if search is None:
+            search = self.search_by_key[key] = {
+                'assertions': assertions,
+                'count': 0,
+                'etimes': array.array('d'),
+                'nentries': array.array('q'),
+            }
+
+        search['count'] += 1
+        if op.etime is not None:
+            search['etimes'].append(op.etime)
+        if op.nentries is not None:
+            search['nentries'].append(op.nentries)
+
+    def report(self):
+        searches = []
+        for (shape, base, scope), search in self.search_by_key.items():
+            searches.append({
+                'fingerprint': shape,
+                'base': base,
+                'scope': scope,
+                'count': search['count'],
+                'etime': summarize(search['etimes']),
+                'nentries': summarize(search['nentries']),
+                'assertions': [list(assertion) for assertion in search['assertions']],
+            })
+        searches.sort(key=lambda s: s['etime']['total'] if s['etime'] else 0.0, reverse=True)
+
+        ## Attribute and index type combinations in the expensive searches
+        index_by_key = {}
+        for search in searches[:self.top]:
+            for attr, match in search['assertions']:
+                ## No index type for negated (`!eq` and so on) and extensible assertions
+                index_type = index_type_by_match.get(match)
+                if index_type is None:
                     continue
-                op.request['dn'] = m.group('dn')
-                op.request['attr'] = m.group('attr')
+                index = index_by_key.get((attr, index_type))
+                if index is None:
+                    index = index_by_key[(attr, index_type)] = {
+                        'attr': attr,
+                        'index': index_type,
+                        'fingerprints': 0,
+                        'count': 0,
+                        'etime_total': 0.0,
+                    }
+                index['fingerprints'] += 1
+                index['count'] += search['count']
+                if search['etime']:
+                    index['etime_total'] += search['etime']['total']
+        indexes = sorted(index_by_key.values(), key=lambda i: i['etime_total'], reverse=True)
+
+        return {
+            'searches': searches,
+            'indexes': indexes,
+        }
 
-            elif chunk.startswith('ADD dn="'):
-                op.set_request('ADD')
-                op.request['dn'] = chunk[8:-1]
 
-            elif chunk.startswith('DEL dn="'):
-                op.set_request('DELETE')
-                op.request['dn'] = chunk[8:-1]
+def source_host(source):
+    """Strip the port number from a connection source address"""
+
+    if source is None or source.startswith('/'):
+        return source
+
+    return source.rsplit(':', 1)[0]
+
+
+class UnindexedReport():
+    """Aggregate "not indexed" diagnostics by attribute and index type"""
+
+    def __init__(self, top=20):
+        self.top = top
+        self.unindexed_by_key = {}
+        self.unattributed_by_key = collections.Counter()
+        self.ambiguous_by_key = collections.Counter()
+
+    def _unindexed(self, key):
+        unindexed = self.unindexed_by_key.get(key)
+        if unindexed is None:
+            unindexed = self.unindexed_by_key[key] = {
+                'count': 0,
+                'searches': 0,
+                'etime_total': 0.0,
+                'sources': collections.Counter(),
+                'dns': collections.Counter(),
+                'fingerprints': collections.Counter(),
+            }
+
+        return unindexed
+
+    def add(self, op):
+        if not op.diagnostics or op.type != 'SEARCH':
+            return
+
+        keys = collections.Counter(
+            (diagnostic['attr'], diagnostic['index'])
+            for diagnostic in op.diagnostics
+            if diagnostic['type'] == 'not_indexed'
+        )
+        if not keys:
+            return
+
+        etime = op.etime
+        source = source_host(op.source)
+        dn = op.dn
+        shape = filter_fingerprint(op.filter)[0] if op.filter is not None else None
+        for key, count in keys.items():
+            unindexed = self._unindexed(key)
+            unindexed['count'] += count
+            unindexed['searches'] += 1
+            if etime is not None:
+                unindexed['etime_total'] += etime
+            unindexed['sources'][source] += 1
+            unindexed['dns'][dn] += 1
+            unindexed['fingerprints'][shape] += 1
+
+    def add_diagnostic(self, diagnostic):
+        if diagnostic['type'] == 'not_indexed':
+            key = (diagnostic['attr'], diagnostic['index'])
+            self.unattributed_by_key[key] += 1
+            if 'ambiguous' in diagnostic:
+                self.ambiguous_by_key[key] += 1
+
+    def report(self):
+        unindexed_list = []
+        for (attr, index), unindexed in self.unindexed_by_key.items():
+            unindexed_list.append({
+                'attr': attr,
+                'index': index,
+                'count': unindexed['count'],
+                'searches': unindexed['searches'],
+                'etime_total': unindexed['etime_total'],
+                'sources': unindexed['sources'].most_common(self.top),
+                'dns': unindexed['dns'].most_common(self.top),
+                'fingerprints': unindexed['fingerprints'].most_common(self.top),
+            })
+        unindexed_list.sort(key=lambda u: u['etime_total'], reverse=True)
+
+        return {
+            'unindexed': unindexed_list,
+            'unattributed': [
+                {
+                    'attr': attr,
+                    'index': index,
+                    'count': count,
+                    'ambiguous': self.ambiguous_by_key[(attr, index)],
+                }
+                for (attr, index), count in self.unattributed_by_key.most_common()
+            ],
+        }
 
-            elif chunk.startswith('MOD dn='):
-                op.set_request('MODIFY')
 
-                m = re_modify_dn.match(chunk)
-                if m is None:
-                    logger.error(f'Invalid `MOD dn=` line: {line_n}: {line}')
-                    continue
-                op.request['dn'] = m.group('dn')
-
-            elif chunk.startswith('MOD attr='):
-                op.request['attrs'] = chunk[9:].split(' ')
-
-            elif chunk.startswith('MODRDN dn="'):
-                op.set_request('MODIFYRDN')
-                op.request['dn'] = chunk[11:-1]
-
-            elif chunk.startswith('PASSMOD'):
-                op.set_request('PASSWORD')
-                request = op.request
-                if chunk.startswith('PASSMOD id="'):
-                    rq_index = chunk.rfind('"')
-                    request['dn'] = chunk[12:rq_index]
-                    chunk = chunk[rq_index + 1:]
-                ## New password is supplied
-                request['new'] = (chunk.find(' new') >= 0)
-                ## Old password is supplied
-                request['old'] = (chunk.find(' old') >= 0)
-
-            elif chunk.startswith('EXT '):  # FIXME: conn=100931 op=0 EXT oid=...
-                continue
-            elif chunk.startswith('ABANDON msg='):  # FIXME
+class RepeatReport():
+    """Detect repeated searches and simulate result caches
+
+    A search is keyed by the bound DN, base, scope, filter and requested
+    attributes, and is a repeat if the same key was requested within
+    window seconds. Recent keys are kept in an LRU of at most max_keys.
+    Repeated keys are counted in a table pruned to the most frequent
+    top_keys (each count may be overestimated by up to its count_error),
+    and LRU caches of each size in cache_sizes with each TTL in cache_ttls
+    are simulated.
+    """
+
+    def __init__(self, top=20, window=60.0, max_keys=100000, top_keys=1000, cache_sizes=(100, 1000, 10000), cache_ttls=(1.0, 10.0, 60.0)):
+        self.top = top
+        self.window = window
+        self.max_keys = max_keys
+        self.top_keys = top_keys
+        self.searches = 0
+        self.repeats = 0
+        self.etime_total = 0.0
+        self.repeat_etime_total = 0.0
+        self.evicted = 0
+        ## key -> (timestamp, etime) of the last request (in the order of requests)
+        self.last_by_key = collections.OrderedDict()
+        ## key -> {'count', 'count_error', 'repeats', 'etime_total', ...}
+        self.query_by_key = {}
+        self.count_floor = 0
+        self.caches = [
+            {
+                'size': size,
+                'ttl': ttl,
+                'hits': 0,
+                'etime_saved': 0.0,
+                'ts_by_key': collections.OrderedDict(),
+            }
+            for size in cache_sizes
+            for ttl in cache_ttls
+        ]
+
+    def add(self, op):
+        if op.type != 'SEARCH' or op.request_datetime is None:
+            return
+
+        key = (op.dn, op.base, op.scope, op.filter, tuple(op.attrs) if op.attrs else None)
+        ts = op.request_datetime.timestamp()
+        etime = op.etime or 0.0
+        self.searches += 1
+        self.etime_total += etime
+
+        last_by_key = self.last_by_key
+        last_ts, last_etime = last_by_key.pop(key, (None, None))
+        repeat = last_ts is not None and ts - last_ts <= self.window
+        last_by_key[key] = (ts, etime)
+        ## Expire keys out of the window, or the least recent if full
+        while last_by_key:
+            oldest_key, (oldest_ts, _) = next(iter(last_by_key.items()))
+            if ts - oldest_ts <= self.window and len(last_by_key) <= self.max_keys:
+                break
+            if ts - oldest_ts <= self.window:
+                self.evicted += 1
+            del last_by_key[oldest_key]
+
+        if repeat:
+            self.repeats += 1
+            self.repeat_etime_total += etime
+            query = self.query_by_key.get(key)
+            if query is None:
+                query = self.query_by_key[key] = {
+                    'count': self.count_floor + 1,
+                    'count_error': self.count_floor,
+                    'repeats': self.count_floor,
+                    'etime_total': last_etime,
+                    'repeat_etime_total': 0.0,
+                    'sources': collections.Counter(),
+                }
+                if len(self.query_by_key) > self.top_keys * 2:
+                    self._prune()
+            query['repeats'] += 1
+            query['repeat_etime_total'] += etime
+        else:
+            query = self.query_by_key.get(key)
+        if query is not None:
+            query['count'] += 1
+            query['etime_total'] += etime
+            query['sources'][source_host(op.source)] += 1
+
+        for cache in self.caches:
+            ts_by_key = cache['ts_by_key']
+            cached_ts = ts_by_key.get(key)
+            if cached_ts is not None and ts - cached_ts <= cache['ttl']:
+                cache['hits'] += 1
+                cache['etime_saved'] += etime
+                ts_by_key.move_to_end(key)
                 continue
+            ts_by_key[key] = ts
+            ts_by_key.move_to_end(key)
+            if len(ts_by_key) > cache['size']:
+                ts_by_key.popitem(last=False)
+
+    def _prune(self):
+        """Keep the top_keys most repeated keys"""
+
+        queries = sorted(self.query_by_key.items(), key=lambda item: item[1]['count'], reverse=True)
+        self.count_floor = queries[self.top_keys][1]['count']
+        self.query_by_key = dict(queries[:self.top_keys])
+
+    def report(self):
+        queries = []
+        for (dn, base, scope, filter_str, attrs), query in self.query_by_key.items():
+            queries.append({
+                'dn': dn,
+                'base': base,
+                'scope': scope,
+                'filter': filter_str,
+                'attrs': list(attrs) if attrs else None,
+                'count': query['count'],
+                'count_error': query['count_error'],
+                'repeats': query['repeats'],
+                'etime_total': query['etime_total'],
+                'repeat_etime_total': query['repeat_etime_total'],
+                'sources': query['sources'].most_common(self.top),
+            })
+        queries.sort(key=lambda q: q['repeat_etime_total'], reverse=True)
+
+        return {
+            'window': self.window,
+            'searches': self.searches,
+            'repeats': self.repeats,
+            'repeat_ratio': self.repeats / self.searches if self.searches else None,
+            'etime_total': self.etime_total,
+            'repeat_etime_total': self.repeat_etime_total,
+            'evicted': self.evicted,
+            'queries': queries[:self.top],
+            'caches': [
+                {
+                    'size': cache['size'],
+                    'ttl': cache['ttl'],
+                    'hits': cache['hits'],
+                    'hit_rate': cache['hits'] / self.searches if self.searches else None,
+                    'etime_saved': cache['etime_saved'],
+                }
+                for cache in self.caches
+            ],
+        }
 
-            ## FIXME: Support CANCEL WHOAMI PROXYAUTHZ DENIED
 
+class ConcurrencyReport():
+    """Reconstruct per-second concurrency of operations from qtime and etime
+
+    slapd logs a request when a worker thread starts to execute it, so an
+    operation is queued for qtime before its request timestamp and then
+    executed until etime after it was queued (etime includes qtime in
+    OpenLDAP 2.5+; qtime is 0 for OpenLDAP 2.4). Each second is written
+    as a JSON line once no more operation can start in it: results are
+    logged up to `max_etime` seconds after requests, and longer
+    operations are clamped to the first second not yet written and
+    counted as late. The summary by report() has `"type": "summary"` and
+    is printed as the last JSON line.
+    """
+
+    ## Print report() as a JSON line after the per-second lines
+    json_lines = True
+
+    def __init__(self, threads=16, max_etime=60.0, file=None):
+        self.threads = threads
+        self.max_etime = max_etime
+        self.file = file
+        self.tzinfo = None
+        self.events_by_second = collections.defaultdict(list)
+        self.started_by_second = collections.Counter()
+        ## The first second not written yet
+        self.next_second = None
+        self.latest = -math.inf
+        self.queued = 0
+        self.executing = 0
+        self.late = 0
+        self.seconds = 0
+        self.peak = None
+        self.peak_queued = None
+        self.starved_seconds = 0
+
+    def add(self, op):
+        if op.type in ('CONNECT', 'DISCONNECT') or op.request_datetime is None or op.etime is None:
+            return
+
+        t_request = op.request_datetime.timestamp()
+        if self.tzinfo is None:
+            self.tzinfo = op.request_datetime.tzinfo
+        etime = op.etime
+        qtime = min(op.qtime or 0.0, etime)
+        t_queued = t_request - qtime
+        t_done = t_queued + etime
+
+        if self.next_second is not None and t_queued < self.next_second:
+            self.late += 1
+            t_queued = self.next_second
+            t_request = max(t_request, t_queued)
+            t_done = max(t_done, t_request)
+        second = int(t_queued)
+        self.started_by_second[second] += 1
+        events_by_second = self.events_by_second
+        events_by_second[second].append((t_queued, 1, 0))
+        events_by_second[int(t_request)].append((t_request, -1, 1))
+        events_by_second[int(t_done)].append((t_done, 0, -1))
+
+        result_ts = op.result_datetime.timestamp()
+        if result_ts > self.latest:
+            self.latest = result_ts
+            self.flush(int(result_ts - self.max_etime))
+
+    def flush(self, until_second):
+        """Write seconds before until_second"""
+
+        if self.next_second is None:
+            if not self.events_by_second:
+                return
+            self.next_second = min(self.events_by_second)
+
+        for second in range(self.next_second, until_second):
+            self.write_second(second)
+        self.next_second = max(self.next_second, until_second)
+
+    def write_second(self, second):
+        queued = self.queued
+        executing = self.executing
+        queued_max = queued
+        executing_max = executing
+        in_flight_max = queued + executing
+        ## Any operation waited for a thread while all threads were busy
+        starved = queued > 0 and executing >= self.threads
+        queued_sum = executing_sum = 0.0
+        t_prev = second
+
+        ## Decrements first at the same time not to count false peaks
+        for t, d_queued, d_executing in sorted(
+            self.events_by_second.pop(second, ()),
+            key=lambda event: (event[0], event[1] + event[2]),
+        ):
+            queued_sum += queued * (t - t_prev)
+            executing_sum += executing * (t - t_prev)
+            t_prev = t
+            queued += d_queued
+            executing += d_executing
+            queued_max = max(queued_max, queued)
+            executing_max = max(executing_max, executing)
+            in_flight_max = max(in_flight_max, queued + executing)
+            if queued > 0 and executing >= self.threads:
+                starved = True
+        queued_sum += queued * (second + 1 - t_prev)
+        executing_sum += executing * (second + 1 - t_prev)
+        self.queued = queued
+        self.executing = executing
+
+        row = {
+            'timestamp': datetime.datetime.fromtimestamp(second, self.tzinfo).isoformat(),
+            'started': self.started_by_second.pop(second, 0),
+            'in_flight_max': in_flight_max,
+            'in_flight_avg': round(queued_sum + executing_sum, 6),
+            'queued_max': queued_max,
+            'queued_avg': round(queued_sum, 6),
+            'executing_max': executing_max,
+            'executing_avg': round(executing_sum, 6),
+            'peak_to_threads': in_flight_max / self.threads,
+            'starved': starved,
+        }
+        print(json.dumps(row), file=self.file)
+
+        self.seconds += 1
+        if self.peak is None or in_flight_max > self.peak['in_flight_max']:
+            self.peak = row
+        if self.peak_queued is None or queued_max > self.peak_queued['queued_max']:
+            self.peak_queued = row
+        if starved:
+            self.starved_seconds += 1
+
+    def report(self):
+        if self.events_by_second:
+            self.flush(max(self.events_by_second) + 1)
+
+        return {
+            'type': 'summary',
+            'threads': self.threads,
+            'seconds': self.seconds,
+            'starved_seconds': self.starved_seconds,
+            'late': self.late,
+            'peak': self.peak,
+            'peak_queued': self.peak_queued,
+        }
+
+
+def bind_dn_class(dn):
+    """Classify a bind DN by replacing its RDN value with `*`"""
+
+    if dn is None or dn in ('ANONYMOUS', 'UNBOUND', ''):
+        return (dn or 'ANONYMOUS').lower()
+
+    equal = dn.find('=')
+    comma = dn.find(',')
+    if equal < 0:
+        return dn
+    if comma < 0:
+        return dn[:equal + 1] + '*'
+
+    return dn[:equal + 1] + '*' + dn[comma:]
+
+
+def openmetrics_labels(labels):
+    return '{' + ','.join(
+        '%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels
+    ) + '}'
+
+
+class MetricsSink():
+    """Sink to keep operation metrics to be exported in OpenMetrics format
+
+    Counters and latency histograms are kept both cumulatively and for
+    the last `window` seconds. The window is a ring of `slots` slots and
+    its totals are updated incrementally as slots expire, so the cost of
+    render() depends only on the number of series, which is bounded by
+    `max_series` (bind DN classes beyond it are counted as `other`).
+    """
+
+    buckets = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, math.inf)
+
+    def __init__(self, window=60, slots=12, max_series=1000, clock=time.monotonic):
+        self.window = window
+        self.slot_seconds = window / slots
+        self.max_series = max_series
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.ops_total = collections.Counter()
+        self.durations_by_type = {}
+        self.window_ops = collections.Counter()
+        self.window_durations_by_type = {}
+        ## (slot number, ops counter, durations by type) of the window
+        self.slots = collections.deque()
+
+    def _new_durations(self):
+        ## Counts per bucket, then the number and sum of durations
+        return [0] * len(self.buckets) + [0, 0.0]
+
+    def _expire(self, now):
+        slot_n = int(now // self.slot_seconds)
+        if self.slots and self.slots[-1][0] == slot_n:
+            return self.slots[-1]
+
+        oldest_n = slot_n - int(self.window // self.slot_seconds) + 1
+        while self.slots and self.slots[0][0] < oldest_n:
+            _, ops, durations_by_type = self.slots.popleft()
+            self.window_ops.subtract(ops)
+            for op_type, durations in durations_by_type.items():
+                window_durations = self.window_durations_by_type[op_type]
+                for i, value in enumerate(durations):
+                    window_durations[i] -= value
+                if not window_durations[-2]:
+                    window_durations[-1] = 0.0  # Drop rounding errors
+        self.window_ops += collections.Counter()  # Drop zero counts
+
+        slot = (slot_n, collections.Counter(), {})
+        self.slots.append(slot)
+        return slot
+
+    def add(self, op):
+        op_type = op.type or 'UNKNOWN'
+        result = error_text_by_n.get(op.error, 'UNKNOWN')
+        key = (op_type, result, bind_dn_class(op.request_dn if op_type == 'BIND' else op.dn))
+        if key not in self.ops_total and len(self.ops_total) >= self.max_series:
+            key = (op_type, result, 'other')
+
+        etime = op.etime
+        if etime is not None:
+            bucket_i = bisect.bisect_left(self.buckets, etime)
+
+        with self.lock:
+            _, slot_ops, slot_durations_by_type = self._expire(self.clock())
+            self.ops_total[key] += 1
+            self.window_ops[key] += 1
+            slot_ops[key] += 1
+
+            if etime is None:
+                return
+            for durations_by_type in (self.durations_by_type, self.window_durations_by_type, slot_durations_by_type):
+                durations = durations_by_type.get(op_type)
+                if durations is None:
+                    durations = durations_by_type[op_type] = self._new_durations()
+                durations[bucket_i] += 1
+                durations[-2] += 1
+                durations[-1] += etime
+
+    def _render_histogram(self, lines, name, durations_by_type, gauge=False):
+        for op_type, durations in sorted(durations_by_type.items()):
+            n = 0
+            for le, count in zip(self.buckets, durations):
+                n += count
+                le = '+Inf' if le == math.inf else repr(le)
+                lines.append(f'{name}_bucket{openmetrics_labels((("type", op_type), ("le", le)))} {n}')
+            labels = openmetrics_labels((('type', op_type),))
+            lines.append(f'{name}_{"gcount" if gauge else "count"}{labels} {durations[-2]}')
+            lines.append(f'{name}_{"gsum" if gauge else "sum"}{labels} {durations[-1]}')
+
+    def render(self):
+        """Return metrics in OpenMetrics text format"""
+
+        with self.lock:
+            self._expire(self.clock())
+            lines = []
+
+            lines.append('# TYPE slapd_operations counter')
+            lines.append('# HELP slapd_operations Operations completed')
+            for (op_type, result, bind_class), n in sorted(self.ops_total.items()):
+                labels = openmetrics_labels((('type', op_type), ('result', result), ('bind_class', bind_class)))
+                lines.append(f'slapd_operations_total{labels} {n}')
+
+            lines.append('# TYPE slapd_operation_duration_seconds histogram')
+            lines.append('# UNIT slapd_operation_duration_seconds seconds')
+            lines.append('# HELP slapd_operation_duration_seconds Operation etime')
+            self._render_histogram(lines, 'slapd_operation_duration_seconds', self.durations_by_type)
+
+            lines.append('# TYPE slapd_window_operations gauge')
+            lines.append(f'# HELP slapd_window_operations Operations completed in the last {self.window} seconds')
+            for (op_type, result, bind_class), n in sorted(self.window_ops.items()):
+                labels = openmetrics_labels((('type', op_type), ('result', result), ('bind_class', bind_class)))
+                lines.append(f'slapd_window_operations{labels} {n}')
+
+            lines.append('# TYPE slapd_window_operation_duration_seconds gaugehistogram')
+            lines.append('# UNIT slapd_window_operation_duration_seconds seconds')
+            lines.append(f'# HELP slapd_window_operation_duration_seconds Operation etime in the last {self.window} seconds')
+            self._render_histogram(
+                lines, 'slapd_window_operation_duration_seconds', self.window_durations_by_type, gauge=True,
+            )
+
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+    def report(self):
+        return None
+
+
+class MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+    sink = None
+
+    def do_GET(self):
+        if self.path not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+
+        body = self.sink.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/openmetrics-text; version=1.0.0; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+def serve_metrics(sink, address):
+    """Start an HTTP server for sink.render() in a background thread"""
+
+    handler = type('MetricsRequestHandler', (MetricsRequestHandler,), {'sink': sink})
+    server = http.server.ThreadingHTTPServer(address, handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    return server
+
+
+def parse_address(address_str):
+    """Parse `[HOST:]PORT` into (host, port)"""
+
+    host, _, port = address_str.rpartition(':')
+    try:
+        return (host.strip('[]') or '127.0.0.1', int(port))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'Invalid address: {address_str}')
+
+
+def parse_list(item_type):
+    """Return a function to parse a comma-separated list of item_type"""
+
+    def parse(list_str):
+        try:
+            return [item_type(item) for item in list_str.split(',')]
+        except ValueError:
+            raise argparse.ArgumentTypeError(f'Invalid list: {list_str}')
+
+    return parse
+
+
+def parse_listen(listen_str):
+    """Parse `udp://[HOST:]PORT`, `tcp://[HOST:]PORT` or `unix://PATH` into (scheme, address)"""
+
+    scheme, sep, address = listen_str.partition('://')
+    if not sep or scheme not in ('udp', 'tcp', 'unix'):
+        raise argparse.ArgumentTypeError(f'Invalid listen address: {listen_str}')
+    if scheme == 'unix':
+        if not address:
+            raise argparse.ArgumentTypeError(f'Invalid listen address: {listen_str}')
+        return (scheme, address)
+
+    return (scheme, parse_address(address))
+
+
+def syslog_message_to_line(message, hostname='-'):
+    """Convert a syslog message (RFC 3164 or RFC 5424) into a log file line
+
+    Return None if the message is invalid.
+    """
+
+    message = message.rstrip('\r\n\0')
+    if not message.startswith('<'):
+        return None
+    pri_end = message.find('>', 1, 5)
+    if pri_end < 0:
+        return None
+    message = message[pri_end + 1:]
+
+    if message.startswith('1 '):
+        ## RFC 5424: VERSION TIMESTAMP HOSTNAME APP-NAME PROCID MSGID STRUCTURED-DATA [MSG]
+        fields = message.split(' ', 6)
+        if len(fields) < 7:
+            return None
+        _, timestamp, host, app, procid, _, sd_msg = fields
+        if sd_msg.startswith('-'):
+            msg = sd_msg[2:]
+        else:
+            ## Skip SD-ELEMENTs (`]` in PARAM-VALUE is escaped as `\]`)
+            i = 0
+            while sd_msg.startswith('[', i):
+                i = sd_msg.find(']', i)
+                while i > 0 and sd_msg[i - 1] == '\\':
+                    i = sd_msg.find(']', i + 1)
+                if i < 0:
+                    return None
+                i += 1
+            msg = sd_msg[i + 1:]
+        if msg.startswith('\ufeff'):
+            msg = msg[1:]
+        if timestamp.endswith('Z'):
+            timestamp = timestamp[:-1] + '+00:00'
+        ## Normalize TIME-SECFRAC to microseconds as in slapd log files
+        frac_end = 20 if timestamp[19:20] == '.' else 19
+        while timestamp[frac_end:frac_end + 1].isdigit():
+            frac_end += 1
+        if frac_end != 26:
+            timestamp = timestamp[:19] + '.' + timestamp[20:frac_end].ljust(6, '0')[:6] + timestamp[frac_end:]
+        if procid == '-':
+            procid = '0'
+        return f'{timestamp} {host} {app}[{procid}]: {msg}'
+
+    if message[:1].isdigit():
+        ## RFC 3164 with ISO 8601 timestamp (e.g. rsyslog RSYSLOG_ForwardFormat)
+        return message
+
+    ## RFC 3164: TIMESTAMP [HOSTNAME] TAG MSG
+    if message[15:16] != ' ':
+        return None
+    tag = message[16:message.find(' ', 16)]
+    if tag.endswith(':'):
+        ## No HOSTNAME in a message from a local socket
+        return f'{message[:16]}{hostname} {message[16:]}'
+
+    return message
+
+
+def split_syslog_frames(buf):
+    """Split octet-counted or LF-terminated syslog frames (RFC 6587)
+
+    Return (frames, the rest of buf).
+    """
+
+    frames = []
+    i = 0
+    n = len(buf)
+    while i < n:
+        if buf[i:i + 1].isdigit():
+            sp = buf.find(b' ', i)
+            if sp < 0:
+                break
+            end = sp + 1 + int(buf[i:sp])
+            if end > n:
+                break
+            frames.append(buf[sp + 1:end])
+        else:
+            end = buf.find(b'\n', i)
+            if end < 0:
+                break
+            if end > i:
+                frames.append(buf[i:end])
+            end += 1
+        i = end
+
+    return frames, buf[i:]
+
+
+class SyslogDatagramProtocol(asyncio.DatagramProtocol):
+    def __init__(self, receiver):
+        self.receiver = receiver
+
+    def datagram_received(self, data, addr):
+        self.receiver.add_messages((data,))
+
+
+def remove_stale_socket(path):
+    """Remove a Unix socket left by a process not listening anymore
+
+    Raise OSError if path is not a socket or another process listens on it.
+    """
+
+    try:
+        st = os.lstat(path)
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(st.st_mode):
+        raise FileExistsError(errno.EEXIST, 'File exists and is not a socket', path)
+
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    try:
+        probe.connect(path)
+    except ConnectionRefusedError:
+        os.unlink(path)
+        return
+    finally:
+        probe.close()
+
+    raise OSError(errno.EADDRINUSE, 'Socket in use by another process', path)
+
+
+class SyslogReceiver():
+    """Receive syslog messages on a UDP, TCP or Unix datagram socket
+
+    An asyncio event loop runs in a background thread and queues the
+    converted lines in batches for lines(). A stream connection stops
+    reading while the queue is full (backpressure). Datagrams are dropped
+    and counted instead, because their senders cannot be slowed down.
+    stop() stops the event loop and removes the Unix socket.
+    """
+
+    def __init__(self, listen, batch_size=1024, queue_size=64, flush_interval=0.1, rcvbuf=8 * 1024 * 1024):
+        self.scheme, self.address = listen
+        self.batch_size = batch_size
+        self.rcvbuf = rcvbuf
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.hostname = socket.gethostname().split('.')[0]
+        self.batch = []
+        self.messages = 0
+        self.invalid = 0
+        self.dropped = 0
+        self.stalls = 0
+        self.ready = threading.Event()
+        self.stopping = threading.Event()
+        self.thread = None
+        self.exception = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        self.ready.wait()
+        if self.exception is not None:
+            raise self.exception
+
+    def stop(self, timeout=5.0):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def run(self):
+        try:
+            asyncio.run(self.serve())
+        except Exception as e:
+            self.exception = e
+            self.ready.set()
+
+    async def serve(self):
+        loop = asyncio.get_running_loop()
+        server = transport = None
+        socket_ino = None
+        try:
+            if self.scheme == 'tcp':
+                server = await asyncio.start_server(self.handle_stream, *self.address)
             else:
-                logger.error(f'Unknown line: {line_n}: {line}')
+                if self.scheme == 'udp':
+                    sock = socket.socket(socket.AF_INET6 if ':' in self.address[0] else socket.AF_INET, socket.SOCK_DGRAM)
+                else:
+                    remove_stale_socket(self.address)
+                    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+                ## Absorb bursts while the event loop is busy (capped by net.core.rmem_max)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
+                sock.bind(self.address)
+                if self.scheme == 'unix':
+                    socket_ino = os.lstat(self.address).st_ino
+                transport, _ = await loop.create_datagram_endpoint(
+                    lambda: SyslogDatagramProtocol(self),
+                    sock=sock,
+                )
+            self.ready.set()
+
+            while not self.stopping.is_set():
+                await asyncio.sleep(self.flush_interval)
+                self.flush()
+        finally:
+            if server is not None:
+                server.close()
+            if transport is not None:
+                transport.close()
+            ## Remove the socket unless replaced by another process
+            if socket_ino is not None:
+                with contextlib.suppress(OSError):
+                    if os.lstat(self.address).st_ino == socket_ino:
+                        os.unlink(self.address)
+
+    async def handle_stream(self, reader, writer):
+        buf = b''
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                frames, buf = split_syslog_frames(buf + data)
+                self.add_messages(frames, flush=False)
+                batch, self.batch = self.batch, []
+                if not batch:
+                    continue
+                try:
+                    self.queue.put_nowait(batch)
+                except queue.Full:
+                    ## Stop reading this connection until the parser catches up.
+                    ## Poll instead of a blocking put() in a thread, which
+                    ## would never return (and block the exit) once the
+                    ## parser stops
+                    self.stalls += 1
+                    while not self.stopping.is_set():
+                        await asyncio.sleep(self.flush_interval / 10)
+                        try:
+                            self.queue.put_nowait(batch)
+                            break
+                        except queue.Full:
+                            pass
+                    else:
+                        return
+        finally:
+            writer.close()
+
+    def add_messages(self, messages, flush=True):
+        batch = self.batch
+        for message in messages:
+            self.messages += 1
+            line = syslog_message_to_line(message.decode('utf-8', 'replace'), self.hostname)
+            if line is None:
+                self.invalid += 1
+                continue
+            batch.append(line)
+        if flush and len(batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        batch, self.batch = self.batch, []
+        if not batch:
+            return
+        try:
+            self.queue.put_nowait(batch)
+        except queue.Full:
+            dropped = self.dropped
+            self.dropped += len(batch)
+            if dropped.bit_length() != self.dropped.bit_length():
+                logger.warning('Dropped %d syslog messages: The parser falls behind', self.dropped)
+
+    def lines(self, on_idle=None):
+        """Yield received lines forever
+
+        on_idle is called before waiting for lines (e.g. to flush output).
+        """
+
+        while True:
+            try:
+                batch = self.queue.get_nowait()
+            except queue.Empty:
+                if on_idle is not None:
+                    on_idle()
+                batch = self.queue.get()
+            yield from batch
+
+    def log_summary(self):
+        logger.info(
+            'Received %d syslog messages: %d invalid, %d dropped, %d stalls',
+            self.messages, self.invalid, self.dropped, self.stalls,
+        )
+
+
+def main(argv):
+    args_parser = argparse.ArgumentParser(
+        prog=sys.argv[0],
+        add_help=True,
+        description='Annotate and convert slapd stats log to JSON',
+    )
+    args_parser.add_argument(
+        'files', metavar='FILE',
+        nargs='*', default=['-'],
+        help='slapd stats log file(s) (default: stdin)',
+    )
+    args_parser.add_argument(
+        '--report', metavar='NAME',
+        choices=('filters', 'unindexed', 'concurrency', 'repeats'),
+        help='Print a report instead of operations: '
+        '`filters` aggregates searches by filter shape and lists index candidates, '
+        '`unindexed` aggregates "not indexed" diagnostics by attribute '
+        '(a diagnostic has no `conn=` and is attributed to a search only if the search is '
+        'the only one in flight in the slapd process that may have logged it, '
+        'otherwise it is counted as unattributed, and as ambiguous if concurrent searches may have), '
+        '`concurrency` prints per-second in-flight and queued operations as JSON Lines '
+        'followed by a summary line with `"type": "summary"`, '
+        '`repeats` reports searches repeated within --window and simulated cache hit rates',
+    )
+    args_parser.add_argument(
+        '--report-top', metavar='N',
+        type=int, default=20,
+        help='Number of the most expensive entries to be examined in a report (default: %(default)s)',
+    )
+    args_parser.add_argument(
+        '--threads', metavar='N',
+        type=int, default=16,
+        help='Number of slapd threads (olcThreads) for `--report concurrency` (default: %(default)s)',
+    )
+    args_parser.add_argument(
+        '--max-etime', metavar='SECONDS',
+        type=float, default=60.0,
+        help='Expected maximum etime for `--report concurrency` (default: %(default)s)',
+    )
+    args_parser.add_argument(
+        '--cache-sizes', metavar='N[,N...]',
+        type=parse_list(int), default='100,1000,10000',
+        help='Numbers of entries of caches simulated by `--report repeats` (default: %(default)s)',
+    )
+    args_parser.add_argument(
+        '--cache-ttls', metavar='SECONDS[,SECONDS...]',
+        type=parse_list(float), default='1,10,60',
+        help='TTLs of caches simulated by `--report repeats` (default: %(default)s)',
+    )
+    args_parser.add_argument(
+        '--since', metavar='TIME',
+        type=parse_time,
+        help='Output operations completed at or after TIME '
+        '(ISO 8601 date and time, or HH:MM[:SS] today). '
+        'Seekable files are bisected to start near TIME (and line numbers count from there)',
+    )
+    args_parser.add_argument(
+        '--until', metavar='TIME',
+        type=parse_time,
+        help='Stop at the first line logged after TIME',
+    )
+    args_parser.add_argument(
+        '--warmup', metavar='SECONDS',
+        type=float, default=300.0,
+        help='Start reading SECONDS before --since to rebuild the state of connections '
+        '(default: %(default)s)',
+    )
+    args_parser.add_argument(
+        '--year', metavar='YEAR',
+        type=int,
+        help='Year of legacy syslog timestamps (default: guessed as in the last 12 months)',
+    )
+    args_parser.add_argument(
+        '--sample', metavar='RATE',
+        type=float,
+        help='Parse only a deterministic sample of connections (0 < RATE <= 1) selected by '
+        'CRC-32 of the hostname and conn_id. Operations carry `sample_weight` (1 / RATE) '
+        'to scale aggregates with. Counts in reports and metrics are of the sampled '
+        'connections and not scaled, and reports carry `sample_rate` and `sample_scaled: false`',
+    )
+    args_parser.add_argument(
+        '--stats', metavar='FILE',
+        nargs='?', const='-',
+        help='Write parser statistics (line counts and time by category, errors, '
+        'table sizes and throughput over time) as JSON to FILE (default: stderr)',
+    )
+    args_parser.add_argument(
+        '--listen', metavar='URI',
+        type=parse_listen,
+        help='Receive syslog messages (RFC 3164 or RFC 5424) from slapd or a syslog daemon '
+        'at udp://[HOST:]PORT, tcp://[HOST:]PORT (RFC 6587 framing) or unix://PATH (datagram) '
+        'instead of reading files',
+    )
+    args_parser.add_argument(
+        '--serve', metavar='[HOST:]PORT',
+        type=parse_address,
+        help='Run as a daemon to follow the log FILE (or read stdin) and export metrics '
+        'in OpenMetrics format at http://HOST:PORT/metrics (HOST defaults to 127.0.0.1)',
+    )
+    args_parser.add_argument(
+        '--window', metavar='SECONDS',
+        type=float, default=60.0,
+        help='Rolling window for metrics exported by --serve, '
+        'and for repeated searches in `--report repeats` (default: %(default)s)',
+    )
+    args_parser.add_argument(
+        '--max-series', metavar='N',
+        type=int, default=1000,
+        help='Maximum number of operation counter series exported by --serve (default: %(default)s)',
+    )
+    args = args_parser.parse_args(argv)
+
+    if args.sample is not None and not 0 < args.sample <= 1:
+        args_parser.error('--sample RATE must be 0 < RATE <= 1')
+    if args.listen and args.files != ['-']:
+        args_parser.error('--listen cannot be used with log files')
+    if args.serve and args.report:
+        args_parser.error('--serve cannot be used with --report')
+
+    server = None
+    if args.serve:
+        if len(args.files) != 1:
+            args_parser.error('--serve requires one log file or stdin')
+        sink = MetricsSink(window=args.window, max_series=args.max_series)
+        server = serve_metrics(sink, args.serve)
+        logger.info('Serving metrics at http://%s:%d/metrics', *args.serve)
+    elif args.report == 'filters':
+        sink = FilterReport(top=args.report_top)
+    elif args.report == 'unindexed':
+        sink = UnindexedReport(top=args.report_top)
+    elif args.report == 'concurrency':
+        sink = ConcurrencyReport(threads=args.threads, max_etime=args.max_etime)
+    elif args.report == 'repeats':
+        sink = RepeatReport(
+            top=args.report_top,
+            window=args.window,
+            cache_sizes=args.cache_sizes,
+            cache_ttls=args.cache_ttls,
+        )
+    else:
+        sink = JSONSink()
+
+    since = start = args.since
+    if since is not None:
+        start = since - args.warmup
+
+    stats = ParserStats() if args.stats else None
+    parser = StatsLogParser(
+        since=since,
+        until=args.until,
+        on_diagnostic=getattr(sink, 'add_diagnostic', None),
+        year=args.year,
+        stats=stats,
+        sample=args.sample,
+    )
+    receiver = None
+    with contextlib.ExitStack() as exit_stack:
+        if server is not None:
+            exit_stack.callback(server.server_close)
+            exit_stack.callback(server.shutdown)
+        if args.listen or args.serve:
+            ## Stop on SIGTERM as well as SIGINT to print the report (if any)
+            signal.signal(signal.SIGTERM, signal.default_int_handler)
+        if args.listen:
+            receiver = SyslogReceiver(args.listen)
+            try:
+                receiver.start()
+            except OSError as e:
+                args_parser.error(f'--listen: {e}')
+            exit_stack.callback(receiver.stop)
+            lines = receiver.lines(on_idle=sys.stdout.flush)
+        elif args.serve and args.files[0] != '-':
+            lines = exit_stack.enter_context(contextlib.closing(follow_log(args.files[0])))
+        else:
+            lines = exit_stack.enter_context(contextlib.closing(read_logs(args.files, start, args.year)))
+        try:
+            for op in parser.parse(lines):
+                sink.add(op)
+        except KeyboardInterrupt:
+            if receiver is None and server is None:
+                raise
+            if receiver is not None:
+                receiver.log_summary()
+
+    report = sink.report()
+    if report is not None:
+        if args.sample is not None:
+            report['sample_rate'] = args.sample
+            report['sample_scaled'] = False
+        if getattr(sink, 'json_lines', False):
+            print(json.dumps(report))
+        else:
+            print(json.dumps(report, indent=2))
 
+    if stats is not None:
+        if args.stats == '-':
+            print(json.dumps(stats.report(parser), indent=2), file=sys.stderr)
         else:
-            logger.error(f'Unknown line: {line_n}: {line}')
+            with open(args.stats, 'w') as stats_file:
+                print(json.dumps(stats.report(parser), indent=2), file=stats_file)
 
     return 0
 
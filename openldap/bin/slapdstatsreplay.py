@@ -0,0 +1,655 @@
+#!/usr/bin/env python3
+## -*- coding: utf-8 -*- vim:shiftwidth=4:expandtab:
+##
+## OpenLDAP: Replay operations in slapd stats log converted to JSON
+##
+## SPDX-FileCopyrightText: 2025 SATOH Fumiyasu @ OSSTech Corp., Japan
+## SPDX-License-Identifier: GPL-3.0-or-later
+##
+## Usage:
+##   slapdstatslog2json.py <slapd.log >slapd.json
+##   slapdstatsreplay.py --uri ldap://ldap.example.jp --speed 5 slapd.json
+##
+## BIND (simple), SEARCH and COMPARE operations are re-issued with the
+## original per-connection sequencing and inter-arrival timing (scaled by
+## --speed). Other operations are counted as skipped.
+## Passwords are not logged, so simple BINDs are replayed only for DNs with
+## a password given by --bind-password or --bind-passwords, and the
+## operations after a successful BIND not replayed are skipped until the
+## next BIND or UNBIND. Compare assertion values are not logged either,
+## so --compare-value is used.
+##
+
+import logging
+import sys
+import os
+import json
+import argparse
+import asyncio
+import ssl
+import time
+import datetime
+import collections
+import contextlib
+import urllib.parse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import slapdstatslog2json  # noqa: E402
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(name)s: %(levelname)s: %(message)s',
+    )
+    logger = logging.getLogger(sys.argv[0])
+else:
+    logger = logging.getLogger(__name__)
+
+scope_n_by_name = {name: n for n, name in slapdstatslog2json.scope_by_n.items()}
+deref_n_by_name = {name: n for n, name in slapdstatslog2json.deref_by_n.items()}
+
+## LDAP protocol (RFC 4511) BER tags
+TAG_INTEGER = 0x02
+TAG_OCTET_STRING = 0x04
+TAG_BOOLEAN = 0x01
+TAG_ENUMERATED = 0x0A
+TAG_SEQUENCE = 0x30
+TAG_BIND_REQUEST = 0x60
+TAG_BIND_RESPONSE = 0x61
+TAG_UNBIND_REQUEST = 0x42
+TAG_SEARCH_REQUEST = 0x63
+TAG_SEARCH_RESULT_ENTRY = 0x64
+TAG_SEARCH_RESULT_DONE = 0x65
+TAG_SEARCH_RESULT_REFERENCE = 0x73
+TAG_COMPARE_REQUEST = 0x6E
+TAG_COMPARE_RESPONSE = 0x6F
+TAG_EXTENDED_RESPONSE = 0x78
+TAG_AUTH_SIMPLE = 0x80
+
+filter_tag_by_match = {
+    '&': 0xA0,
+    '|': 0xA1,
+    '!': 0xA2,
+    'eq': 0xA3,
+    'sub': 0xA4,
+    'ge': 0xA5,
+    'le': 0xA6,
+    'pres': 0x87,
+    'approx': 0xA8,
+    'ext': 0xA9,
+}
+
+
+## BER encoding and decoding
+## ======================================================================
+
+def ber_length(length):
+    if length < 0x80:
+        return bytes((length,))
+
+    length_bytes = length.to_bytes((length.bit_length() + 7) // 8, 'big')
+    return bytes((0x80 | len(length_bytes),)) + length_bytes
+
+
+def ber(tag, content):
+    return bytes((tag,)) + ber_length(len(content)) + content
+
+
+def ber_integer(n, tag=TAG_INTEGER):
+    return ber(tag, n.to_bytes(n.bit_length() // 8 + 1, 'big', signed=True))
+
+
+def ber_string(s, tag=TAG_OCTET_STRING):
+    if isinstance(s, str):
+        s = s.encode('utf-8')
+    return ber(tag, s)
+
+
+def ber_boolean(b, tag=TAG_BOOLEAN):
+    return ber(tag, b'\xff' if b else b'\x00')
+
+
+def ber_decode(data, pos=0):
+    """Decode a BER element at pos and return (tag, content, next_pos)"""
+
+    tag = data[pos]
+    length = data[pos + 1]
+    pos += 2
+    if length & 0x80:
+        n = length & 0x7F
+        length = int.from_bytes(data[pos:pos + n], 'big')
+        pos += n
+
+    return tag, data[pos:pos + length], pos + length
+
+
+def unescape_filter_value(value):
+    """Unescape `\\XX` sequences in an assertion value in a filter string"""
+
+    if '\\' not in value:
+        return value.encode('utf-8')
+
+    value_bytes = bytearray()
+    pos = 0
+    while True:
+        escape = value.find('\\', pos)
+        if escape < 0:
+            value_bytes += value[pos:].encode('utf-8')
+            break
+        value_bytes += value[pos:escape].encode('utf-8')
+        value_bytes.append(int(value[escape + 1:escape + 3], 16))
+        pos = escape + 3
+
+    return bytes(value_bytes)
+
+
+def ber_filter(node):
+    match = node[0]
+    tag = filter_tag_by_match.get(match)
+    if tag is None:
+        raise ValueError(f'Filter not encodable: {node}')
+
+    if match in ('&', '|'):
+        return ber(tag, b''.join(ber_filter(child) for child in node[1]))
+    if match == '!':
+        return ber(tag, ber_filter(node[1][0]))
+    if match == 'pres':
+        return ber_string(node[1], tag)
+    if match == 'sub':
+        substrings = b''
+        if node[2]:
+            substrings += ber_string(unescape_filter_value(node[2]), 0x80)
+        for value in node[3]:
+            substrings += ber_string(unescape_filter_value(value), 0x81)
+        if node[4]:
+            substrings += ber_string(unescape_filter_value(node[4]), 0x82)
+        return ber(tag, ber_string(node[1]) + ber(TAG_SEQUENCE, substrings))
+    if match == 'ext':
+        content = b''
+        if node[3]:
+            content += ber_string(node[3], 0x81)
+        if node[1]:
+            content += ber_string(node[1], 0x82)
+        content += ber_string(unescape_filter_value(node[4]), 0x83)
+        if node[2]:
+            content += ber_boolean(True, 0x84)
+        return ber(tag, content)
+
+    return ber(tag, ber_string(node[1]) + ber_string(unescape_filter_value(node[2])))
+
+
+def bind_request(dn, password):
+    return ber(TAG_BIND_REQUEST, b''.join((
+        ber_integer(3),
+        ber_string(dn),
+        ber_string(password, TAG_AUTH_SIMPLE),
+    )))
+
+
+def search_request(request):
+    return ber(TAG_SEARCH_REQUEST, b''.join((
+        ber_string(request['base']),
+        ber_integer(scope_n_by_name[request['scope']], TAG_ENUMERATED),
+        ber_integer(deref_n_by_name[request['deref']], TAG_ENUMERATED),
+        ber_integer(0),
+        ber_integer(0),
+        ber_boolean(False),
+        ber_filter(slapdstatslog2json.parse_filter(request['filter'])),
+        ber(TAG_SEQUENCE, b''.join(ber_string(attr) for attr in request.get('attrs', ()))),
+    )))
+
+
+def compare_request(request, value):
+    return ber(TAG_COMPARE_REQUEST, b''.join((
+        ber_string(request['dn']),
+        ber(TAG_SEQUENCE, ber_string(request['attr']) + ber_string(value)),
+    )))
+
+
+## LDAP connection and connection pool
+## ======================================================================
+
+class LDAPConnection():
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.message_id = 0
+        self.dn = ''
+
+    @classmethod
+    async def open(cls, uri):
+        url = urllib.parse.urlsplit(uri)
+        if url.scheme == 'ldapi':
+            path = urllib.parse.unquote(url.netloc) or '/var/run/ldapi'
+            reader, writer = await asyncio.open_unix_connection(path)
+        elif url.scheme == 'ldaps':
+            context = ssl.create_default_context()
+            reader, writer = await asyncio.open_connection(url.hostname, url.port or 636, ssl=context)
+        elif url.scheme == 'ldap':
+            reader, writer = await asyncio.open_connection(url.hostname, url.port or 389)
+        else:
+            raise ValueError(f'Unsupported URI scheme: {uri}')
+
+        return cls(reader, writer)
+
+    async def read_message(self):
+        header = await self.reader.readexactly(2)
+        length = header[1]
+        if length & 0x80:
+            length_bytes = await self.reader.readexactly(length & 0x7F)
+            length = int.from_bytes(length_bytes, 'big')
+        content = await self.reader.readexactly(length)
+
+        _, message_id, pos = ber_decode(content)
+        tag, op, _ = ber_decode(content, pos)
+
+        return int.from_bytes(message_id, 'big', signed=True), tag, op
+
+    async def request(self, op):
+        """Send a request and return (result code, number of entries)"""
+
+        self.message_id += 1
+        message_id = self.message_id
+        self.writer.write(ber(TAG_SEQUENCE, ber_integer(message_id) + op))
+        await self.writer.drain()
+
+        nentries = 0
+        while True:
+            response_id, tag, response = await self.read_message()
+            if tag == TAG_SEARCH_RESULT_ENTRY:
+                nentries += 1
+                continue
+            if tag == TAG_SEARCH_RESULT_REFERENCE:
+                continue
+            _, result_code, _ = ber_decode(response)
+            result_code = int.from_bytes(result_code, 'big')
+            if tag == TAG_EXTENDED_RESPONSE and response_id == 0:
+                raise ConnectionError(f'Notice of disconnection: result code {result_code}')
+            if response_id == message_id:
+                return result_code, nentries
+
+    async def bind(self, dn, password):
+        result_code, _ = await self.request(bind_request(dn, password))
+        self.dn = dn if result_code == 0 else ''
+
+        return result_code
+
+    def close(self):
+        try:
+            self.writer.write(ber(TAG_SEQUENCE, ber_integer(self.message_id + 1) + ber(TAG_UNBIND_REQUEST, b'')))
+        except Exception:
+            pass
+        self.writer.close()
+
+
+class BindError(Exception):
+    def __init__(self, dn, result_code):
+        super().__init__(f'Bind as "{dn}" failed: result code {result_code}')
+        self.dn = dn
+        self.result_code = result_code
+
+
+class ConnectionPool():
+    """Pool of up to `size` connections to the target server
+
+    Idle connections are kept by bound DN, so that a replayed connection
+    gets one bound as itself if available, or one rebound to its DN.
+    """
+
+    def __init__(self, uri, size):
+        self.uri = uri
+        self.semaphore = asyncio.Semaphore(size)
+        self.idle_by_dn = collections.defaultdict(list)
+        self.rebinds = 0
+        self.rebind_errors = 0
+
+    async def acquire(self, dn, password):
+        """Acquire a connection bound as dn (or as any DN if dn is None)
+
+        Raise BindError if rebinding to dn failed.
+        """
+
+        await self.semaphore.acquire()
+        conn = None
+        try:
+            if dn is not None:
+                idle = self.idle_by_dn.get(dn)
+                if idle:
+                    return idle.pop()
+            for idle in self.idle_by_dn.values():
+                if idle:
+                    conn = idle.pop()
+                    break
+            else:
+                conn = await LDAPConnection.open(self.uri)
+            if dn is not None and conn.dn != dn:
+                self.rebinds += 1
+                result_code = await conn.bind(dn, password)
+                if result_code != 0:
+                    self.rebind_errors += 1
+                    raise BindError(dn, result_code)
+            return conn
+        except BaseException:
+            if conn is not None:
+                conn.close()
+            self.semaphore.release()
+            raise
+
+    def release(self, conn, broken=False):
+        if broken:
+            conn.writer.close()
+        else:
+            self.idle_by_dn[conn.dn].append(conn)
+        self.semaphore.release()
+
+    def close(self):
+        for idle in self.idle_by_dn.values():
+            for conn in idle:
+                conn.close()
+        self.idle_by_dn.clear()
+
+
+## Replay
+## ======================================================================
+
+class OpStats():
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.mismatches = 0
+        self.failures = 0
+        self.skipped = 0
+        self.latencies = []
+        self.etimes = []
+
+
+class Replayer():
+    def __init__(
+        self, pool, speed=1.0, password_by_dn=None, password=None, compare_value='x', lookahead=1.0,
+        queue_size=1000,
+    ):
+        self.pool = pool
+        self.speed = speed
+        self.password_by_dn = password_by_dn or {}
+        self.password = password
+        self.compare_value = compare_value
+        self.lookahead = lookahead
+        self.queue_size = queue_size
+        self.stats_by_type = collections.defaultdict(OpStats)
+        self.log_start = None
+        self.wall_start = None
+
+    def scheduled_time(self, record):
+        """Return the loop time to issue the operation in the record at"""
+
+        timestamp = datetime.datetime.fromisoformat(record['op_request']['timestamp']).timestamp()
+        if self.log_start is None:
+            self.log_start = timestamp
+            self.wall_start = asyncio.get_running_loop().time()
+        if not self.speed:
+            return self.wall_start
+
+        return self.wall_start + (timestamp - self.log_start) / self.speed
+
+    def bind_password(self, dn):
+        if not dn:
+            return ''
+
+        return self.password_by_dn.get(dn, self.password)
+
+    def encode(self, record):
+        op_type = record['op_type']
+        request = record['op_request']
+        if op_type == 'SEARCH':
+            return search_request(request)
+        if op_type == 'COMPARE':
+            return compare_request(request, self.compare_value)
+
+        return None
+
+    async def replay_connection(self, queue):
+        """Replay operations in a connection sequentially"""
+
+        loop = asyncio.get_running_loop()
+        dn = ''
+        password = ''
+        ## Skip operations until the identity changes if the BIND was
+        ## skipped or rebinding failed, not to replay them as another DN
+        rebind_failed = False
+        conn = None
+        try:
+            while True:
+                if queue.empty() and conn is not None:
+                    ## Return the idle connection to the pool while waiting
+                    self.pool.release(conn)
+                    conn = None
+                item = await queue.get()
+                if item is None:
+                    break
+                when, record = item
+                op_type = record['op_type']
+                if op_type in ('CONNECT', 'UNBIND', 'DISCONNECT'):
+                    if op_type != 'CONNECT':
+                        dn = password = ''
+                        rebind_failed = False
+                    continue
+
+                stats = self.stats_by_type[op_type]
+                if rebind_failed and op_type != 'BIND':
+                    stats.skipped += 1
+                    continue
+                if op_type == 'BIND':
+                    request = record['op_request']
+                    bind_password = None
+                    if request.get('method') == 'Simple' and request.get('mech', 'SIMPLE') == 'SIMPLE':
+                        bind_password = self.bind_password(request['dn'])
+                    if bind_password is None:
+                        stats.skipped += 1
+                        if record['op_result']['error'] == 0:
+                            rebind_failed = True
+                        else:
+                            ## The connection was left anonymous in the log too
+                            dn = password = ''
+                            rebind_failed = False
+                        continue
+                    op = None
+                else:
+                    try:
+                        op = self.encode(record)
+                    except (ValueError, KeyError) as e:
+                        logger.debug('Cannot encode request: %s: %s', record['op_request'], e)
+                        op = None
+                    if op is None:
+                        stats.skipped += 1
+                        continue
+
+                delay = when - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                try:
+                    if conn is None:
+                        ## Any connection will do for a BIND
+                        conn = await self.pool.acquire(dn if op is not None else None, password)
+                    started = time.perf_counter()
+                    if op is None:
+                        result_code = await conn.bind(request['dn'], bind_password)
+                        ## A failed BIND leaves the connection anonymous
+                        dn = request['dn'] if result_code == 0 else ''
+                        password = bind_password if result_code == 0 else ''
+                        rebind_failed = False
+                    else:
+                        result_code, _ = await conn.request(op)
+                except BindError as e:
+                    logger.error('Rebind failed: %s', e)
+                    stats.skipped += 1
+                    rebind_failed = True
+                    continue
+                except (OSError, ConnectionError, asyncio.IncompleteReadError) as e:
+                    logger.error('Connection failed: %s', e)
+                    stats.failures += 1
+                    if conn is not None:
+                        self.pool.release(conn, broken=True)
+                        conn = None
+                    continue
+                stats.latencies.append(time.perf_counter() - started)
+
+                stats.count += 1
+                if result_code not in (0, 5, 6):
+                    stats.errors += 1
+                if result_code != record['op_result']['error']:
+                    stats.mismatches += 1
+                if record['op_result']['etime'] is not None:
+                    stats.etimes.append(record['op_result']['etime'])
+        finally:
+            if conn is not None:
+                self.pool.release(conn)
+
+    async def run(self, records):
+        queue_by_conn_id = {}
+        tasks = []
+        loop = asyncio.get_running_loop()
+
+        for record in records:
+            when = self.scheduled_time(record)
+            ## Read ahead only a little to keep the memory usage bounded
+            delay = when - loop.time() - self.lookahead
+            if delay > 0:
+                await asyncio.sleep(delay)
+            elif not self.speed:
+                await asyncio.sleep(0)
+
+            conn_id = record['conn']
+            queue = queue_by_conn_id.get(conn_id)
+            if queue is None:
+                queue = queue_by_conn_id[conn_id] = asyncio.Queue(self.queue_size)
+                tasks.append(asyncio.ensure_future(self.replay_connection(queue)))
+            ## Wait for the connection to catch up if its queue is full
+            await queue.put((when, record))
+
+            if record['op_type'] == 'DISCONNECT':
+                await queue.put(None)
+                del queue_by_conn_id[conn_id]
+
+        for queue in queue_by_conn_id.values():
+            await queue.put(None)
+        await asyncio.gather(*tasks)
+        self.pool.close()
+
+    def report(self):
+        ops = {}
+        for op_type, stats in sorted(self.stats_by_type.items()):
+            latency = slapdstatslog2json.summarize(stats.latencies)
+            etime = slapdstatslog2json.summarize(stats.etimes)
+            ops[op_type] = {
+                'count': stats.count,
+                'errors': stats.errors,
+                'mismatches': stats.mismatches,
+                'failures': stats.failures,
+                'skipped': stats.skipped,
+                'latency': latency,
+                'etime': etime,
+                'latency_to_etime_p50': (
+                    latency['p50'] / etime['p50']
+                    if latency and etime and etime['p50'] else None
+                ),
+            }
+
+        return {
+            'ops': ops,
+            'rebinds': self.pool.rebinds,
+            'rebind_errors': self.pool.rebind_errors,
+        }
+
+
+def read_records(paths):
+    for path in paths:
+        with (contextlib.nullcontext(sys.stdin) if path == '-' else open(path)) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if record['op_request']['timestamp'] is None:
+                    continue
+                yield record
+
+
+def read_passwords(path):
+    """Read "DN<TAB>PASSWORD" lines"""
+
+    password_by_dn = {}
+    with open(path) as f:
+        for line in f:
+            line = line.rstrip('\r\n')
+            if not line or line.startswith('#'):
+                continue
+            dn, password = line.split('\t', 1)
+            password_by_dn[dn] = password
+
+    return password_by_dn
+
+
+def main(argv):
+    args_parser = argparse.ArgumentParser(
+        prog=sys.argv[0],
+        add_help=True,
+        description='Replay operations in JSON converted by slapdstatslog2json.py',
+    )
+    args_parser.add_argument(
+        'files', metavar='FILE',
+        nargs='*', default=['-'],
+        help='JSON file(s) (default: stdin)',
+    )
+    args_parser.add_argument(
+        '--uri', '-H', metavar='URI',
+        default='ldap://localhost',
+        help='Target server URI (ldap://, ldaps:// or ldapi://) (default: %(default)s)',
+    )
+    args_parser.add_argument(
+        '--speed', metavar='FACTOR',
+        type=float, default=1.0,
+        help='Replay speed factor, 0 for the maximum speed (default: %(default)s)',
+    )
+    args_parser.add_argument(
+        '--connections', metavar='N',
+        type=int, default=100,
+        help='Maximum number of connections to the target server (default: %(default)s)',
+    )
+    args_parser.add_argument(
+        '--bind-password', metavar='PASSWORD',
+        help='Password for all simple BINDs',
+    )
+    args_parser.add_argument(
+        '--bind-passwords', metavar='FILE',
+        help='File with "DN<TAB>PASSWORD" lines for simple BINDs',
+    )
+    args_parser.add_argument(
+        '--compare-value', metavar='VALUE',
+        default='x',
+        help='Assertion value for COMPARE operations (default: %(default)s)',
+    )
+    args = args_parser.parse_args(argv)
+
+    password_by_dn = {}
+    if args.bind_passwords:
+        password_by_dn = read_passwords(args.bind_passwords)
+
+    async def replay():
+        pool = ConnectionPool(args.uri, args.connections)
+        replayer = Replayer(
+            pool,
+            speed=args.speed,
+            password_by_dn=password_by_dn,
+            password=args.bind_password,
+            compare_value=args.compare_value,
+        )
+        await replayer.run(read_records(args.files))
+        return replayer.report()
+
+    report = asyncio.run(replay())
+    print(json.dumps(report, indent=2))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+## -*- coding: utf-8 -*- vim:shiftwidth=4:expandtab:
+##
+## OpenLDAP: Benchmark slapdstatslog2json.py with synthetic slapd stats log
+##
+## SPDX-FileCopyrightText: 2025 SATOH Fumiyasu @ OSSTech Corp., Japan
+## SPDX-License-Identifier: GPL-3.0-or-later
+##
+## Print a JSON object with lines/sec, operations/sec, peak RSS of the
+## converter process, the number of operations by type and the time
+## by line category from an extra run with `--stats`.
+##
+
+import sys
+import os
+import argparse
+import collections
+import datetime
+import json
+import random
+import subprocess
+import tempfile
+import time
+
+import slapdstatsloggen
+
+converter_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'slapdstatslog2json.py')
+
+
+def run(log_path, out_file, options):
+    """Run the converter and return (elapsed seconds, peak RSS in KiB)"""
+
+    out_file.seek(0)
+    out_file.truncate()
+    t0 = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, converter_path, *options, log_path],
+        stdout=out_file,
+    )
+    _, status, rusage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - t0
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise RuntimeError(f'{converter_path} exited with status {process.returncode}')
+
+    return elapsed, rusage.ru_maxrss
+
+
+def main(argv):
+    args_parser = argparse.ArgumentParser(
+        prog=sys.argv[0],
+        add_help=True,
+        description='Benchmark slapdstatslog2json.py',
+    )
+    args_parser.add_argument(
+        'file', metavar='FILE',
+        nargs='?',
+        help='slapd stats log file (default: generate with slapdstatsloggen.py)',
+    )
+    args_parser.add_argument(
+        '--ops', metavar='N',
+        type=int, default=100000,
+        help='Number of operations to generate (default: %(default)s)',
+    )
+    args_parser.add_argument(
+        '--concurrency', metavar='N',
+        type=int, default=50,
+        help='Number of concurrent clients to generate (default: %(default)s)',
+    )
+    args_parser.add_argument(
+        '--legacy', action='store_true',
+        help='Generate legacy syslog timestamps instead of ISO 8601',
+    )
+    args_parser.add_argument(
+        '--version', metavar='VERSION',
+        choices=('2.4', '2.5'), default='2.5',
+        help='OpenLDAP version of generated log format (default: %(default)s)',
+    )
+    args_parser.add_argument(
+        '--repeat', metavar='N',
+        type=int, default=3,
+        help='Number of runs to take the fastest of (default: %(default)s)',
+    )
+    args_parser.add_argument(
+        '--report', metavar='NAME',
+        help='Benchmark `slapdstatslog2json.py --report NAME` instead of the conversion',
+    )
+    args = args_parser.parse_args(argv)
+
+    options = ['--year', '2025']
+    if args.report:
+        options += ['--report', args.report]
+
+    with tempfile.TemporaryDirectory(prefix='bench-slapdstatslog2json.') as tmp_dir:
+        log_path = args.file
+        if log_path is None:
+            log_path = os.path.join(tmp_dir, 'stats.log')
+            generator = slapdstatsloggen.Generator(
+                random.Random(0),
+                datetime.datetime.fromisoformat('2025-10-19T14:00:00+09:00'),
+                iso=not args.legacy,
+                version=args.version,
+            )
+            with open(log_path, 'w') as log_file:
+                log_file.writelines(generator.generate(args.ops, args.concurrency))
+
+        with open(log_path, 'rb') as log_file:
+            lines = sum(1 for _ in log_file)
+        size = os.path.getsize(log_path)
+
+        with open(os.path.join(tmp_dir, 'out.json'), 'w+') as out_file:
+            runs = [run(log_path, out_file, options) for _ in range(args.repeat)]
+            stats_path = os.path.join(tmp_dir, 'stats.json')
+            run(log_path, out_file, options + ['--stats', stats_path])
+            with open(stats_path) as stats_file:
+                stats = json.load(stats_file)
+            op_types = collections.Counter()
+            if not args.report:
+                out_file.seek(0)
+                for line in out_file:
+                    op_types[json.loads(line)['op_type']] += 1
+
+    elapsed = min(seconds for seconds, _ in runs)
+    ops = sum(op_types.values())
+    result = {
+        'python': sys.version.split()[0],
+        'options': options,
+        'lines': lines,
+        'bytes': size,
+        'seconds': round(elapsed, 3),
+        'lines_per_sec': round(lines / elapsed),
+        'mib_per_sec': round(size / elapsed / 1024 / 1024, 3),
+        'max_rss_kib': max(rss for _, rss in runs),
+    }
+    if not args.report:
+        result['ops'] = ops
+        result['ops_per_sec'] = round(ops / elapsed)
+        result['op_types'] = dict(op_types.most_common())
+    result['stats'] = {
+        'read_seconds': round(stats['read_seconds'], 3),
+        'sink_seconds': round(stats['sink_seconds'], 3),
+        'categories': {
+            category['category']: {
+                'count': category['count'],
+                'seconds': round(category['seconds'], 3),
+                'usec_per_line': category['usec_per_line'],
+            }
+            for category in stats['categories']
+        },
+        'unmatched': stats['unmatched'],
+        'errors': {error['message']: error['count'] for error in stats['errors']},
+        'tables': stats['tables'],
+    }
+    print(json.dumps(result, indent=2))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
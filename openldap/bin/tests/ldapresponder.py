@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+## -*- coding: utf-8 -*- vim:shiftwidth=4:expandtab:
+##
+## OpenLDAP: Minimal LDAP responder to test slapdstatsreplay.py
+##
+## SPDX-FileCopyrightText: 2025 SATOH Fumiyasu @ OSSTech Corp., Japan
+## SPDX-License-Identifier: GPL-3.0-or-later
+##
+## A stand-in for slapd with deterministic responses:
+##   BIND: success as anonymous or with a password in --password,
+##         invalidCredentials otherwise
+##   SEARCH: an entry named by the base DN and success
+##   COMPARE: compareTrue
+##   UNBIND: close the connection
+##
+
+import sys
+import os
+import argparse
+import asyncio
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from slapdstatsreplay import (  # noqa: E402
+    TAG_SEQUENCE,
+    TAG_ENUMERATED,
+    TAG_BIND_REQUEST,
+    TAG_BIND_RESPONSE,
+    TAG_UNBIND_REQUEST,
+    TAG_SEARCH_REQUEST,
+    TAG_SEARCH_RESULT_ENTRY,
+    TAG_SEARCH_RESULT_DONE,
+    TAG_COMPARE_REQUEST,
+    TAG_COMPARE_RESPONSE,
+    ber,
+    ber_decode,
+    ber_integer,
+    ber_string,
+)
+
+RESULT_SUCCESS = 0
+RESULT_COMPARE_TRUE = 6
+RESULT_INVALID_CREDENTIALS = 49
+
+
+def ldap_result(tag, result_code):
+    return ber(tag, ber_integer(result_code, TAG_ENUMERATED) + ber_string('') + ber_string(''))
+
+
+class LDAPResponder():
+    def __init__(self, passwords=()):
+        self.passwords = {password.encode('utf-8') for password in passwords}
+        self.connections = 0
+        self.requests = 0
+
+    async def read_message(self, reader):
+        header = await reader.readexactly(2)
+        length = header[1]
+        if length & 0x80:
+            length_bytes = await reader.readexactly(length & 0x7F)
+            length = int.from_bytes(length_bytes, 'big')
+        content = await reader.readexactly(length)
+
+        _, message_id, pos = ber_decode(content)
+        tag, op, _ = ber_decode(content, pos)
+
+        return int.from_bytes(message_id, 'big', signed=True), tag, op
+
+    def respond(self, tag, op):
+        """Return a list of response protocol ops or None to disconnect"""
+
+        if tag == TAG_BIND_REQUEST:
+            _, _, pos = ber_decode(op)  # version
+            _, _, pos = ber_decode(op, pos)  # name
+            _, password, _ = ber_decode(op, pos)
+            result_code = RESULT_SUCCESS if not password or password in self.passwords else RESULT_INVALID_CREDENTIALS
+            return [ldap_result(TAG_BIND_RESPONSE, result_code)]
+        if tag == TAG_SEARCH_REQUEST:
+            _, base, _ = ber_decode(op)
+            return [
+                ber(TAG_SEARCH_RESULT_ENTRY, ber_string(base) + ber(TAG_SEQUENCE, b'')),
+                ldap_result(TAG_SEARCH_RESULT_DONE, RESULT_SUCCESS),
+            ]
+        if tag == TAG_COMPARE_REQUEST:
+            return [ldap_result(TAG_COMPARE_RESPONSE, RESULT_COMPARE_TRUE)]
+
+        return None
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                message_id, tag, op = await self.read_message(reader)
+                self.requests += 1
+                if tag == TAG_UNBIND_REQUEST:
+                    break
+                responses = self.respond(tag, op)
+                if responses is None:
+                    break
+                for response in responses:
+                    writer.write(ber(TAG_SEQUENCE, ber_integer(message_id) + response))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def start(self, path):
+        return await asyncio.start_unix_server(self.handle, path)
+
+
+def main(argv):
+    args_parser = argparse.ArgumentParser(
+        prog=sys.argv[0],
+        add_help=True,
+        description='Minimal LDAP responder to test slapdstatsreplay.py',
+    )
+    args_parser.add_argument(
+        'socket', metavar='PATH',
+        help='UNIX domain socket path to listen on',
+    )
+    args_parser.add_argument(
+        '--password', metavar='PASSWORD',
+        action='append', default=[],
+        help='Password to accept for simple BINDs (multiple)',
+    )
+    args = args_parser.parse_args(argv)
+
+    async def serve():
+        server = await LDAPResponder(args.password).start(args.socket)
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+## -*- coding: utf-8 -*- vim:shiftwidth=4:expandtab:
+##
+## OpenLDAP: Generate an LMDB data.mdb like back-mdb with py-lmdb
+##
+## SPDX-FileCopyrightText: 2025 SATOH Fumiyasu @ OSSTech Corp., Japan
+## SPDX-License-Identifier: GPL-3.0-or-later
+##
+## Create DIR/data.mdb with back-mdb-like sub-DBs (entries, DN and
+## attribute indexes), delete some of the entries to leave free pages,
+## and print the statistics by py-lmdb as JSON to test db_size.py with.
+##
+
+import sys
+import argparse
+import json
+import random
+import struct
+
+import lmdb
+
+
+def mdb_stat(stat):
+    return {
+        'depth': stat['depth'],
+        'pages': stat['branch_pages'] + stat['leaf_pages'] + stat['overflow_pages'],
+        'overflow_pages': stat['overflow_pages'],
+        'entries': stat['entries'],
+    }
+
+
+def generate(path, entries, seed=0):
+    rng = random.Random(seed)
+    env = lmdb.open(path, map_size=64 * 1024 * 1024, max_dbs=16, subdir=True)
+    dbs = {
+        'id2e': env.open_db(b'id2e', integerkey=True),
+        'dn2i': env.open_db(b'dn2i', dupsort=True),
+        'objectClass': env.open_db(b'objectClass', dupsort=True, dupfixed=True),
+        'uid': env.open_db(b'uid', dupsort=True, dupfixed=True),
+        'cn': env.open_db(b'cn', dupsort=True, dupfixed=True),
+    }
+
+    batch = 500
+    for start in range(1, entries + 1, batch):
+        with env.begin(write=True) as txn:
+            for i in range(start, min(start + batch, entries + 1)):
+                entry_id = struct.pack('=Q', i)
+                ## Some entries are large enough for overflow pages
+                size = 5000 if i % 50 == 0 else rng.randrange(200, 1500)
+                txn.put(entry_id, rng.randbytes(size), db=dbs['id2e'])
+                txn.put(b'uid=user%d' % i, entry_id, db=dbs['dn2i'])
+                txn.put(b'oc%d' % (i % 5), entry_id, db=dbs['objectClass'])
+                txn.put(b'user%d' % i, entry_id, db=dbs['uid'])
+                txn.put(b'cn%d' % (i % 300), entry_id, db=dbs['cn'])
+
+    for start in range(1, entries + 1, batch * 3):
+        with env.begin(write=True) as txn:
+            for i in range(start, min(start + batch, entries + 1)):
+                txn.delete(struct.pack('=Q', i), db=dbs['id2e'])
+                txn.delete(b'user%d' % i, db=dbs['uid'])
+
+    with env.begin() as txn:
+        databases = {name: mdb_stat(txn.stat(db)) for name, db in dbs.items()}
+    stat = env.stat()
+    info = env.info()
+    env.close()
+
+    return {
+        'page_size': stat['psize'],
+        'map_size': info['map_size'],
+        'last_pgno': info['last_pgno'],
+        'txnid': info['last_txnid'],
+        'databases': {
+            '@main': mdb_stat(stat),
+            **databases,
+        },
+    }
+
+
+def main(argv):
+    args_parser = argparse.ArgumentParser(
+        prog=sys.argv[0],
+        add_help=True,
+        description='Generate an LMDB data.mdb like back-mdb with py-lmdb',
+    )
+    args_parser.add_argument(
+        'dir', metavar='DIR',
+        help='Directory to create data.mdb in',
+    )
+    args_parser.add_argument(
+        '--entries', metavar='N',
+        type=int, default=3000,
+        help='Number of entries (default: %(default)s)',
+    )
+    args_parser.add_argument(
+        '--seed', metavar='N',
+        type=int, default=0,
+        help='Random seed (default: %(default)s)',
+    )
+    args = args_parser.parse_args(argv)
+
+    print(json.dumps(generate(args.dir, args.entries, args.seed), indent=2))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
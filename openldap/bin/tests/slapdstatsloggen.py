@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+## -*- coding: utf-8 -*- vim:shiftwidth=4:expandtab:
+##
+## OpenLDAP: Generate synthetic slapd stats log for tests and benchmarks
+##
+## SPDX-FileCopyrightText: 2025 SATOH Fumiyasu @ OSSTech Corp., Japan
+## SPDX-License-Identifier: GPL-3.0-or-later
+##
+## The output is deterministic for the same options (and --seed).
+##
+
+import sys
+import argparse
+import random
+import heapq
+import datetime
+import calendar
+
+SUFFIX = 'dc=example,dc=jp'
+PEOPLE = 'ou=People,' + SUFFIX
+GROUPS = 'ou=Groups,' + SUFFIX
+SERVICE_DN = 'cn=nss,ou=Services,' + SUFFIX
+
+OID_STARTTLS = '1.3.6.1.4.1.1466.20037'
+OID_PASSMOD = '1.3.6.1.4.1.4203.1.11.1'
+OID_WHOAMI = '1.3.6.1.4.1.4203.1.11.3'
+
+## (weight, operation generator method name)
+op_weights = (
+    (70, 'search'),
+    (4, 'bind'),
+    (4, 'compare'),
+    (8, 'modify'),
+    (2, 'add'),
+    (1, 'delete'),
+    (1, 'modrdn'),
+    (2, 'passmod'),
+    (1, 'whoami'),
+)
+
+search_filters = (
+    ('(uid={uid})', None),
+    ('(&(objectClass=posixAccount)(uid={uid}))', None),
+    ('(|(cn={uid}*)(mail={uid}*))', ('substring', 'cn')),
+    ('(&(objectClass=groupOfNames)(member=uid={uid},' + PEOPLE + '))', None),
+    ('(mail=*@example.jp)', ('substring', 'mail')),
+    ('(objectClass=*)', None),
+    ## back-mdb evaluates `!` without indexes and does not log `not indexed`
+    ('(&(objectClass=posixAccount)(!(loginShell=/sbin/nologin)))', None),
+    ('(&(objectClass=posixAccount)(loginShell=/bin/false))', ('equality', 'loginShell')),
+    ('(description=*)', ('presence', 'description')),
+)
+search_attrs = (
+    None,
+    'uid cn mail',
+    'memberOf',
+    '1.1',
+    'uidNumber gidNumber homeDirectory loginShell',
+)
+
+
+class Generator():
+    def __init__(self, rng, start, iso=True, version='2.5', hostname='ldap1', pid=1234):
+        self.rng = rng
+        self.start = start
+        self.iso = iso
+        self.version = version
+        self.prefix = f' {hostname} slapd[{pid}]: '
+        self.events = []
+        self.event_n = 0
+        self.next_conn_id = 1000
+        self.last_search = None
+        self.free_fds = list(range(12, 65536))
+        self.closed_fds = []
+
+    def timestamp(self, t):
+        dt = self.start + datetime.timedelta(seconds=t)
+        if self.iso:
+            return dt.isoformat(timespec='microseconds')
+
+        return f'{calendar.month_abbr[dt.month]} {dt.day:2d} {dt.hour:02d}:{dt.minute:02d}:{dt.second:02d}'
+
+    def log(self, t, message):
+        heapq.heappush(self.events, (t, self.event_n, message))
+        self.event_n += 1
+
+    def etime(self, scale=0.001):
+        return self.rng.expovariate(1 / scale)
+
+    def result(self, t, conn, op_n, tag, err=0, etime=None, oid=False, nentries=None):
+        if etime is None:
+            etime = self.etime()
+        qtime = self.rng.expovariate(1 / 0.00002)
+        if self.version == '2.4':
+            times = ''
+        else:
+            times = f' qtime={qtime:.6f} etime={etime:.6f}'
+
+        if nentries is None:
+            tag_oid = ' oid=' if oid else f' tag={tag}'
+            self.log(t + etime, f'conn={conn} op={op_n} RESULT{tag_oid} err={err}{times} text=')
+        else:
+            self.log(t + etime, f'conn={conn} op={op_n} SEARCH RESULT tag={tag} err={err}{times} nentries={nentries} text=')
+
+        return t + etime
+
+    def uid(self):
+        return f'user{self.rng.randrange(10000):04d}'
+
+    def bind_simple(self, t, conn, op_n, dn):
+        self.log(t, f'conn={conn} op={op_n} BIND dn="{dn}" method=128')
+        if dn and self.rng.random() < 0.05:
+            return self.result(t, conn, op_n, 97, err=49)
+        if dn:
+            ssf = 'ssf=0' if self.version == '2.4' else 'bind_ssf=0 ssf=0'
+            self.log(t, f'conn={conn} op={op_n} BIND dn="{dn}" mech=SIMPLE {ssf}')
+        return self.result(t, conn, op_n, 97)
+
+    def bind_external(self, t, conn, op_n):
+        dn = 'gidNumber=0+uidNumber=0,cn=peercred,cn=external,cn=auth'
+        self.log(t, f'conn={conn} op={op_n} BIND dn="" method=163')
+        self.log(t, f'conn={conn} op={op_n} BIND authcid="{dn}" authzid="{dn}"')
+        ssf = 'sasl_ssf=71 ssf=71' if self.version == '2.4' else 'bind_ssf=71 ssf=71'
+        self.log(t, f'conn={conn} op={op_n} BIND dn="{dn}" mech=EXTERNAL {ssf}')
+        return self.result(t, conn, op_n, 97)
+
+    def op_bind(self, t, conn, op_n):
+        return self.bind_simple(t, conn, op_n, f'uid={self.uid()},{PEOPLE}')
+
+    def op_search(self, t, conn, op_n):
+        if self.last_search is not None and self.rng.random() < 0.3:
+            ## Clients often repeat the same search
+            base, scope, filter_str, attrs, not_indexed = self.last_search
+        else:
+            filter_format, not_indexed = self.rng.choice(search_filters)
+            scope = self.rng.choice((0, 1, 2, 2, 2))
+            base = PEOPLE if 'uid' in filter_format else SUFFIX
+            filter_str = filter_format.format(uid=self.uid())
+            attrs = self.rng.choice(search_attrs)
+            self.last_search = (base, scope, filter_str, attrs, not_indexed)
+        self.log(t, f'conn={conn} op={op_n} SRCH base="{base}" scope={scope} deref=0 filter="{filter_str}"')
+        if attrs:
+            self.log(t, f'conn={conn} op={op_n} SRCH attr={attrs}')
+        if not_indexed:
+            self.log(t, f'<= mdb_{not_indexed[0]}_candidates: ({not_indexed[1]}) not indexed')
+            etime = self.etime(0.05)
+        else:
+            etime = self.etime()
+        if self.rng.random() < 0.02:
+            return self.result(t, conn, op_n, 101, err=32, etime=etime, nentries=0)
+        return self.result(t, conn, op_n, 101, etime=etime, nentries=self.rng.choice((0, 1, 1, 1, 2, 10)))
+
+    def op_compare(self, t, conn, op_n):
+        self.log(t, f'conn={conn} op={op_n} CMP dn="cn=group{self.rng.randrange(100)},{GROUPS}" attr="member"')
+        return self.result(t, conn, op_n, 111, err=self.rng.choice((5, 6)))
+
+    def op_modify(self, t, conn, op_n):
+        self.log(t, f'conn={conn} op={op_n} MOD dn="uid={self.uid()},{PEOPLE}"')
+        self.log(t, f'conn={conn} op={op_n} MOD attr={self.rng.choice(("mail", "description", "mail telephoneNumber"))}')
+        return self.result(t, conn, op_n, 103, etime=self.etime(0.005))
+
+    def op_add(self, t, conn, op_n):
+        self.log(t, f'conn={conn} op={op_n} ADD dn="uid={self.uid()},{PEOPLE}"')
+        return self.result(t, conn, op_n, 105, err=self.rng.choice((0, 0, 0, 68)), etime=self.etime(0.005))
+
+    def op_delete(self, t, conn, op_n):
+        self.log(t, f'conn={conn} op={op_n} DEL dn="uid={self.uid()},{PEOPLE}"')
+        return self.result(t, conn, op_n, 107, err=self.rng.choice((0, 32)), etime=self.etime(0.005))
+
+    def op_modrdn(self, t, conn, op_n):
+        self.log(t, f'conn={conn} op={op_n} MODRDN dn="uid={self.uid()},{PEOPLE}"')
+        return self.result(t, conn, op_n, 109, etime=self.etime(0.005))
+
+    def op_passmod(self, t, conn, op_n):
+        self.log(t, f'conn={conn} op={op_n} EXT oid={OID_PASSMOD}')
+        passmod = self.rng.choice((f'PASSMOD id="uid={self.uid()},{PEOPLE}" new', 'PASSMOD old new', 'PASSMOD'))
+        self.log(t, f'conn={conn} op={op_n} {passmod}')
+        return self.result(t, conn, op_n, 120, oid=True, etime=self.etime(0.005))
+
+    def op_whoami(self, t, conn, op_n):
+        self.log(t, f'conn={conn} op={op_n} EXT oid={OID_WHOAMI}')
+        self.log(t, f'conn={conn} op={op_n} WHOAMI')
+        return self.result(t, conn, op_n, 120, oid=True)
+
+    def session(self, t, ops):
+        """Log a connection with up to ops operations and return (end time, number of operations)"""
+
+        rng = self.rng
+        conn = self.next_conn_id
+        self.next_conn_id += 1
+        while self.closed_fds and self.closed_fds[0][0] <= t:
+            heapq.heappush(self.free_fds, heapq.heappop(self.closed_fds)[1])
+        fd = heapq.heappop(self.free_fds)
+
+        kind = rng.choice(('ldap', 'ldap', 'ldap', 'starttls', 'ldaps', 'ldapi'))
+        if kind == 'ldapi':
+            self.log(t, f'conn={conn} fd={fd} ACCEPT from PATH=/var/run/ldapi (PATH=/var/run/ldapi)')
+        else:
+            port = 636 if kind == 'ldaps' else 389
+            self.log(t, f'conn={conn} fd={fd} ACCEPT from IP=192.0.2.{rng.randrange(1, 255)}:{rng.randrange(32768, 61000)} (IP=0.0.0.0:{port})')
+        if kind == 'ldaps':
+            self.log(t, f'conn={conn} fd={fd} TLS established tls_ssf=256 ssf=256 tls_proto=TLSv1.3 tls_cipher=TLS_AES_256_GCM_SHA384')
+
+        op_n = 0
+        n = 0
+        self.last_search = None
+        if kind == 'starttls':
+            self.log(t, f'conn={conn} op={op_n} EXT oid={OID_STARTTLS}')
+            self.log(t, f'conn={conn} op={op_n} STARTTLS')
+            t = self.result(t, conn, op_n, 120, oid=True)
+            self.log(t, f'conn={conn} fd={fd} TLS established tls_ssf=256 ssf=256 tls_proto=TLSv1.3 tls_cipher=TLS_AES_256_GCM_SHA384')
+            op_n += 1
+            n += 1
+
+        if kind == 'ldapi':
+            t = self.bind_external(t, conn, op_n)
+        elif rng.random() < 0.1:
+            t = self.bind_simple(t, conn, op_n, '')
+        elif rng.random() < 0.3:
+            t = self.bind_simple(t, conn, op_n, SERVICE_DN)
+        else:
+            t = self.op_bind(t, conn, op_n)
+        op_n += 1
+        n += 1
+
+        for _ in range(rng.randrange(1, 20)):
+            if n >= ops:
+                break
+            t += rng.expovariate(1 / 0.01)
+            name = rng.choices([name for _, name in op_weights], [w for w, _ in op_weights])[0]
+            t = getattr(self, 'op_' + name)(t, conn, op_n)
+            op_n += 1
+            n += 1
+
+        t += rng.expovariate(1 / 0.001)
+        if rng.random() < 0.9:
+            self.log(t, f'conn={conn} op={op_n} UNBIND')
+            self.log(t, f'conn={conn} fd={fd} closed')
+            n += 1
+        else:
+            self.log(t, f'conn={conn} fd={fd} closed (connection lost)')
+        heapq.heappush(self.closed_fds, (t, fd))
+
+        return t, n
+
+    def generate(self, ops, concurrency):
+        """Generate sessions until ops operations and yield log lines in time order"""
+
+        ## Start times of the concurrent clients
+        clients = [self.rng.uniform(0, 0.1) for _ in range(concurrency)]
+        heapq.heapify(clients)
+        n = 0
+        while n < ops:
+            t = heapq.heappop(clients)
+            ## Flush lines logged before any further session starts
+            while self.events and self.events[0][0] <= t:
+                t_event, _, message = heapq.heappop(self.events)
+                yield self.timestamp(t_event) + self.prefix + message + '\n'
+            t_end, session_ops = self.session(t, ops - n)
+            n += session_ops
+            heapq.heappush(clients, t_end + self.rng.expovariate(1 / 0.05))
+
+        while self.events:
+            t_event, _, message = heapq.heappop(self.events)
+            yield self.timestamp(t_event) + self.prefix + message + '\n'
+
+
+def main(argv):
+    args_parser = argparse.ArgumentParser(
+        prog=sys.argv[0],
+        add_help=True,
+        description='Generate synthetic slapd stats log',
+    )
+    args_parser.add_argument(
+        '--ops', metavar='N',
+        type=int, default=1000,
+        help='Number of operations (default: %(default)s)',
+    )
+    args_parser.add_argument(
+        '--concurrency', metavar='N',
+        type=int, default=10,
+        help='Number of concurrent clients (default: %(default)s)',
+    )
+    args_parser.add_argument(
+        '--legacy', action='store_true',
+        help='Use legacy syslog timestamps instead of ISO 8601',
+    )
+    args_parser.add_argument(
+        '--version', metavar='VERSION',
+        choices=('2.4', '2.5'), default='2.5',
+        help='OpenLDAP version of log format: 2.4 (no qtime/etime) or 2.5 (default: %(default)s)',
+    )
+    args_parser.add_argument(
+        '--start', metavar='TIME',
+        type=datetime.datetime.fromisoformat, default='2025-10-19T14:00:00+09:00',
+        help='Timestamp of the first line (default: %(default)s)',
+    )
+    args_parser.add_argument(
+        '--seed', metavar='N',
+        type=int, default=0,
+        help='Random seed (default: %(default)s)',
+    )
+    args = args_parser.parse_args(argv)
+
+    generator = Generator(
+        random.Random(args.seed),
+        args.start,
+        iso=not args.legacy,
+        version=args.version,
+    )
+    sys.stdout.writelines(generator.generate(args.ops, args.concurrency))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+## -*- coding: utf-8 -*- vim:shiftwidth=4:expandtab:
+##
+## OpenLDAP: Send slapd stats log lines as syslog messages
+##
+## SPDX-FileCopyrightText: 2025 SATOH Fumiyasu @ OSSTech Corp., Japan
+## SPDX-License-Identifier: GPL-3.0-or-later
+##
+## A syslog client to test `slapdstatslog2json.py --listen`.
+##
+
+import sys
+import os
+import argparse
+import socket
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import slapdstatslog2json  # noqa: E402
+
+PRI = '<166>'  # local4.info
+
+
+def line_to_message(line, syslog_format, hostname=True):
+    """Convert a syslog file line into an RFC 3164 or RFC 5424 message"""
+
+    line = line.rstrip('\n')
+    if line[:3].isalpha():
+        timestamp, rest = line[:15], line[16:]
+    else:
+        timestamp, rest = line.split(' ', 1)
+    host, rest = rest.split(' ', 1)
+    tag, msg = rest.split(': ', 1)
+
+    if syslog_format == '5424':
+        app, _, pid = tag[:-1].partition('[')
+        return f'{PRI}1 {timestamp} {host} {app} {pid} - - {msg}'
+
+    if not hostname:
+        return f'{PRI}{timestamp} {tag}: {msg}'
+
+    return f'{PRI}{line}'
+
+
+def main(argv):
+    args_parser = argparse.ArgumentParser(
+        prog=sys.argv[0],
+        add_help=True,
+        description='Send slapd stats log lines as syslog messages',
+    )
+    args_parser.add_argument(
+        'listen', metavar='URI',
+        type=slapdstatslog2json.parse_listen,
+        help='udp://[HOST:]PORT, tcp://[HOST:]PORT or unix://PATH',
+    )
+    args_parser.add_argument(
+        'file', metavar='FILE',
+        type=argparse.FileType('r'),
+        nargs='?', default=sys.stdin,
+        help='slapd stats log file (default: stdin)',
+    )
+    args_parser.add_argument(
+        '--format', metavar='FORMAT',
+        choices=('3164', '5424'), default='3164',
+        help='Syslog message format: 3164 or 5424 (default: %(default)s)',
+    )
+    args_parser.add_argument(
+        '--no-hostname', action='store_true',
+        help='Omit HOSTNAME in RFC 3164 messages like a local syslog(3) client',
+    )
+    args_parser.add_argument(
+        '--octet-counting', action='store_true',
+        help='Use octet-counting framing instead of LF for tcp (RFC 6587)',
+    )
+    args = args_parser.parse_args(argv)
+
+    scheme, address = args.listen
+    if scheme == 'tcp':
+        sock = socket.create_connection(address)
+    elif scheme == 'udp':
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.connect(address)
+    else:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.connect(address)
+
+    for line in args.file:
+        message = line_to_message(line, args.format, not args.no_hostname).encode('utf-8')
+        if scheme != 'tcp':
+            sock.send(message)
+        elif args.octet_counting:
+            sock.sendall(b'%d %s' % (len(message), message))
+        else:
+            sock.sendall(message + b'\n')
+    sock.close()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,416 @@
+#!/bin/bash
+##
+## Test db_size.py with an LMDB data.mdb generated by mdbgen.py (py-lmdb)
+##
+## py-lmdb is used if installed, otherwise extracted from the lmdb wheel
+## file $LMDB_WHEEL (for this Python and platform). The tests with data.mdb
+## are skipped without them.
+##
+
+set -u
+
+cd "${0%/*}" || exit $?
+
+export PATH="..:.:$PATH"
+
+rc=0
+
+tmp_dir=$(mktemp -d) || exit $?
+trap 'rm -rf "$tmp_dir"' EXIT
+
+echo "Test: db_size.linear_slope and db_size.days_until"
+python3 - <<'EOF' || rc=1
+import sys
+
+sys.path.insert(0, '..')
+from db_size import linear_slope, days_until
+
+
+def slope(points):
+    return linear_slope(
+        len(points),
+        sum(x for x, _ in points),
+        sum(x * x for x, _ in points),
+        sum(y for _, y in points),
+        sum(x * y for x, y in points),
+    )
+
+
+assert slope([(0, 10), (1, 12), (2, 14)]) == 2.0
+assert slope([(0, 10), (1, 11), (2, 14)]) == 2.0
+assert slope([(0, 10), (1, 8)]) == -2.0
+assert slope([(0, 10), (1, 10), (2, 10)]) == 0.0
+## A single sample or samples at the same time have no slope
+assert slope([(0, 10)]) is None
+assert slope([(1, 10), (1, 20)]) is None
+assert slope([]) is None
+
+assert days_until(100, 10) == 10.0
+assert days_until(100, 3) == 33.3
+assert days_until(100, None) is None
+assert days_until(100, 0.0) is None
+assert days_until(100, -1.0) is None
+assert days_until(0, 10) == 0.0
+assert days_until(-5, 10) == 0.0
+assert days_until(-5, 0.0) is None
+EOF
+
+echo "Test: db_size.History"
+python3 - "$tmp_dir" <<'EOF' || rc=1
+import sys
+import os
+
+sys.path.insert(0, '..')
+import db_size
+
+tmp_dir = sys.argv[1]
+day = 86400
+ts0 = 1_700_000_000
+mib = 1024 * 1024
+history = db_size.History(os.path.join(tmp_dir, 'history.sqlite'))
+
+
+def insert(path, day_n, size, free, map_size, disk_avail):
+    history.db.execute(
+        'INSERT INTO samples VALUES (?, ?, ?, ?, ?, ?)',
+        (history.path_id(path), ts0 + day_n * day, size, free, map_size, disk_avail),
+    )
+
+
+## Growing: size +10 MiB/day, free +1 MiB/day, disk -20 MiB/day
+for n in range(5):
+    insert('/growing/data.mdb', n, (100 + 10 * n) * mib, (5 + n) * mib, 500 * mib, (1000 - 20 * n) * mib)
+## Shrinking: used pages decrease and the disk has more space
+for n in range(3):
+    insert('/shrinking/data.mdb', n, 100 * mib, (10 + 5 * n) * mib, 500 * mib, (1000 + n) * mib)
+## Single sample
+insert('/single/data.mdb', 0, 100 * mib, 30 * mib, 500 * mib, 1000 * mib)
+## Old samples out of the window only
+insert('/old/data.mdb', -40, 100 * mib, 0, None, 1000 * mib)
+history.db.commit()
+
+forecasts = {f['path']: f for f in history.forecasts(ts0 - day, reclaim_ratio=0.2)}
+assert set(forecasts) == {'/growing/data.mdb', '/shrinking/data.mdb', '/single/data.mdb'}, forecasts.keys()
+
+f = forecasts['/growing/data.mdb']
+assert f['samples'] == 5, f
+assert f['first'] == ts0 and f['last'] == ts0 + 4 * day, f
+assert (f['size'], f['used'], f['free']) == (140 * mib, 131 * mib, 9 * mib), f
+assert f['size_per_day'] == 10 * mib, f
+assert f['used_per_day'] == 9 * mib, f
+assert f['free_per_day'] == 1 * mib, f
+assert f['fragmentation'] == round(9 / 131, 3), f
+assert f['disk_avail'] == 920 * mib, f
+assert f['disk_full_days'] == 46.0, f
+## (500 - 131) MiB at 9 MiB/day
+assert f['map_full_days'] == 41.0, f
+assert f['reclaim'] == 9 * mib, f
+assert f['reclaim_ratio'] == round(9 / 140, 3), f
+## free + 1t = 0.2 * (140 + 10t): free grows slower than 20% of size
+assert f['reclaim_days'] is None, f
+
+f = forecasts['/shrinking/data.mdb']
+assert f['used_per_day'] == -5 * mib, f
+assert f['map_full_days'] is None, f
+assert f['disk_full_days'] is None, f
+assert f['reclaim_ratio'] == 0.2 and f['reclaim_days'] == 0.0, f
+
+f = forecasts['/single/data.mdb']
+assert f['samples'] == 1, f
+for key in ('size_per_day', 'used_per_day', 'free_per_day', 'disk_full_days', 'map_full_days'):
+    assert f[key] is None, (key, f)
+assert f['reclaim_ratio'] == 0.3 and f['reclaim_days'] == 0.0, f
+assert history.forecasts(ts0 - day, reclaim_ratio=0.5)[2]['reclaim_days'] is None
+
+## Fragmentation grows: reclaim when free reaches 20% of size
+f = history.forecasts(ts0 - day, ['/shrinking/data.mdb'], reclaim_ratio=0.3)[0]
+## 20 + 5t = 0.3 * 100
+assert f['reclaim_days'] == 2.0, f
+
+## PATHs not in the history are ignored
+assert history.forecasts(ts0 - day, ['/unknown/data.mdb']) == []
+
+## Samples out of the window are pruned
+history.prune(ts0 - day)
+assert history.db.execute('SELECT count(*) FROM samples').fetchone()[0] == 9
+EOF
+
+## The tests below need py-lmdb to generate data.mdb
+if ! python3 -c 'import lmdb' 2>/dev/null; then
+  if [[ -z ${LMDB_WHEEL-} ]]; then
+    echo "$0: SKIP: No py-lmdb module installed and no LMDB_WHEEL given" 1>&2
+    exit "$rc"
+  fi
+  python3 -m zipfile -e "$LMDB_WHEEL" "$tmp_dir/lmdb" || exit $?
+  export PYTHONPATH="$tmp_dir/lmdb${PYTHONPATH:+:$PYTHONPATH}"
+  if ! python3 -c 'import lmdb' 2>/dev/null; then
+    echo "$0: SKIP: $LMDB_WHEEL is not for this Python or platform" 1>&2
+    exit "$rc"
+  fi
+fi
+
+mkdir "$tmp_dir/db1" "$tmp_dir/db2" || exit $?
+mdbgen.py "$tmp_dir/db1" >"$tmp_dir/db1.json" || exit $?
+mdbgen.py --entries 1000 --seed 1 "$tmp_dir/db2" >"$tmp_dir/db2.json" || exit $?
+
+echo "Test: db_size.py --json page counts against py-lmdb"
+db_size.py --json "$tmp_dir/db1" "$tmp_dir/db2" >"$tmp_dir/db_size.json" || rc=1
+python3 - "$tmp_dir" <<'EOF' || rc=1
+import sys
+import os
+import json
+
+tmp_dir = sys.argv[1]
+with open(os.path.join(tmp_dir, 'db_size.json')) as f:
+    report = json.load(f)
+
+assert [database['directory'] for database in report['databases']] == [
+    os.path.join(tmp_dir, 'db1'),
+    os.path.join(tmp_dir, 'db2'),
+], report['databases']
+
+for database in report['databases']:
+    with open(database['directory'] + '.json') as f:
+        expected = json.load(f)
+    [stats] = database['files']
+    assert stats['path'] == os.path.join(database['directory'], 'data.mdb'), stats['path']
+    assert stats['type'] == 'mdb', stats['type']
+    for key in ('page_size', 'map_size', 'last_pgno', 'txnid'):
+        assert stats[key] == expected[key], (key, stats[key], expected[key])
+    assert stats['size'] == (expected['last_pgno'] + 1) * expected['page_size'], stats['size']
+    assert stats['free'] == stats['free_pages'] * stats['page_size'], stats['free']
+    assert stats['free_pages'] > 0, 'No free pages after deletions'
+
+    for name, expected_db in expected['databases'].items():
+        db = stats['databases'][name]
+        for key, value in expected_db.items():
+            assert db[key] == value, (name, key, db[key], value)
+    assert set(stats['databases']) == {'@free', *expected['databases']}, stats['databases'].keys()
+
+    ## Every page is a meta page, a B-tree page or a free page
+    pages = sum(db['pages'] for db in stats['databases'].values())
+    assert 2 + pages + stats['free_pages'] == stats['last_pgno'] + 1, (pages, stats['free_pages'], stats['last_pgno'])
+
+    assert database['size'] == stats['size'], database
+    assert database['free'] == stats['free'], database
+    assert database['used'] == stats['size'] - stats['free'], database
+
+assert report['size'] == sum(database['size'] for database in report['databases']), report['size']
+assert report['free'] == sum(database['free'] for database in report['databases']), report['free']
+assert report['used'] == report['size'] - report['free'], report['used']
+EOF
+
+echo "Test: db_size.StatsCache"
+python3 - "$tmp_dir" <<'EOF' || rc=1
+import sys
+import os
+import json
+
+sys.path.insert(0, '..')
+import db_size
+
+tmp_dir = sys.argv[1]
+db_file = os.path.join(tmp_dir, 'db1', 'data.mdb')
+cache_file = os.path.join(tmp_dir, 'cache.json')
+
+cache = db_size.StatsCache(cache_file)
+stats = cache.collect(db_file)
+assert cache.hits == 0, cache.hits
+assert stats == db_size.collect(db_file)
+cache.save()
+
+## Unchanged: the statistics come from the saved cache
+cache = db_size.StatsCache(cache_file)
+assert cache.collect(db_file) == stats
+assert cache.hits == 1, cache.hits
+
+## Tamper with the cached statistics to tell hits from collections
+with open(cache_file) as f:
+    entry_by_path = json.load(f)
+entry_by_path[db_file]['stats']['free'] = -1
+with open(cache_file, 'w') as f:
+    json.dump(entry_by_path, f)
+cache = db_size.StatsCache(cache_file)
+assert cache.collect(db_file)['free'] == -1
+assert cache.hits == 1, cache.hits
+
+## Modified mtime: collected again
+st = os.stat(db_file)
+os.utime(db_file, ns=(st.st_atime_ns, st.st_mtime_ns + 1))
+assert cache.collect(db_file) == stats
+assert cache.hits == 1, cache.hits
+assert cache.collect(db_file) == stats
+assert cache.hits == 2, cache.hits
+
+## Modified size (with the same mtime): collected again
+cache.entry_by_path[db_file]['stats']['free'] = -1
+st = os.stat(db_file)
+with open(db_file, 'ab') as f:
+    f.write(b'\0' * stats['page_size'])
+os.utime(db_file, ns=(st.st_atime_ns, st.st_mtime_ns))
+assert cache.collect(db_file) == stats
+assert cache.hits == 2, cache.hits
+assert cache.entry_by_path[db_file]['file_size'] == st.st_size + stats['page_size']
+EOF
+
+echo "Test: db_size.StatsCache with threads and pruning"
+python3 - "$tmp_dir" <<'EOF' || rc=1
+import sys
+import os
+import json
+import concurrent.futures
+
+sys.path.insert(0, '..')
+import db_size
+
+tmp_dir = sys.argv[1]
+db_file = os.path.join(tmp_dir, 'db2', 'data.mdb')
+cache_file = os.path.join(tmp_dir, 'cache-threads.json')
+with open(cache_file, 'w') as f:
+    json.dump({'/removed/data.mdb': {'mtime_ns': 0, 'file_size': 0, 'stats': {}}}, f)
+
+cache = db_size.StatsCache(cache_file)
+stats = cache.collect(db_file)
+with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+    results = list(executor.map(cache.collect, [db_file] * 1000))
+assert all(result == stats for result in results)
+assert cache.hits == 1000, cache.hits
+cache.save()
+
+## Entries of files not collected are dropped
+with open(cache_file) as f:
+    assert list(json.load(f)) == [db_file]
+EOF
+
+echo "Test: db_size.mdb_stats maps the file again to retry"
+python3 - "$tmp_dir" <<'EOF' || rc=1
+import sys
+import os
+import mmap
+
+sys.path.insert(0, '..')
+import db_size
+
+tmp_dir = sys.argv[1]
+db_file = os.path.join(tmp_dir, 'db2', 'data.mdb')
+expected = db_size.mdb_stats(db_file)
+
+## Map only the meta pages at first as if the file grew after mapping it
+lengths = []
+mmap_orig = mmap.mmap
+
+
+def mmap_grown(fileno, length, **kwargs):
+    length = expected['page_size'] * 2 if not lengths else length
+    lengths.append(length)
+    return mmap_orig(fileno, length, **kwargs)
+
+
+mmap.mmap = mmap_grown
+try:
+    assert db_size.mdb_stats(db_file) == expected
+finally:
+    mmap.mmap = mmap_orig
+assert lengths == [expected['page_size'] * 2, 0], lengths
+EOF
+
+echo "Test: db_size.py --cache"
+db_size.py --json --cache "$tmp_dir/cache2.json" "$tmp_dir/db2" >"$tmp_dir/cache2-1.json" || rc=1
+db_size.py --json --cache "$tmp_dir/cache2.json" "$tmp_dir/db2" >"$tmp_dir/cache2-2.json" || rc=1
+cmp "$tmp_dir/cache2-1.json" "$tmp_dir/cache2-2.json" || rc=1
+
+echo "Test: db_size.py --history and --forecast"
+history="$tmp_dir/history2.sqlite"
+## db1/data.mdb has been modified by the StatsCache test
+db_size.py --json --history "$history" "$tmp_dir/db2" >/dev/null || rc=1
+db_size.py --json --history "$history" --forecast "$tmp_dir/db2" >"$tmp_dir/forecast.json" || rc=1
+python3 - "$tmp_dir" <<'EOF' || rc=1
+import sys
+import os
+import json
+
+tmp_dir = sys.argv[1]
+with open(os.path.join(tmp_dir, 'forecast.json')) as f:
+    [forecast] = json.load(f)
+with open(os.path.join(tmp_dir, 'db_size.json')) as f:
+    stats = json.load(f)['databases'][1]['files'][0]
+
+assert forecast['path'] == stats['path'], forecast
+assert forecast['samples'] == 1, forecast
+assert forecast['size'] == stats['size'] and forecast['free'] == stats['free'], forecast
+assert forecast['map_size'] == stats['map_size'], forecast
+assert forecast['size_per_day'] is None and forecast['map_full_days'] is None, forecast
+EOF
+
+echo "Test: db_size.py --indexes --filters"
+mkdir -p "$tmp_dir/slapd.d/cn=config" || exit $?
+cat <<'CONF_EOF' >"$tmp_dir/slapd.conf"
+database	mdb
+suffix		"dc=example,dc=jp"
+rootdn		"cn=admin,dc=example,dc=jp
+directory	/db2
+index		objectClass	eq
+index		uid		eq,pres
+index		cn
+  eq,sub
+CONF_EOF
+printf '%s\n' \
+  'dn: olcDatabase={1}mdb,cn=config' \
+  'olcDatabase: {1}mdb' \
+  'olcSuffix: dc=example,dc=jp' \
+  'olcDbDirectory: /db2' \
+  'olcDbIndex: objectClass  eq' \
+  $'olcDbIndex: uid\teq,pres' \
+  'olcDbIndex: cn eq,sub' \
+  >"$tmp_dir/slapd.d/cn=config/olcDatabase={1}mdb.ldif" \
+|| exit $?
+cat <<'JSON_EOF' >"$tmp_dir/filters.json"
+{
+  "searches": [
+    {"assertions": [["uid", "eq"], ["cn", "!eq"]], "count": 3},
+    {"assertions": [["objectclass", "!eq"], ["cn", "!sub"], ["uid", "pres"]], "count": 2}
+  ],
+  "indexes": []
+}
+JSON_EOF
+for config in slapd.conf slapd.d; do
+  db_size.py --json --indexes "$tmp_dir/$config" --root "$tmp_dir" --filters "$tmp_dir/filters.json" \
+    >"$tmp_dir/indexes.json" 2>"$tmp_dir/indexes.err" \
+  || rc=1
+  python3 - "$tmp_dir" "$config" <<'EOF' || rc=1
+import sys
+import os
+import json
+
+tmp_dir, config = sys.argv[1:]
+with open(os.path.join(tmp_dir, 'indexes.json')) as f:
+    [database] = json.load(f)
+with open(os.path.join(tmp_dir, 'indexes.err')) as f:
+    err = f.read()
+with open(os.path.join(tmp_dir, 'db2.json')) as f:
+    expected = json.load(f)
+
+if config == 'slapd.conf':
+    assert err.endswith(f'{os.path.join(tmp_dir, config)}:3: No closing quotation\n'), err
+else:
+    assert not err, err
+
+assert database['directory'] == os.path.join(tmp_dir, 'db2'), database
+index_by_attr = {index['attr']: index for index in database['indexes']}
+assert set(index_by_attr) == {'objectClass', 'uid', 'cn'}, index_by_attr.keys()
+for attr, index in index_by_attr.items():
+    assert index['pages'] == expected['databases'][attr]['pages'], (attr, index)
+    assert index['entries'] == expected['databases'][attr]['entries'], (attr, index)
+
+assert index_by_attr['uid']['types'] == ['eq', 'pres'], index_by_attr['uid']
+assert index_by_attr['uid']['searches'] == {'eq': 3, 'pres': 2}, index_by_attr['uid']
+assert index_by_attr['uid']['used'], index_by_attr['uid']
+## Negated assertions do not use indexes
+assert index_by_attr['objectClass']['searches'] == {'eq': 0}, index_by_attr['objectClass']
+assert index_by_attr['cn']['types'] == ['eq', 'sub'], index_by_attr['cn']
+assert index_by_attr['cn']['searches'] == {'eq': 0, 'sub': 0}, index_by_attr['cn']
+assert not index_by_attr['cn']['used'], index_by_attr['cn']
+EOF
+done
+
+exit "$rc"
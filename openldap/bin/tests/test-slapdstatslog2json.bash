@@ -0,0 +1,270 @@
+#!/bin/bash
+##
+## Compare slapdstatslog2json.py output with the golden files in data/
+##
+## data/stats-VERSION-FORMAT.log is generated by slapdstatsloggen.py.
+## To update the golden files after an intended output change:
+##
+##   ./test-slapdstatslog2json.bash --update
+##
+
+set -u
+
+cd "${0%/*}" || exit $?
+
+export PATH="..:.:$PATH"
+export TZ=UTC
+
+update=
+if [[ ${1-} == --update ]]; then
+  update=set
+fi
+
+rc=0
+
+tmp_dir=$(mktemp -d) || exit $?
+trap 'rm -rf "$tmp_dir"' EXIT
+
+check() {
+  local golden="$1"; shift
+
+  if [[ -n $update ]]; then
+    "$@" >"$golden"
+    return
+  fi
+
+  "$@" |diff -u "$golden" - || rc=1
+}
+
+for log in data/stats-*.log; do
+  name="${log%.log}"
+  version="${name#data/stats-}"
+  version="${version%%-*}"
+  gen_options=(--ops 200 --concurrency 8 --version "$version")
+  if [[ $name == *-legacy ]]; then
+    gen_options+=(--legacy)
+  fi
+
+  echo "Test: slapdstatsloggen.py ${log##*/}"
+  check "$log" slapdstatsloggen.py "${gen_options[@]}"
+
+  echo "Test: slapdstatslog2json.py ${log##*/}"
+  check "$name.json" slapdstatslog2json.py --year 2025 "$log"
+
+  for report in filters unindexed concurrency repeats; do
+    echo "Test: slapdstatslog2json.py --report $report ${log##*/}"
+    check "$name.$report.json" slapdstatslog2json.py --year 2025 --report "$report" "$log"
+  done
+
+  if [[ -n $update ]]; then
+    continue
+  fi
+
+  if [[ $name == *-legacy ]]; then
+    send_options=(--no-hostname)
+  else
+    send_options=(--format 5424)
+  fi
+  echo "Test: slapdstatslog2json.py --listen unix://... ${log##*/} (${send_options[*]})"
+  slapdstatslog2json.py --year 2025 --listen "unix://$tmp_dir/syslog.sock" >"$tmp_dir/listen.json" 2>/dev/null &
+  listen_pid="$!"
+  for ((i = 0; i < 50; i++)); do
+    [[ -S $tmp_dir/syslog.sock ]] && break
+    sleep 0.1
+  done
+  slapdstatslogsend.py "${send_options[@]}" "unix://$tmp_dir/syslog.sock" "$log"
+  for ((i = 0; i < 50; i++)); do
+    [[ $(wc -l <"$tmp_dir/listen.json") -ge $(wc -l <"$name.json") ]] && break
+    sleep 0.1
+  done
+  kill -TERM "$listen_pid"
+  wait "$listen_pid"
+  diff -u "$name.json" "$tmp_dir/listen.json" || rc=1
+  if [[ -e $tmp_dir/syslog.sock ]]; then
+    echo "$0: --listen did not remove the socket on exit" 1>&2
+    rc=1
+    rm -f "$tmp_dir/syslog.sock"
+  fi
+done
+
+echo "Test: slapdstatslog2json.py --listen unix://... refuses to replace a file"
+echo keep >"$tmp_dir/not-a-socket"
+slapdstatslog2json.py --listen "unix://$tmp_dir/not-a-socket" </dev/null >/dev/null 2>&1
+if [[ $? -ne 2 || $(<"$tmp_dir/not-a-socket") != keep ]]; then
+  echo "$0: --listen replaced a file that is not a socket" 1>&2
+  rc=1
+fi
+
+echo "Test: slapdstatslog2json.SyslogReceiver stops with a stream stalled on a full queue"
+timeout 10 python3 - <<'EOF' || rc=1
+import sys
+import socket
+import time
+
+sys.path.insert(0, '..')
+import slapdstatslog2json
+
+with socket.socket() as s:
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+receiver = slapdstatslog2json.SyslogReceiver(('tcp', ('127.0.0.1', port)), queue_size=1)
+receiver.start()
+sender = socket.create_connection(('127.0.0.1', port))
+for n in range(3):
+    sender.sendall(b'<167>Oct 19 14:00:0%d ldap1 slapd[1234]: conn=1000 fd=12 closed\n' % n)
+    time.sleep(0.3)
+lines = receiver.lines()
+assert next(lines).startswith('Oct 19 14:00:00 ldap1 '), 'No line received'
+assert receiver.stalls, 'The stream did not stall'
+receiver.stop()
+assert not receiver.thread.is_alive(), 'The receiver did not stop'
+sender.close()
+EOF
+
+## Operations queued for long (qtime) before their requests are logged
+log="data/qtime-starved.log"
+echo "Test: slapdstatslog2json.py --report concurrency --threads 2 ${log##*/}"
+check "${log%.log}.concurrency.json" slapdstatslog2json.py --year 2025 --report concurrency --threads 2 "$log"
+## Every line is JSON and the summary is the last one
+python3 -c '
+import json, sys
+rows = [json.loads(line) for line in open(sys.argv[1])]
+assert [row.get("type") for row in rows] == [None] * (len(rows) - 1) + ["summary"], rows
+' "${log%.log}.concurrency.json" || rc=1
+
+log="data/stats-2.5-iso.log"
+echo "Test: slapdstatslog2json.py --sample 0.25 ${log##*/}"
+check "${log%.log}.sample.json" slapdstatslog2json.py --year 2025 --sample 0.25 "$log"
+if [[ -z $update ]]; then
+  ## Connections are selected by CRC-32 of "HOSTNAME CONN_ID"
+  python3 - "$log" "${log%.log}.sample.json" <<'EOF' || rc=1
+import json, re, sys, zlib
+conns = {
+    int(m.group(2))
+    for m in re.finditer(r' (\S+) slapd\[\d+\]: conn=(\d+) ', open(sys.argv[1]).read())
+    if zlib.crc32(f'{m.group(1)} {m.group(2)}'.encode()) < 0.25 * 0x100000000
+}
+ops = [json.loads(line) for line in open(sys.argv[2])]
+assert conns and {op['conn'] for op in ops} == conns, (conns, {op['conn'] for op in ops})
+assert all(op['sample_weight'] == 4.0 for op in ops)
+EOF
+  echo "Test: slapdstatslog2json.py --sample 0.25 --report filters ${log##*/}"
+  slapdstatslog2json.py --year 2025 --sample 0.25 --report filters "$log" \
+  |python3 -c '
+import json, sys
+report = json.load(sys.stdin)
+assert report["sample_rate"] == 0.25 and report["sample_scaled"] is False, report
+' || rc=1
+fi
+
+## Table sizes are sampled every 4096 lines
+gen_options=(--ops 5000 --concurrency 8)
+echo "Test: slapdstatslog2json.py --stats FILE (${gen_options[*]})"
+slapdstatsloggen.py "${gen_options[@]}" >"$tmp_dir/stats.log"
+slapdstatslog2json.py --year 2025 --stats "$tmp_dir/stats.json" "$tmp_dir/stats.log" >/dev/null
+## Times are measured and not reproducible: keep the counters only
+check "data/stats-2.5-iso.stats.json" python3 -c '
+import json, sys
+stats = json.load(open(sys.argv[1]))
+print(json.dumps({
+    "lines": stats["lines"],
+    "ops": stats["ops"],
+    "categories": {
+        category["category"]: category["count"]
+        for category in sorted(stats["categories"], key=lambda category: category["category"])
+    },
+    "unmatched": stats["unmatched"],
+    "errors": {error["message"]: error["count"] for error in stats["errors"]},
+    "tables": stats["tables"],
+}, indent=2))
+' "$tmp_dir/stats.json"
+
+scrape() {
+  python3 -c '
+import sys, urllib.request
+sys.stdout.write(urllib.request.urlopen(sys.argv[1]).read().decode("utf-8"))
+' "$1" 2>/dev/null
+}
+
+log="data/stats-2.5-iso.log"
+echo "Test: slapdstatslog2json.py --serve ... ${log##*/}"
+port=$(python3 -c 'import socket; s = socket.socket(); s.bind(("127.0.0.1", 0)); print(s.getsockname()[1])')
+: >"$tmp_dir/serve.log"
+## Background commands ignore SIGINT: restore it to test Ctrl-C
+python3 -c 'import os, signal, sys; signal.signal(signal.SIGINT, signal.SIG_DFL); os.execvp(sys.argv[1], sys.argv[1:])' \
+  slapdstatslog2json.py --year 2025 --serve "127.0.0.1:$port" "$tmp_dir/serve.log" 2>"$tmp_dir/serve.err" &
+serve_pid="$!"
+for ((i = 0; i < 50; i++)); do
+  scrape "http://127.0.0.1:$port/metrics" >/dev/null && break
+  sleep 0.1
+done
+## Appended lines are followed
+cat "$log" >>"$tmp_dir/serve.log"
+ops=$(wc -l <"${log%.log}.json")
+for ((i = 0; i < 100; i++)); do
+  scrape "http://127.0.0.1:$port/metrics" >"$tmp_dir/metrics.txt"
+  [[ $(awk '/^slapd_operations_total/ { n += $NF } END { print n + 0 }' "$tmp_dir/metrics.txt") -ge $ops ]] && break
+  sleep 0.1
+done
+check "${log%.log}.metrics.txt" cat "$tmp_dir/metrics.txt"
+echo "Test: slapdstatslog2json.py --serve ... exits on SIGINT"
+kill -INT "$serve_pid"
+wait "$serve_pid" || { echo "$0: --serve exited with status $?" 1>&2; rc=1; }
+if grep -q Traceback "$tmp_dir/serve.err"; then
+  cat "$tmp_dir/serve.err" 1>&2
+  rc=1
+fi
+
+## Line numbers count from the seek offset with --since
+strip_line_n() {
+  python3 -c '
+import json, sys
+def strip(value):
+    if isinstance(value, dict):
+        return {k: strip(v) for k, v in value.items() if k != "line_n"}
+    if isinstance(value, list):
+        return [strip(v) for v in value]
+    return value
+for line in sys.stdin:
+    print(json.dumps(strip(json.loads(line))))
+'
+}
+
+## A log large enough to be bisected, with connections spanning the
+## --since time so that the window starts in the middle of connections
+for format in iso legacy; do
+  name="data/stats-2.5-$format"
+  gen_options=(--ops 5000 --concurrency 8)
+  if [[ $format == iso ]]; then
+    window_options=(--since 2025-10-19T14:00:10+09:00 --until 2025-10-19T14:00:11+09:00)
+  else
+    gen_options+=(--legacy)
+    window_options=(--since 2025-10-19T14:00:10 --until 2025-10-19T14:00:10)
+  fi
+  log="$tmp_dir/stats-window.log"
+  slapdstatsloggen.py "${gen_options[@]}" >"$log"
+
+  echo "Test: slapdstatslog2json.py ${window_options[*]} --warmup 2 (${gen_options[*]})"
+  check "$name.window.json" slapdstatslog2json.py --year 2025 "${window_options[@]}" --warmup 2 "$log"
+
+  if [[ -n $update ]]; then
+    continue
+  fi
+
+  echo "Test: slapdstatslog2json.py ${window_options[*]} --warmup 2 (${gen_options[*]}) <LOG"
+  slapdstatslog2json.py --year 2025 "${window_options[@]}" --warmup 2 <"$log" \
+  |strip_line_n \
+  >"$tmp_dir/window-linear.json"
+  strip_line_n <"$name.window.json" |diff -u "$tmp_dir/window-linear.json" - || rc=1
+
+  echo "Test: slapdstatslog2json.py ${window_options[*]} --warmup 0 (${gen_options[*]}) differs"
+  slapdstatslog2json.py --year 2025 "${window_options[@]}" --warmup 0 "$log" \
+  |strip_line_n \
+  >"$tmp_dir/window-nowarmup.json"
+  if cmp -s "$tmp_dir/window-linear.json" "$tmp_dir/window-nowarmup.json"; then
+    echo "No operations in connections started before --since" 1>&2
+    rc=1
+  fi
+done
+
+exit "$rc"
@@ -0,0 +1,181 @@
+#!/bin/bash
+##
+## Replay data/stats-2.5-iso.json against ldapresponder.py and compare the
+## report (without the measured latencies) with the golden file in data/
+##
+## To update the golden file after an intended output change:
+##
+##   ./test-slapdstatsreplay.bash --update
+##
+
+set -u
+
+cd "${0%/*}" || exit $?
+
+export PATH="..:.:$PATH"
+
+update=
+if [[ ${1-} == --update ]]; then
+  update=set
+fi
+
+rc=0
+
+tmp_dir=$(mktemp -d) || exit $?
+responder_pid=
+trap '[[ -n $responder_pid ]] && kill -TERM "$responder_pid"; rm -rf "$tmp_dir"' EXIT
+
+socket="$tmp_dir/ldapi"
+ldapresponder.py --password secret "$socket" &
+responder_pid="$!"
+for ((i = 0; i < 50; i++)); do
+  [[ -S $socket ]] && break
+  sleep 0.1
+done
+
+## The BINDs as this DN fail
+printf '%s\t%s\n' 'uid=user2513,ou=People,dc=example,dc=jp' 'wrong' >"$tmp_dir/passwords"
+
+## Latencies are measured and not reproducible: keep their keys only
+strip_latencies() {
+  python3 -c '
+import json, sys
+report = json.load(sys.stdin)
+del report["rebinds"]
+for op in report["ops"].values():
+    op["latency"] = sorted(op["latency"]) if op["latency"] else None
+    op["latency_to_etime_p50"] = type(op["latency_to_etime_p50"]).__name__
+print(json.dumps(report, indent=2))
+'
+}
+
+echo "Test: slapdstatsreplay.py stats-2.5-iso.json"
+golden="data/stats-2.5-iso.replay.json"
+slapdstatsreplay.py \
+  --uri "ldapi://${socket//\//%2F}" \
+  --speed 0 \
+  --bind-password secret \
+  --bind-passwords "$tmp_dir/passwords" \
+  data/stats-2.5-iso.json \
+|strip_latencies \
+>"$tmp_dir/replay.json" \
+|| rc=1
+if [[ -n $update ]]; then
+  cp "$tmp_dir/replay.json" "$golden"
+else
+  diff -u "$golden" "$tmp_dir/replay.json" || rc=1
+fi
+
+echo "Test: slapdstatsreplay.ConnectionPool.acquire with a failing rebind"
+python3 - "$tmp_dir/ldapi.pool" <<'EOF' || rc=1
+import sys
+import asyncio
+
+import ldapresponder
+
+sys.path.insert(0, '..')
+import slapdstatsreplay
+
+
+async def test(path):
+    responder = ldapresponder.LDAPResponder(['secret'])
+    server = await responder.start(path)
+    pool = slapdstatsreplay.ConnectionPool('ldapi://' + path.replace('/', '%2F'), 1)
+
+    try:
+        await pool.acquire('cn=bad', 'wrong')
+    except slapdstatsreplay.BindError as e:
+        assert e.result_code == ldapresponder.RESULT_INVALID_CREDENTIALS, e
+    else:
+        raise AssertionError('No BindError')
+    assert pool.rebind_errors == 1, pool.rebind_errors
+
+    ## The connection must be closed and the pool slot released
+    for _ in range(50):
+        if not responder.connections:
+            break
+        await asyncio.sleep(0.1)
+    assert responder.connections == 0, responder.connections
+    conn = await asyncio.wait_for(pool.acquire('cn=good', 'secret'), 5)
+    assert conn.dn == 'cn=good', conn.dn
+    pool.release(conn)
+    pool.close()
+    for _ in range(50):
+        if not responder.connections:
+            break
+        await asyncio.sleep(0.1)
+
+    server.close()
+    await server.wait_closed()
+
+
+asyncio.run(test(sys.argv[1]))
+EOF
+
+echo "Test: slapdstatsreplay.Replayer skips operations after BINDs not replayed"
+python3 - "$tmp_dir/ldapi.skip" <<'EOF' || rc=1
+import sys
+import asyncio
+
+import ldapresponder
+
+sys.path.insert(0, '..')
+import slapdstatsreplay
+
+
+def record(conn, op_type, error=0, **request):
+    return {
+        'conn': conn,
+        'op_type': op_type,
+        'op_request': {'timestamp': '2025-10-19T14:00:00+09:00', **request},
+        'op_result': {'error': error, 'etime': 0.0},
+    }
+
+
+def search(conn):
+    return record(conn, 'SEARCH', base='dc=example,dc=jp', scope='Base', deref='Never', filter='(objectClass=*)')
+
+
+records = [
+    ## SASL BIND: the identity is unknown
+    record(1, 'CONNECT'),
+    record(1, 'BIND', dn='', method='SASL', mech='EXTERNAL'),
+    *[search(1) for _ in range(5)],
+    record(1, 'BIND', dn='', method='Simple'),
+    search(1),
+    ## Successful simple BIND without a password
+    record(2, 'BIND', dn='cn=nopassword', method='Simple'),
+    search(2),
+    record(2, 'UNBIND'),
+    search(2),
+    ## Failed simple BIND without a password: anonymous in the log too
+    record(3, 'BIND', 49, dn='cn=nopassword', method='Simple'),
+    search(3),
+]
+
+
+async def test(path):
+    responder = ldapresponder.LDAPResponder()
+    server = await responder.start(path)
+    pool = slapdstatsreplay.ConnectionPool('ldapi://' + path.replace('/', '%2F'), 2)
+    replayer = slapdstatsreplay.Replayer(pool, speed=0, queue_size=1)
+    await replayer.run(records)
+
+    search_stats = replayer.stats_by_type['SEARCH']
+    assert (search_stats.count, search_stats.skipped) == (3, 6), vars(search_stats)
+    bind_stats = replayer.stats_by_type['BIND']
+    assert (bind_stats.count, bind_stats.skipped) == (1, 3), vars(bind_stats)
+    assert pool.rebinds == 0, pool.rebinds
+
+    for _ in range(50):
+        if not responder.connections:
+            break
+        await asyncio.sleep(0.1)
+    server.close()
+    await server.wait_closed()
+
+
+asyncio.run(test(sys.argv[1]))
+EOF
+
+exit "$rc"